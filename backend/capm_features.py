@@ -0,0 +1,139 @@
+"""
+CAPM Features Module
+
+This module holds the compact representation of the CAPM expected return
+features. Every expected_return_{n}d_{rate} column is fully determined by the
+beta of the ticker for interval n and the treasury yield of the date:
+
+    expected_return = rate + beta_n * (0.08 * n / 252 - rate)
+
+so instead of materializing 13 intervals x 6 rates = 78 columns in every row of
+every price data file, get_price_data.py stores one table of betas (one row per
+ticker, one column per interval) and one table of daily treasury yields. The
+features are expanded on demand, e.g. by the model data loader.
+
+Usage:
+    betas, treasury_yields = load_capm_inputs('price_data')
+    df = expand_capm_features(df, betas, treasury_yields)
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+BETAS_FILE = 'capm_betas.csv'
+YIELDS_FILE = 'capm_yields.csv'
+
+ANNUAL_MARKET_RETURN = 0.08
+TRADING_DAYS_PER_YEAR = 252
+
+def capm_feature_columns(betas, treasury_yields):
+    """
+    List the names of the expected return features, in the order they are expanded.
+
+    Args:
+        betas (pd.DataFrame): Betas with one row per interval and one column per ticker
+        treasury_yields (pd.DataFrame): Date plus one column of yields (as fractions) per rate
+
+    Returns:
+        list: Column names expected_return_{n}d_{rate}
+    """
+    rates = [column for column in treasury_yields.columns if column != 'Date']
+    return [f'expected_return_{n}d_{rate}' for n in betas.index for rate in rates]
+
+def expand_capm_features(df, betas, treasury_yields, ticker=None):
+    """
+    Add the CAPM expected return features to a frame of dated rows.
+
+    Each row uses the yields of the latest date of the table on or before its own.
+    The table stored by get_price_data.py has one row per trading day (NaN when no
+    yields were quoted), so rows on other dates get the values of the last trading
+    day, as the forward-filled price rows of the merged ticker data did. Rows
+    without a close price get NaN.
+
+    Args:
+        df (pd.DataFrame): Rows with a Date column, and a ticker column unless ticker is given
+        betas (pd.DataFrame): Betas with one row per interval and one column per ticker
+        treasury_yields (pd.DataFrame): Date plus one column of yields (as fractions) per rate,
+            one row per trading day
+        ticker (str, optional): Ticker of every row of df
+
+    Returns:
+        pd.DataFrame: df with the expected_return_{n}d_{rate} columns appended
+    """
+    rates = [column for column in treasury_yields.columns if column != 'Date']
+    dates = pd.to_datetime(df['Date']).to_numpy()
+
+    # merge_asof needs sorted keys, so look the yields up in date order
+    order = np.argsort(dates, kind='stable')
+    as_of = pd.merge_asof(
+        pd.DataFrame({'Date': dates[order]}),
+        treasury_yields.sort_values('Date'),
+        on='Date'
+    )
+    yields = np.empty((len(df), len(rates)))
+    yields[order] = as_of[rates].to_numpy(dtype=float)
+    if 'Close' in df.columns:
+        yields[df['Close'].isna().to_numpy()] = np.nan
+
+    if ticker is not None:
+        row_betas = np.tile(betas[ticker].to_numpy(dtype=float), (len(df), 1))
+    else:
+        row_betas = betas.reindex(columns=df['ticker']).to_numpy(dtype=float).T
+
+    features = {}
+    for i, n in enumerate(betas.index):
+        market_return_n = ANNUAL_MARKET_RETURN * (n / TRADING_DAYS_PER_YEAR)
+        for j, rate in enumerate(rates):
+            features[f'expected_return_{n}d_{rate}'] = yields[:, j] + row_betas[:, i] * (market_return_n - yields[:, j])
+
+    return pd.concat([df, pd.DataFrame(features, index=df.index)], axis=1)
+
+def save_capm_inputs(folder, betas, treasury_yields):
+    """
+    Store the betas and yields the features are expanded from.
+
+    Betas of tickers already stored in the folder but not in betas are kept, and so
+    are the yields of stored dates not in treasury_yields, so a run on a subset of
+    the tickers does not drop the trading days the other tickers look up.
+
+    Args:
+        folder (str): Folder of the price data files
+        betas (pd.DataFrame): Betas with one row per interval and one column per ticker
+        treasury_yields (pd.DataFrame): Date plus one column of yields (as fractions) per rate
+    """
+    betas_path = os.path.join(folder, BETAS_FILE)
+    yields_path = os.path.join(folder, YIELDS_FILE)
+    if os.path.exists(betas_path) and os.path.exists(yields_path):
+        stored_betas, stored_yields = load_capm_inputs(folder)
+        betas = pd.concat([stored_betas.drop(columns=betas.columns, errors='ignore'), betas], axis=1)
+        treasury_yields = treasury_yields.assign(Date=pd.to_datetime(treasury_yields['Date']))
+        # Yields of this run replace the stored ones of the same dates
+        stored_yields = stored_yields[~stored_yields['Date'].isin(treasury_yields['Date'])]
+        treasury_yields = pd.concat([stored_yields, treasury_yields], ignore_index=True)
+        treasury_yields = treasury_yields.sort_values('Date', kind='stable').reset_index(drop=True)
+
+    table = betas.T.rename(columns=lambda n: f'beta_{n}d')
+    table.index.name = 'ticker'
+    table.to_csv(betas_path)
+    treasury_yields.to_csv(yields_path, index=False)
+
+def load_capm_inputs(folder):
+    """
+    Load the betas and yields stored by save_capm_inputs.
+
+    Args:
+        folder (str): Folder of the price data files
+
+    Returns:
+        tuple: (betas with one row per interval and one column per ticker, treasury yields)
+
+    Raises:
+        FileNotFoundError: If the folder has no stored betas or yields
+    """
+    table = pd.read_csv(os.path.join(folder, BETAS_FILE), index_col='ticker')
+    betas = table.T
+    betas.index = [int(column[len('beta_'):-len('d')]) for column in table.columns]
+    treasury_yields = pd.read_csv(os.path.join(folder, YIELDS_FILE), parse_dates=['Date'])
+    return betas, treasury_yields
@@ -23,14 +23,19 @@ from pytorch_forecasting import TimeSeriesDataSet, TemporalFusionTransformer
 from pytorch_forecasting.metrics import MAE
 from pytorch_forecasting.data import TorchNormalizer
 
-def update_model(new_data_path, old_model_path, save_path):
+from capm_features import BETAS_FILE, expand_capm_features, load_capm_inputs
+from pipeline_storage import read_table_file
+
+def update_model(new_data_path, old_model_path, save_path, price_data_dir='price_data'):
     """
     Updates an existing TFT model with new financial data.
     
     Parameters:
-    new_data_path (str): Path to CSV file containing new financial data
+    new_data_path (str): Path to the parquet, feather or CSV file containing new financial data
     old_model_path (str): Path to the existing model checkpoint
     save_path (str): Path where the updated model will be saved
+    price_data_dir (str): Folder with the betas and treasury yields the CAPM
+                          expected return features are expanded from
     
     Returns:
     tuple: (Updated TFT model, PyTorch Lightning trainer)
@@ -55,9 +60,15 @@ def update_model(new_data_path, old_model_path, save_path):
         """
         # Add any necessary data preprocessing steps here
         # This should match your original preprocessing
+        
+        # The CAPM expected return features are stored as betas and yields
+        # and only expanded here, for the rows the model is trained on
+        has_capm_features = any(col.startswith('expected_return_') for col in df.columns)
+        if not has_capm_features and os.path.exists(os.path.join(price_data_dir, BETAS_FILE)):
+            df = expand_capm_features(df, *load_capm_inputs(price_data_dir))
         return df
     
-    new_df = pd.read_csv(new_data_path)
+    new_df = read_table_file(new_data_path)
     new_df = prepare_data(new_df)
     
     # 2. Split the new data
@@ -6,42 +6,169 @@ It provides functionality to:
 - Fetch historical stock data from Yahoo Finance
 - Calculate returns over various time horizons (2-24 months)
 - Compute beta coefficients against S&P 500 for different intervals
-- Calculate expected returns using CAPM model with multiple treasury rates
+- Store the betas and treasury yields the CAPM expected returns are expanded from
 - Compute covariance matrices at different time intervals
 - Process and clean price data for multiple S&P 500 stocks
 
 The module serves as a data preparation pipeline for portfolio optimization algorithms.
 """
 
-import finnhub
+import argparse
 import pandas as pd
 import datetime as dt   
-import yfinance as yf
-import statsmodels.api as sm
 import os
+import pickle
+import threading
 import traceback
 import time
+import json
 import numpy as np
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from capm_features import save_capm_inputs
+from online_covariance import RETURN_TYPES, interval_returns, update_covariances
+from pipeline_storage import DEFAULT_FORMAT, FORMATS, find_table, list_tables, read_table, read_table_file, write_table
 
 # Constants
 intervals = [50, 70, 100, 120, 150, 180, 200, 220, 250, 280, 300, 320, 350]
 treasury_rates = ['US3Y', 'US5Y', 'US7Y', 'US10Y', 'US20Y', 'US30Y']
 treasury_csv = 'treasury_yields.csv'
+treasury_start = '2009-01-01'
+
+# Intervals (in months) of the covariance matrices saved for portfolio optimization
+COV_MONTHS = (2, 3, 4, 5, 6, 8, 12)
+
+# Market data shared by every ticker of a run, see load_market_context:
+# treasury_yields holds Date plus the treasury_rates columns as fractions,
+# hist_sp500 holds the Date and Close of the S&P 500 index with naive dates
+MarketContext = namedtuple('MarketContext', ['treasury_yields', 'hist_sp500'])
+
+class YahooFinanceSource:
+    """
+    Data source that downloads daily price history from Yahoo Finance.
+    
+    Parameters:
+    start (str): First date of the history to download
+    """
+
+    def __init__(self, start="2009-01-01"):
+        import yfinance as yf
+        self.yf = yf
+        self.start = start
+
+    def history(self, ticker, start=None):
+        """
+        Downloads the daily price history of a ticker.
+        
+        Parameters:
+        ticker (str): The stock symbol to fetch data for
+        start (str, optional): First date to download, defaults to the source's start date
+        
+        Returns:
+        pd.DataFrame: Price history with a Date column
+        """
+        return self.yf.Ticker(ticker).history(start=start or self.start).reset_index()
+
+class FileDataSource:
+    """
+    Data source that reads price history from local tables (see pipeline_storage),
+    as a stand-in for Yahoo Finance in tests and offline runs.
+    
+    Parameters:
+    folder (str): Folder containing one table per ticker, in any storage format
+    name_pattern (str): Table name of a ticker, formatted with the ticker
+    """
+
+    def __init__(self, folder, name_pattern='{ticker}_price_data'):
+        self.folder = folder
+        self.name_pattern = name_pattern
+
+    def history(self, ticker, start=None):
+        """
+        Reads the price history of a ticker.
+        
+        Parameters:
+        ticker (str): The stock symbol to read data for
+        start (str, optional): First date to return
+        
+        Returns:
+        pd.DataFrame: Price history with Date, Open, High, Low, Close and Volume columns
+        """
+        df = read_table(self.folder, self.name_pattern.format(ticker=ticker),
+                        columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+        if start is not None:
+            df = df[df['Date'] >= pd.Timestamp(start)]
+        return df.reset_index(drop=True)
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls out to at most a given number per second.
+    
+    Parameters:
+    requests_per_second (float): Maximum call rate; None or 0 disables the limit
+    """
 
-def fetch_stock_data(ticker):
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def acquire(self):
+        """Blocks until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+def fetch_with_retry(fetch, ticker, rate_limiter=None, retries=3, backoff=1.0):
     """
-    Retrieves historical price data for a given stock ticker from Yahoo Finance.
+    Calls a fetch function, retrying with exponential backoff when it fails.
     
     Parameters:
+    fetch (callable): Function taking the ticker and returning its data
     ticker (str): The stock symbol to fetch data for
+    rate_limiter (RateLimiter): Limiter acquired before every attempt
+    retries (int): Number of retries after the first attempt
+    backoff (float): Delay in seconds before the first retry, doubled for every further retry
+    
+    Returns:
+    The result of fetch(ticker)
+    
+    Raises:
+    The exception of the last attempt if every attempt failed
+    """
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return fetch(ticker)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def fetch_stock_data(ticker, source=None, start=None):
+    """
+    Retrieves historical price data for a given stock ticker from a data source.
+    
+    Parameters:
+    ticker (str): The stock symbol to fetch data for
+    source: Data source with a history(ticker, start) method, defaults to YahooFinanceSource
+    start (str, optional): First date to fetch, defaults to the source's full history
     
     Returns:
     pd.DataFrame: DataFrame containing historical price data with columns:
                   Date, Open, High, Low, Close, Volume
     """
-    stock = yf.Ticker(ticker)
-    hist_data = stock.history(start="2009-01-01")
-    hist_data.reset_index(inplace=True)
+    if source is None:
+        source = YahooFinanceSource()
+    hist_data = source.history(ticker) if start is None else source.history(ticker, start=start)
+
+    if 'Date' not in hist_data.columns or hist_data.empty:
+        raise ValueError(f"No price history returned for {ticker}. Check data source.")
 
     hist_data['Date'] = pd.to_datetime(hist_data['Date']).dt.date
     hist_data.sort_values(by='Date', inplace=True)
@@ -49,12 +176,74 @@ def fetch_stock_data(ticker):
     
     return hist_data
 
-def calculate_horizon_returns(df):
+def load_treasury_yields(csv_path=treasury_csv, cache_path=None):
+    """
+    Loads the treasury yields used for the CAPM expected returns.
+    
+    The parsed yields are cached in a pickle next to the CSV file, tagged with the
+    size and modification time of the CSV, so later runs skip the date parsing
+    until the CSV changes.
+    
+    Parameters:
+    csv_path (str): Path of the treasury yields CSV (dates as day/month/year)
+    cache_path (str, optional): Path of the parsed cache, defaults to the CSV path with a .pkl extension
+    
+    Returns:
+    pd.DataFrame: Date and the treasury_rates columns as fractions, from treasury_start on
+    """
+    if cache_path is None:
+        cache_path = os.path.splitext(csv_path)[0] + '.pkl'
+    stat = os.stat(csv_path)
+    source_tag = (stat.st_size, stat.st_mtime_ns)
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['source'] == source_tag:
+            return cached['yields']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    treasury_yields = pd.read_csv(csv_path)
+    treasury_yields['Date'] = pd.to_datetime(treasury_yields['date'], format='%d/%m/%Y')
+    treasury_yields = treasury_yields[treasury_yields['Date'] > treasury_start]
+    treasury_yields = treasury_yields[['Date'] + treasury_rates].reset_index(drop=True)
+    treasury_yields[treasury_rates] = treasury_yields[treasury_rates] / 100.0
+
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump({'source': source_tag, 'yields': treasury_yields}, f)
+    os.replace(temp_path, cache_path)
+    return treasury_yields
+
+def load_market_context(source=None, treasury_path=treasury_csv, retries=3):
+    """
+    Loads the market data shared by all tickers of a run.
+    
+    Parameters:
+    source: Data source with a history(ticker) method, defaults to YahooFinanceSource
+    treasury_path (str): Path of the treasury yields CSV
+    retries (int): Retries after a failed download of the index history
+    
+    Returns:
+    MarketContext: Treasury yields and S&P 500 history
+    """
+    if source is None:
+        source = YahooFinanceSource()
+    hist_sp500 = fetch_with_retry(source.history, '^GSPC', retries=retries)
+    hist_sp500 = hist_sp500[['Date', 'Close']].copy()
+    hist_sp500['Date'] = pd.to_datetime(hist_sp500['Date']).dt.tz_localize(None)
+    return MarketContext(load_treasury_yields(treasury_path), hist_sp500)
+
+def calculate_horizon_returns(df, since=None):
     """
     Calculates forward-looking returns for multiple time horizons (2-24 months).
     
     Parameters:
     df (pd.DataFrame): DataFrame containing historical price data with 'Date' and 'Close' columns
+    since (pd.Timestamp, optional): Last date of a previous calculation on the same rows. Only rows
+        whose horizon date falls after it can have a different nearest future close, so only those
+        are recomputed and the existing values of earlier rows are kept.
     
     Returns:
     pd.DataFrame: Original dataframe enriched with future close prices and returns for each horizon
@@ -66,13 +255,70 @@ def calculate_horizon_returns(df):
 
     for horizon in horizons:
         target_dates = df.index + pd.DateOffset(months=horizon)
-        future_close = df['Close'].reindex(target_dates, method='nearest').values
-        df[f'future_close_{horizon}m'] = future_close
-        df[f'return_{horizon}m'] = (future_close / df['Close']) - 1
+        if since is None or f'return_{horizon}m' not in df.columns:
+            future_close = df['Close'].reindex(target_dates, method='nearest').values
+            df[f'future_close_{horizon}m'] = future_close
+            df[f'return_{horizon}m'] = (future_close / df['Close']) - 1
+        else:
+            affected = target_dates > since
+            future_close = df['Close'].reindex(target_dates[affected], method='nearest').values
+            df.loc[affected, f'future_close_{horizon}m'] = future_close
+            df.loc[affected, f'return_{horizon}m'] = (future_close / df['Close'].values[affected]) - 1
 
     df = df.reset_index()
     return df
 
+def compute_panel_betas(prices, hist_sp500, intervals):
+    """
+    Computes beta coefficients for many stocks against the S&P 500 at once.
+    
+    The close prices of all stocks are aligned with the S&P 500 on their common
+    dates into one (dates x tickers) panel. For every interval the n-day returns
+    of the panel and the index are formed with array slicing, and the OLS slope
+    with intercept is computed in closed form as cov(stock, index) / var(index)
+    over the dates where both returns are available. Missing prices are masked
+    per ticker, so each beta uses the same observations as a regression on that
+    ticker alone; a gap inside a ticker's history drops the returns spanning it.
+    
+    Parameters:
+    prices (pd.DataFrame): Close prices with dates as index and one column per ticker
+    hist_sp500 (pd.DataFrame): DataFrame containing S&P 500 index data
+    intervals (list): List of time intervals (in days) to compute betas for
+    
+    Returns:
+    pd.DataFrame: Betas with one row per interval and one column per ticker
+                  (NaN where fewer than two observations are available)
+    """
+    sp500_close = hist_sp500.set_index(pd.to_datetime(hist_sp500['Date']).dt.tz_localize(None))['Close']
+    prices = prices.set_axis(pd.to_datetime(prices.index).tz_localize(None), axis=0)
+    dates = prices.index.intersection(sp500_close.index).sort_values()
+    panel = prices.reindex(dates).to_numpy(dtype=float)
+    index = sp500_close.reindex(dates).to_numpy(dtype=float)
+
+    # Keep only dates with at least one stock price, as the per-ticker merge would
+    panel_dates = ~np.isnan(panel).all(axis=1)
+    panel, index = panel[panel_dates], index[panel_dates]
+
+    betas = np.full((len(intervals), panel.shape[1]), np.nan)
+    for i, n in enumerate(intervals):
+        if n >= len(index):
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stock_returns = panel[n:] / panel[:-n] - 1
+            index_returns = (index[n:] / index[:-n] - 1)[:, None]
+        mask = ~np.isnan(stock_returns) & ~np.isnan(index_returns)
+        count = mask.sum(axis=0)
+
+        x = np.where(mask, index_returns, 0.0)
+        y = np.where(mask, stock_returns, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_centered = np.where(mask, x - x.sum(axis=0) / count, 0.0)
+            y_centered = np.where(mask, y - y.sum(axis=0) / count, 0.0)
+            slope = (x_centered * y_centered).sum(axis=0) / (x_centered ** 2).sum(axis=0)
+        betas[i] = np.where(count > 1, slope, np.nan)
+
+    return pd.DataFrame(betas, index=list(intervals), columns=prices.columns)
+
 def compute_intervals_betas(df, hist_sp500, intervals):
     """
     Computes beta coefficients for a stock against the S&P 500 for various time intervals.
@@ -85,133 +331,223 @@ def compute_intervals_betas(df, hist_sp500, intervals):
     Returns:
     dict: Dictionary mapping time intervals to beta coefficients
     """
-    df['Date'] = pd.to_datetime(df['Date']).dt.tz_localize(None)
-    hist_sp500['Date'] = pd.to_datetime(hist_sp500['Date']).dt.tz_localize(None)
-
-    merged = pd.merge(
-        df[['Date', 'Close']],
-        hist_sp500[['Date', 'Close']],
-        on='Date',
-        how='inner',
-        suffixes=('_stock', '_sp500')
-    )
+    prices = df.set_index(pd.to_datetime(df['Date']).dt.tz_localize(None))[['Close']]
+    return compute_panel_betas(prices, hist_sp500, intervals)['Close'].to_dict()
 
-    betas = {}
-
-    for n in intervals:
-        merged[f'return_stock_{n}d'] = merged['Close_stock'].pct_change(n)
-        merged[f'return_sp500_{n}d'] = merged['Close_sp500'].pct_change(n)
-        
-        temp = merged.dropna(subset=[f'return_stock_{n}d', f'return_sp500_{n}d']).copy()
-        
-        if len(temp) > 1:
-            X = sm.add_constant(temp[f'return_sp500_{n}d'])
-            y = temp[f'return_stock_{n}d']
-            model = sm.OLS(y, X).fit()
-            betas[n] = model.params.iloc[1]
-        else:
-            betas[n] = np.nan
-
-    return betas
+def load_stored_price_data(ticker, output_folder='price_data'):
+    """
+    Reads the processed data of a ticker saved by an earlier run.
+    
+    Parameters:
+    ticker (str): The stock symbol to read data for
+    output_folder (str): Folder the processed tables are saved in
+    
+    Returns:
+    pd.DataFrame: Stored data with parsed dates, or None if there is none
+    """
+    file_path = find_table(output_folder, f"{ticker}_price_data")
+    if file_path is None:
+        return None
+    stored = read_table_file(file_path)
+    return stored if not stored.empty else None
 
-def compute_expected_returns_multiple_rates(df):
+def fetch_price_update(ticker, source, output_folder='price_data', rate_limiter=None, retries=3, backoff=1.0):
     """
-    Computes expected returns using CAPM model with multiple treasury rates.
+    Fetches the trading days a ticker's stored data is missing.
+    
+    The download starts at the last stored date, so the overlapping day can be
+    compared with the stored close. If it differs, past prices were adjusted
+    (e.g. for a dividend or split) and the full history is fetched instead. Both
+    downloads go through fetch_with_retry, so each acquires the rate limiter and
+    is retried on its own.
     
     Parameters:
-    df (pd.DataFrame): DataFrame containing stock price data
+    ticker (str): The stock symbol to fetch data for
+    source: Data source with a history(ticker, start) method
+    output_folder (str): Folder the processed tables are saved in
+    rate_limiter (RateLimiter): Limiter acquired before every download request
+    retries (int): Retries per download after a failed attempt
+    backoff (float): Delay in seconds before the first retry, doubled for every further retry
     
     Returns:
-    pd.DataFrame: Original dataframe enriched with expected returns for 
-                 different intervals and treasury rates
+    tuple: (stored data, price history since its last date), or (None, full price history)
+           when there is no usable stored data
+    """
+    stored = load_stored_price_data(ticker, output_folder)
+    if stored is not None:
+        start = stored['Date'].iloc[-1].strftime('%Y-%m-%d')
+        delta = fetch_with_retry(lambda ticker: fetch_stock_data(ticker, source, start=start), ticker,
+                                 rate_limiter, retries, backoff)
+        delta['Date'] = pd.to_datetime(delta['Date'])
+        overlap = stored[['Date', 'Close']].merge(delta[['Date', 'Close']], on='Date', suffixes=('', '_new'))
+        if not overlap.empty and np.allclose(overlap['Close'], overlap['Close_new'], rtol=1e-6):
+            return stored, delta
+        print(f"Stored prices of {ticker} no longer match the source, fetching the full history")
+    return None, fetch_with_retry(lambda ticker: fetch_stock_data(ticker, source), ticker,
+                                  rate_limiter, retries, backoff)
+
+def prepare_ticker_data(ticker, stored, df_price):
+    """
+    Computes the horizon returns of one ticker's downloaded price history.
     
-    Note:
-    This function assumes that hist_sp500 is available in global scope and
-    treasury_yields.csv exists in the working directory.
+    Without stored data the returns are computed for the full history. Otherwise the
+    new trading days are appended to the stored data and horizon returns are only
+    recomputed for rows whose forward window reaches past the previous last date.
+    Expected return columns of data stored by earlier versions are dropped, as the
+    features are now expanded on demand from the stored betas (see capm_features).
+    
+    Parameters:
+    ticker (str): The stock symbol the data belongs to
+    stored (pd.DataFrame): Stored data from load_stored_price_data, or None
+    df_price (pd.DataFrame): Full price history, or the history since the last stored date
+    
+    Returns:
+    tuple: (data with horizon returns, or None if the stored data is already up to date;
+            Date and close price series)
     """
-    annual_market_return = 0.08
-    trading_days_per_year = 252
-
-    treasury_yields = pd.read_csv("treasury_yields.csv")
-    treasury_yields['Date'] = pd.to_datetime(
-        treasury_yields['date'], infer_datetime_format=True, dayfirst=True
-    )
-    treasury_yields = treasury_yields[treasury_yields['Date'] > '2009-01-01']
-
-    betas = compute_intervals_betas(df, hist_sp500, intervals)
-
-    for rate in treasury_rates:
-        treasury_yields[rate] = treasury_yields[rate] / 100.0
-
-    df['Date'] = pd.to_datetime(df['Date'])
-    df = pd.merge(df, treasury_yields[['Date'] + treasury_rates], on='Date', how='left')
-
-    for n in intervals:
-        market_return_n = annual_market_return * (n / trading_days_per_year)
-        beta_n = betas.get(n, np.nan)
-
-        for rate_column in treasury_rates:
-            col_name = f'expected_return_{n}d_{rate_column}'
-            df[col_name] = df[rate_column] + beta_n * (market_return_n - df[rate_column])
-            
-    df.drop(axis=1, labels=['US3Y', 'US5Y', 'US7Y', 'US10Y', 'US20Y', 'US30Y'], inplace=True)
-
-    return df
+    if stored is None:
+        df = calculate_horizon_returns(df_price)
+        return df, df[['Date', 'Close']]
+
+    last_date = stored['Date'].iloc[-1]
+    new_rows = df_price[df_price['Date'] > last_date]
+    expected_columns = [column for column in stored.columns if column.startswith('expected_return_')]
+    if new_rows.empty:
+        print(f"Data for {ticker} is up to date")
+        return (stored.drop(columns=expected_columns) if expected_columns else None), stored[['Date', 'Close']]
+
+    df = pd.concat([stored.drop(columns=expected_columns), new_rows], ignore_index=True)
+    df = calculate_horizon_returns(df, since=last_date)
+    print(f"Adding {len(new_rows)} days for {ticker}")
+    return df, df[['Date', 'Close']]
+
+def save_ticker_data(ticker, df, output_folder='price_data', storage_format=DEFAULT_FORMAT):
+    """
+    Saves the processed data of one ticker.
+    
+    The prices are kept in float64: incremental refreshes recompute horizon returns
+    from the stored closes and must match a full rebuild.
+    
+    Parameters:
+    ticker (str): The stock symbol the data belongs to
+    df (pd.DataFrame): Data with horizon returns from prepare_ticker_data
+    output_folder (str): Folder the processed table is written to
+    storage_format (str): Storage format of the table, one of pipeline_storage.FORMATS
+    """
+    file_path = write_table(df, output_folder, f"{ticker}_price_data", storage_format)
+    print(f"Saved data for {ticker} to {file_path}")
 
-def get_price_data(tickers, all_close_prices):
+def get_price_data(tickers, all_close_prices, source=None, max_workers=8, requests_per_second=5,
+                   retries=3, backoff=1.0, output_folder='price_data', incremental=False, market=None,
+                   storage_format=DEFAULT_FORMAT):
     """
-    Processes data for multiple tickers, saving results to CSV files.
+    Processes data for multiple tickers, saving results to one table per ticker.
+    
+    Downloads run concurrently on a bounded thread pool behind a shared rate limiter,
+    with retries and exponential backoff. The horizon returns of each ticker are
+    computed and saved in the calling thread as soon as its download completes, so
+    that work overlaps with the downloads still in flight. At most twice max_workers
+    downloads are pending at any time. Once all downloads are done, the betas of
+    every ticker are estimated at once with compute_panel_betas and stored with the
+    treasury yields, from which capm_features expands the CAPM expected returns.
     
     Parameters:
     tickers (list): List of stock tickers to process
     all_close_prices (list): List to accumulate close price dataframes
+    source: Data source with a history(ticker) method, defaults to YahooFinanceSource
+    max_workers (int): Number of concurrent downloads
+    requests_per_second (float): Maximum rate of download requests; None disables the limit
+    retries (int): Retries per ticker after a failed download
+    backoff (float): Delay in seconds before the first retry, doubled for every further retry
+    output_folder (str): Folder the processed tables are written to
+    incremental (bool): Only fetch the days after each ticker's stored data and update it in place
+    market (MarketContext, optional): Market data from load_market_context, loaded from source if not given
+    storage_format (str): Storage format of the ticker tables, one of pipeline_storage.FORMATS
     
     Returns:
-    list: List of tickers that failed to process
+    list: List of tickers that failed to download or process
     
     Side effects:
-    - Saves processed data for each ticker to 'price_data/TICKER_price_data.csv'
-    - Appends price data to all_close_prices list
+    - Saves processed data for each ticker to 'price_data/TICKER_price_data' in storage_format
+    - Saves the betas and treasury yields to 'price_data/capm_betas.csv' and 'price_data/capm_yields.csv'
+    - Appends price data to all_close_prices list, in the order of tickers
     """
-    missing_tickers = []
-    for ticker in tickers:
-        print("processing data for ticker " + ticker)
-        df_price = fetch_stock_data(ticker)
-        df_price = calculate_horizon_returns(df_price)
-        df = compute_expected_returns_multiple_rates(df_price)
-        
-        if 'Date' not in df.columns:
-            missing_tickers.append(ticker)
-            raise ValueError(f"'Date' column missing in the DataFrame for {ticker}. Check data source.")
-
-        df['Date'] = pd.to_datetime(df['Date'])
-        prices_df = df[['Date', 'Close']].rename(columns={'Close': ticker})
-        all_close_prices.append(prices_df)
-
-        file_path = os.path.join('price_data', f"{ticker}_price_data.csv")
-        df.to_csv(file_path, index=False)
-        print(f"Saved data for {ticker} to {file_path}")
+    if source is None:
+        source = YahooFinanceSource()
+    if market is None:
+        market = load_market_context(source, retries=retries)
+    rate_limiter = RateLimiter(requests_per_second)
+    # Every download request, including the full-history refetch of an incremental
+    # update, acquires the shared limiter and is retried on its own
+    if incremental:
+        fetch = lambda ticker: fetch_price_update(ticker, source, output_folder, rate_limiter, retries, backoff)
+    else:
+        fetch = lambda ticker: (None, fetch_with_retry(lambda ticker: fetch_stock_data(ticker, source), ticker,
+                                                       rate_limiter, retries, backoff))
 
-    return missing_tickers
+    missing_tickers = []
+    close_prices = {}
+    remaining = iter(tickers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            ticker = next(remaining, None)
+            if ticker is not None:
+                pending[executor.submit(fetch, ticker)] = ticker
+
+        for _ in range(2 * max_workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = pending.pop(future)
+                submit_next()
+                print("processing data for ticker " + ticker)
+                try:
+                    df, close_prices[ticker] = prepare_ticker_data(ticker, *future.result())
+                    if df is not None:
+                        save_ticker_data(ticker, df, output_folder, storage_format)
+                except Exception as e:
+                    print(f"Failed to process {ticker}: {e}")
+                    missing_tickers.append(ticker)
+                    close_prices.pop(ticker, None)
+
+    # Estimate the betas of all tickers together on one aligned panel of close prices
+    if close_prices:
+        close_panel = pd.DataFrame({
+            ticker: close.set_index(pd.to_datetime(close['Date']))['Close'] for ticker, close in close_prices.items()
+        })
+        betas = compute_panel_betas(close_panel, market.hist_sp500, intervals)
+        # Yields on the trading days only, so later dates look up the last trading day
+        trading_day_yields = pd.DataFrame({'Date': close_panel.index}).merge(market.treasury_yields, on='Date', how='left')
+        save_capm_inputs(output_folder, betas, trading_day_yields)
+
+    all_close_prices.extend(
+        close_prices[ticker].assign(Date=pd.to_datetime(close_prices[ticker]['Date'])).rename(columns={'Close': ticker})
+        for ticker in tickers if ticker in close_prices
+    )
+    return [ticker for ticker in tickers if ticker in missing_tickers]
 
 def clean_price_data(folder_path: str):
     """
-    Cleans price data by removing rows with NaN values from CSV files.
+    Cleans price data by removing rows with NaN values from the ticker tables.
     
     Parameters:
-    folder_path (str): Path to the folder containing price data CSV files
+    folder_path (str): Path to the folder containing price data tables
     
     Side effects:
-    Overwrites each CSV file with a cleaned version (NaN values removed)
+    Overwrites each table, in its own format, with a cleaned version (NaN values removed)
     """
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith('.csv'):
-            file_path = os.path.join(folder_path, file_name)
-            print(f"Processing {file_name}...")
-            df = pd.read_csv(file_path)
-            cleaned_df = df.dropna()
-            cleaned_df.to_csv(file_path, index=False)
-            print(f"Cleaned {file_name} and saved to {file_path}")
+    for name in list_tables(folder_path, '_price_data'):
+        file_path = find_table(folder_path, name)
+        print(f"Processing {os.path.basename(file_path)}...")
+        df = read_table_file(file_path)
+        cleaned_df = df.dropna()
+        storage_format = next(fmt for fmt in FORMATS if file_path.endswith(fmt))
+        write_table(cleaned_df, folder_path, name, storage_format)
+        print(f"Cleaned {name} and saved to {file_path}")
 
 def custom_fill(df):
     """
@@ -227,66 +563,131 @@ def custom_fill(df):
     - Values before first valid observation are filled with 0
     - Remaining missing values are filled using forward fill
     """
-    for col in df.columns:
-        first_valid_index = df[col].first_valid_index()
-        if first_valid_index:
-            df.loc[:first_valid_index, col] = df.loc[:first_valid_index, col].fillna(0)
-        else:
-            df[col] = df[col].fillna(0)
-        df[col] = df[col].fillna(method='ffill')
-    return df
+    # After a forward fill only the values before the first valid observation are missing
+    return df.ffill().fillna(0)
 
-def compute_cov(prices_df: pd.DataFrame, interval: str = '2M') -> pd.DataFrame:
+def returns_cov(resampled_prices: pd.DataFrame, return_type: str = 'simple') -> pd.DataFrame:
+    """
+    Compute the covariance matrix of the returns between consecutive rows of a price panel.
+    
+    Non-positive prices, such as the zeros custom_fill puts before a ticker's first
+    price, are treated as missing (see online_covariance.interval_returns). Each pair of tickers uses the periods where both
+    have a return, as DataFrame.cov does, computed for all pairs at once with
+    matrix products of the masked returns.
+    
+    Parameters:
+    resampled_prices (pd.DataFrame): Prices with one row per period and one column per ticker
+    return_type (str): 'simple' for p1 / p0 - 1 or 'log' for log(p1 / p0)
+    
+    Returns:
+    pd.DataFrame: Covariance matrix of returns of the tickers with more than one price,
+                  0 for pairs with fewer than two common returns
+    """
+    # Drop tickers (columns) with insufficient data
+    valid_tickers = resampled_prices.columns[resampled_prices.count() > 1]
+    returns = interval_returns(resampled_prices[valid_tickers].to_numpy(dtype=float), return_type)
+    mask = ~np.isnan(returns)
+    weights = mask.astype(float)
+    returns = np.where(mask, returns, 0.0)
+    # Centering on each ticker's mean leaves the covariances unchanged but avoids cancellation
+    with np.errstate(invalid='ignore'):
+        centered = np.where(mask, returns - returns.sum(axis=0) / weights.sum(axis=0), 0.0)
+
+    count = weights.T @ weights
+    sums = centered.T @ weights  # sums[i, j]: sum of returns of i over the periods shared with j
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (centered.T @ centered - sums * sums.T / count) / (count - 1)
+    cov = np.where(count > 1, cov, 0.0)
+    return pd.DataFrame(cov, index=valid_tickers, columns=valid_tickers)
+
+def compute_cov(prices_df: pd.DataFrame, interval: str = '2ME', return_type: str = 'simple') -> pd.DataFrame:
     """
     Compute the covariance matrix of asset returns.
     
     Parameters:
     prices_df (pd.DataFrame): DataFrame containing price data with dates as index.
-    interval (str): Resampling interval (e.g., '2M' for 2 months, 'W' for weekly).
+    interval (str): Resampling interval (e.g., '2ME' for 2 months, 'W' for weekly).
                     Uses pandas offset aliases: 
                     - 'W' for weekly
-                    - 'M' for monthly
-                    - '3M' for quarterly
+                    - 'ME' for monthly
+                    - '3ME' for quarterly
                     - '2W' for bi-weekly
                     etc.
+    return_type (str): 'simple' or 'log' returns
     
     Returns:
     pd.DataFrame: Covariance matrix of returns.
     """
     # Resample according to the specified interval (take the last price in each period)
-    resampled_prices = prices_df.resample(interval).last()
+    return returns_cov(prices_df.resample(interval).last(), return_type)
+
+def compute_monthly_covs(prices_df: pd.DataFrame, months=COV_MONTHS, return_type: str = 'simple') -> dict:
+    """
+    Compute the covariance matrices of asset returns over several month intervals at once.
     
-    # Drop tickers (columns) with insufficient data
-    valid_tickers = resampled_prices.columns[resampled_prices.count() > 1]
-    resampled_prices = resampled_prices[valid_tickers]
+    The daily prices are resampled to month ends once, and the prices of every
+    n-month interval are taken from those monthly prices instead of resampling the
+    daily panel again. The bins are the ones of prices_df.resample(f'{n}ME'): the
+    first ends at the first month end and each later one spans n months.
     
-    # Compute returns for the specified interval
-    returns = resampled_prices.pct_change().dropna(how='all')
+    Parameters:
+    prices_df (pd.DataFrame): DataFrame containing price data with dates as index.
+    months (iterable): Lengths of the intervals in months
+    return_type (str): 'simple' or 'log' returns
     
-    # Compute and return the covariance matrix
-    cov_matrix = returns.cov()
-    cov_matrix.fillna(0, inplace=True)
-    return cov_matrix
+    Returns:
+    dict: Covariance matrix of returns (pd.DataFrame) per number of months
+    """
+    monthly_prices = prices_df.resample('ME').last()
+    positions = np.arange(len(monthly_prices))
+    covs = {}
+    for n in months:
+        bins = (positions + n - 1) // n
+        covs[n] = returns_cov(monthly_prices.groupby(bins).last(), return_type)
+    return covs
 
 if __name__ == "__main__":
     # Main execution block for processing S&P 500 stock data
     # This loads S&P 500 constituents, fetches their price data, computes returns
     # and covariances at different intervals, and saves the results
     
+    parser = argparse.ArgumentParser(description="Download price data and compute returns and covariances.")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent downloads.")
+    parser.add_argument("--rate", type=float, default=5, help="Maximum download requests per second.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per ticker after a failed download.")
+    parser.add_argument("--source-dir", default=None,
+                        help="Read price history from {ticker}_price_data tables in this folder instead of Yahoo Finance.")
+    parser.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT,
+                        help="Storage format of the price data tables.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch the days after the data stored in price_data and update it in place.")
+    parser.add_argument("--returns", choices=RETURN_TYPES, default='simple',
+                        help="Returns the covariance matrices are computed from.")
+    parser.add_argument("--cov-state", default=None,
+                        help="Folder of the covariance accumulators; only periods completed since the last run are folded in.")
+    parser.add_argument("--cov-decay", type=float, default=None,
+                        help="Weight factor per period of age of the returns in the covariances, in (0, 1].")
+    parser.add_argument("--cov-window", type=int, default=None,
+                        help="Number of most recent returns the covariances are computed from.")
+    args = parser.parse_args()
+
     url = 'constituents.csv'
     companies_sp500 = pd.read_csv(url)
     tickers = companies_sp500['Symbol'].tolist()
     
+    import finnhub
     api_key = "your_api_key_here"
     finnhub_client = finnhub.Client(api_key=api_key)
     
-    sp500_index = yf.Ticker('^GSPC')
-    hist_sp500 = sp500_index.history(start="2009-01-01")
-    hist_sp500 = hist_sp500.reset_index()
-    hist_sp500['Date'] = pd.to_datetime(hist_sp500['Date']).dt.tz_localize(None)
+    source = FileDataSource(args.source_dir) if args.source_dir else YahooFinanceSource()
+    market = load_market_context(source, retries=args.retries)
 
     all_close_prices = []
-    missing = get_price_data(tickers, all_close_prices)
+    missing = get_price_data(tickers, all_close_prices, source=source, max_workers=args.workers,
+                             requests_per_second=args.rate, retries=args.retries,
+                             incremental=args.incremental, market=market, storage_format=args.format)
+    if missing:
+        print(f"Failed to process {len(missing)} tickers: {', '.join(missing)}")
     
     prices_df = pd.concat(
         [df.set_index('Date') for df in all_close_prices], axis=1
@@ -294,29 +695,20 @@ if __name__ == "__main__":
     
     prices_df = custom_fill(prices_df)
     
-    # Computing covariance matrices at different time intervals
-    two_month_cov = compute_cov(prices_df, '2M')  
-    three_month_cov = compute_cov(prices_df, '3M')  
-    four_month_cov = compute_cov(prices_df, '4M')  
-    five_month_cov = compute_cov(prices_df, '5M')  
-    six_month_cov = compute_cov(prices_df, '6M')  
-    eight_month_cov = compute_cov(prices_df, '8M')  
-    twelve_month_cov = compute_cov(prices_df, '12M')  
-
-    # Reset index for saving
-    two_month_cov.reset_index(inplace=True)
-    three_month_cov.reset_index(inplace=True)
-    four_month_cov.reset_index(inplace=True)
-    five_month_cov.reset_index(inplace=True)
-    six_month_cov.reset_index(inplace=True)
-    eight_month_cov.reset_index(inplace=True)
-    twelve_month_cov.reset_index(inplace=True)
-
-    # Save covariance matrices as NumPy files
-    np.save('cov_2month.npy', two_month_cov.to_numpy())
-    np.save('cov_3month.npy', three_month_cov.to_numpy())
-    np.save('cov_4month.npy', four_month_cov.to_numpy())
-    np.save('cov_5month.npy', five_month_cov.to_numpy())
-    np.save('cov_6month.npy', six_month_cov.to_numpy())
-    np.save('cov_8month.npy', eight_month_cov.to_numpy())
-    np.save('cov_12month.npy', twelve_month_cov.to_numpy())
\ No newline at end of file
+    # Computing covariance matrices at different time intervals, either updating the saved
+    # accumulators with the periods completed since the last run or from one monthly resampling
+    if args.cov_state or args.cov_decay is not None or args.cov_window is not None:
+        covs = update_covariances(prices_df, COV_MONTHS, args.returns, args.cov_state,
+                                  args.cov_decay, args.cov_window)
+    else:
+        covs = compute_monthly_covs(prices_df, COV_MONTHS, args.returns)
+
+    # Save covariance matrices as numeric NumPy files, with the ticker of each row in a manifest
+    cov_manifest = {}
+    for months, cov in covs.items():
+        file_name = f'cov_{months}month.npy'
+        np.save(file_name, cov.to_numpy(dtype=float))
+        cov_manifest[file_name] = cov.index.tolist()
+
+    with open('cov_manifest.json', 'w') as f:
+        json.dump(cov_manifest, f)
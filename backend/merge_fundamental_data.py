@@ -1,81 +1,204 @@
 """
 Merge Fundamental Data Module
 
-This module consolidates fundamental financial data for stock tickers from multiple 
-source folders into unified CSV files. It leverages a pre-filtered mapping of tickers 
-to locate and merge all available fundamental data files for each ticker across 
+This module consolidates fundamental financial data for stock tickers from multiple
+source folders into unified CSV files. It leverages a pre-filtered mapping of tickers
+to locate and merge all available fundamental data files for each ticker across
 various categories (earnings, balance sheets, cash flow, etc.)
 
 The main processing steps are:
 1. Load a pre-filtered ticker mapping from JSON configuration
-2. Identify all relevant fundamental data subfolders
-3. For each ticker, find and merge all its associated files across subfolders
+2. Index the files of all relevant fundamental data subfolders by ticker in one scan
+3. For each ticker, merge all its associated files across subfolders in one date-indexed join
 4. Filter data to include only records from January 1, 2009 onward
-5. Save consolidated data to individual ticker files
+5. Save consolidated data to individual ticker tables (see pipeline_storage)
+
+Tickers are merged in parallel across a process pool.
 
 Usage:
     Run this script directly to process all tickers defined in filtered_mapping.json
-    and output consolidated data files to the Merged_Fundamental_Data directory.
+    and output consolidated data files to the Merged_Fundamental_Data directory:
+    python merge_fundamental_data.py --mapping backend/filtered_mapping.json --format parquet
 """
 
+import argparse
+import json
 import os
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+
 import pandas as pd
-import json
 
-# Load filtered_mapping from filtered_mapping.json
-filtered_mapping_file = r"C:\Users\adeeb\Desktop\portfolio-recommendation-master\Portfolio-Managment-Recommendation-System\backend\filtered_mapping.json"
-with open(filtered_mapping_file, "r") as f:
-    # This JSON file contains a mapping of tickers that have passed filtering criteria
-    filtered_mapping = json.load(f)
+from pipeline_storage import DEFAULT_FORMAT, FORMATS, write_table
 
 # Define directories
-base_dir = "backend"
-fundamental_data_dir = os.path.join(base_dir, "Fundamental_data")
-output_dir = os.path.join(base_dir, "Merged_Fundamental_Data")
-os.makedirs(output_dir, exist_ok=True)
+BASE_DIR = "backend"
+MAPPING_FILE = os.path.join(BASE_DIR, "filtered_mapping.json")
+FUNDAMENTAL_DATA_DIR = os.path.join(BASE_DIR, "Fundamental_data")
+OUTPUT_DIR = os.path.join(BASE_DIR, "Merged_Fundamental_Data")
 
 # Exclude certain folders that aren't needed or would cause issues with merging
-# "market_cap_updated" and "stock_splits_updated" are excluded as they may have 
+# "market_cap_updated" and "stock_splits_updated" are excluded as they may have
 # different data structures or aren't required for the fundamental analysis
-subfolders = [
-    os.path.join(fundamental_data_dir, folder)
-    for folder in os.listdir(fundamental_data_dir)
-    if os.path.isdir(os.path.join(fundamental_data_dir, folder)) and folder != "market_cap_updated" and folder != "stock_splits_updated"
-]
-
-# Process each ticker
-for ticker, _ in filtered_mapping:
-    merged_data = None
-
-    # Iterate through subfolders to find relevant files
-    for subfolder in subfolders:
+EXCLUDED_FOLDERS = ("market_cap_updated", "stock_splits_updated")
+
+# This standardizes the time period across all tickers
+START_DATE = "2009-01-01"
+
+def load_filtered_mapping(mapping_path=MAPPING_FILE):
+    """
+    Load the tickers that have passed the filtering criteria.
+
+    Args:
+        mapping_path (str): Path of the JSON file with [ticker, name] pairs
+
+    Returns:
+        list: Tickers in the order of the mapping
+    """
+    with open(mapping_path, "r") as f:
+        filtered_mapping = json.load(f)
+    return [ticker for ticker, _ in filtered_mapping]
+
+def build_file_index(fundamental_data_dir=FUNDAMENTAL_DATA_DIR, excluded_folders=EXCLUDED_FOLDERS):
+    """
+    Index the fundamental data files of all subfolders by ticker in a single scan.
+
+    A file belongs to a ticker if its name starts with "{ticker}_" and ends with ".csv",
+    so each file is indexed under every prefix of its name that ends before an underscore.
+
+    Args:
+        fundamental_data_dir (str): Folder containing one subfolder per data category
+        excluded_folders (tuple): Subfolders to skip
+
+    Returns:
+        dict: Ticker to list of file paths, in subfolder and directory listing order
+    """
+    file_index = defaultdict(list)
+    for folder in os.listdir(fundamental_data_dir):
+        subfolder = os.path.join(fundamental_data_dir, folder)
+        if not os.path.isdir(subfolder) or folder in excluded_folders:
+            continue
         for file_name in os.listdir(subfolder):
-            # Look for files that start with this ticker's symbol
-            if file_name.startswith(f"{ticker}_") and file_name.endswith(".csv"):
-                file_path = os.path.join(subfolder, file_name)
-                
-                # Read the CSV file
-                data = pd.read_csv(file_path, parse_dates=["Date"])
-
-                # Filter rows with Date >= 01-01-2009
-                # This standardizes the time period across all tickers
-                data = data[data["Date"] >= "2009-01-01"]
-
-                # Merge data
-                if merged_data is None:
-                    # For first file found, just initialize the merged_data
-                    merged_data = data
-                else:
-                    # For subsequent files, merge with existing data
-                    # Using outer merge to preserve all dates from both datasets
-                    merged_data = pd.merge(merged_data, data, on="Date", how="outer")
-
-    # Save merged data for the ticker
-    if merged_data is not None:
-        output_file = os.path.join(output_dir, f"{ticker}_fundamental_data.csv")
-        merged_data.to_csv(output_file, index=False)
-        print(f"Saved: {output_file}")
-    else:
-        print(f"No data found for ticker: {ticker}")
-
-print("Processing completed.")
+            if not file_name.endswith(".csv"):
+                continue
+            file_path = os.path.join(subfolder, file_name)
+            separator = file_name.find("_")
+            while separator != -1:
+                file_index[file_name[:separator]].append(file_path)
+                separator = file_name.find("_", separator + 1)
+    return dict(file_index)
+
+def read_fundamental_file(file_path, start_date=START_DATE):
+    """
+    Read one fundamental data file, keeping the records from start_date onward.
+
+    Args:
+        file_path (str): Path of the CSV file
+        start_date (str): First date to keep
+
+    Returns:
+        pandas.DataFrame: Data of the file
+    """
+    data = pd.read_csv(file_path, parse_dates=["Date"])
+    return data[data["Date"] >= start_date]
+
+def merge_fundamental_files(file_paths, start_date=START_DATE):
+    """
+    Merge the fundamental data files of one ticker on their dates.
+
+    The files are joined at once on a Date index, which keeps all dates of all files as
+    a chain of outer merges would without copying the growing frame once per file. Files
+    with repeated dates or column names that clash with another file are merged with
+    pd.merge instead, which pairs repeated dates and suffixes clashing columns.
+
+    Args:
+        file_paths (list): Paths of the CSV files of the ticker
+        start_date (str): First date to keep
+
+    Returns:
+        pandas.DataFrame: Merged data sorted by date, or None if there are no files
+    """
+    frames = [read_fundamental_file(file_path, start_date) for file_path in file_paths]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+
+    indexed = [data.set_index("Date") for data in frames]
+    columns = [column for data in indexed for column in data.columns]
+    if all(data.index.is_unique for data in indexed) and len(set(columns)) == len(columns):
+        merged_data = pd.concat(indexed, axis=1, join="outer", sort=True)
+        return merged_data.rename_axis("Date").reset_index()
+
+    merged_data = frames[0]
+    for data in frames[1:]:
+        merged_data = pd.merge(merged_data, data, on="Date", how="outer")
+    return merged_data
+
+def process_ticker(ticker, file_paths, output_dir=OUTPUT_DIR, storage_format=DEFAULT_FORMAT, start_date=START_DATE,
+                   float32=False):
+    """
+    Merge and save the fundamental data of one ticker.
+
+    Args:
+        ticker (str): Ticker symbol
+        file_paths (list): Paths of the CSV files of the ticker
+        output_dir (str): Folder of the merged tables
+        storage_format (str): Storage format of the merged table, one of pipeline_storage.FORMATS
+        start_date (str): First date to keep
+        float32 (bool): Store the float columns as float32 in the columnar formats
+
+    Returns:
+        str: Path of the saved table, or None if the ticker has no data
+    """
+    merged_data = merge_fundamental_files(file_paths, start_date)
+    if merged_data is None:
+        return None
+    return write_table(merged_data, output_dir, f"{ticker}_fundamental_data", storage_format, float32=float32)
+
+def merge_all_tickers(mapping_path=MAPPING_FILE, fundamental_data_dir=FUNDAMENTAL_DATA_DIR, output_dir=OUTPUT_DIR,
+                      storage_format=DEFAULT_FORMAT, n_processes=None, float32=False):
+    """
+    Merge the fundamental data of every ticker of the filtered mapping.
+
+    Args:
+        mapping_path (str): Path of the filtered ticker mapping
+        fundamental_data_dir (str): Folder containing one subfolder per data category
+        output_dir (str): Folder of the merged tables
+        storage_format (str): Storage format of the merged tables, one of pipeline_storage.FORMATS
+        n_processes (int, optional): Number of worker processes
+        float32 (bool): Store the float columns as float32 in the columnar formats
+
+    Returns:
+        dict: Path of the saved table per ticker, None for tickers without data
+    """
+    tickers = load_filtered_mapping(mapping_path)
+    file_index = build_file_index(fundamental_data_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+
+    tasks = [(ticker, file_index.get(ticker, []), output_dir, storage_format, START_DATE, float32) for ticker in tickers]
+    with Pool(processes=n_processes) as pool:
+        output_files = pool.starmap(process_ticker, tasks)
+
+    results = dict(zip(tickers, output_files))
+    for ticker, output_file in results.items():
+        if output_file is not None:
+            print(f"Saved: {output_file}")
+        else:
+            print(f"No data found for ticker: {ticker}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the fundamental data files of each ticker.")
+    parser.add_argument("--mapping", default=MAPPING_FILE, help="Path of the filtered ticker mapping JSON file.")
+    parser.add_argument("--input-dir", default=FUNDAMENTAL_DATA_DIR, help="Folder with one subfolder of fundamental data files per category.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Folder of the merged tables.")
+    parser.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="Storage format of the merged tables.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--float32", action="store_true", help="Store the float columns as float32 in the columnar formats.")
+    args = parser.parse_args()
+
+    merge_all_tickers(args.mapping, args.input_dir, args.output_dir, args.format, args.processes, args.float32)
+    print("Processing completed.")
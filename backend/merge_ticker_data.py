@@ -9,23 +9,32 @@ missing values with the most recent available data.
 The main processing steps for each ticker are:
 1. Load price and fundamental data files
 2. Create a complete timeline with all dates from both sources
-3. For each date, fill missing data with values from the closest previous date
-4. Save the merged data to a CSV file
+3. Fill dates without price data from the closest previous price date (backward as-of join)
+4. Save the merged data to a table (see pipeline_storage)
 
 Usage:
     Run this script directly to process all matching tickers in the price_data and
     Merged_fundamental_Data folders, saving results to the specified output folder.
 """
 
+import argparse
 import pandas as pd
-import os
 from pathlib import Path
 
+from pipeline_storage import (DEFAULT_FORMAT, FORMATS, find_table, list_tables, read_table, read_table_file,
+                              table_file_columns, write_table)
+
+# Price columns that are not merged; all others, including any stored CAPM
+# expected return columns, are carried into the merged data
+DROPPED_PRICE_COLUMNS = ["Open", "future_close_2m", "future_close_3m", "future_close_4m",
+                         "future_close_5m", "future_close_6m", "future_close_8m", "future_close_12m",
+                         "future_close_18m", "future_close_24m", "return_18m", "return_24m"]
+
 def load_and_prepare_data(price_path, fundamental_path, ticker):
     """
     Load and prepare price and fundamental data for a given ticker.
     
-    This function loads both datasets, removes unneeded columns from the price data,
+    This function loads both datasets, skipping the DROPPED_PRICE_COLUMNS of the price data,
     converts date columns to datetime format, and ensures both datasets are sorted by date.
     
     Args:
@@ -36,15 +45,14 @@ def load_and_prepare_data(price_path, fundamental_path, ticker):
     Returns:
         tuple: A tuple containing (price_df, fundamental_df)
     """
-    # Load both datasets
-    price_df = pd.read_csv(f"{price_path}/{ticker}_price_data.csv")
-    fundamental_df = pd.read_csv(f"{fundamental_path}/{ticker}_fundamental_data.csv")
-
-    columns = ["Open", "future_close_2m", "future_close_3m", "future_close_4m",
-               "future_close_5m", "future_close_6m", "future_close_6m", 
-               "future_close_8m", "future_close_12m", "future_close_18m", 
-               "future_close_24m", "return_18m", "return_24m"]
-    price_df.drop(columns=columns, inplace=True)
+    # Load both datasets, reading only the price columns that are merged
+    price_name = f"{ticker}_price_data"
+    price_table = find_table(price_path, price_name)
+    if price_table is None:
+        raise FileNotFoundError(f"No table {price_name} in {price_path}")
+    price_columns = [col for col in table_file_columns(price_table) if col not in DROPPED_PRICE_COLUMNS]
+    price_df = read_table_file(price_table, price_columns)
+    fundamental_df = read_table(fundamental_path, f"{ticker}_fundamental_data")
     
     # Convert date columns to datetime
     price_df['Date'] = pd.to_datetime(price_df['Date'])
@@ -60,75 +68,84 @@ def load_and_prepare_data(price_path, fundamental_path, ticker):
     
     return price_df, fundamental_df
 
-def find_closest_previous_date(target_date, available_dates):
-    """
-    Find the closest previous date from available_dates for a target_date.
-    Returns None if no previous date exists.
-    """
-    previous_dates = available_dates[available_dates <= target_date]
-    if len(previous_dates) == 0:
-        return None
-    return previous_dates.max()
-
 def merge_ticker_data(price_df, fundamental_df):
     """
     Merge price and fundamental data with specific handling of missing dates.
+    
+    The timeline holds every date of both datasets. Dates without price data take
+    the price row of the closest previous date, found with one backward as-of join
+    over the sorted timeline, so each ticker merges in linear time.
+    
+    Args:
+        price_df (pandas.DataFrame): Price data sorted by date
+        fundamental_df (pandas.DataFrame): Fundamental data
+        
+    Returns:
+        pandas.DataFrame: Merged data with one row per date
     """
-    # Create a complete set of dates from both dataframes
-    all_dates = pd.Series(pd.concat([price_df['Date'], fundamental_df['Date']]).unique()).sort_values()
-    
-    # Create a template dataframe with all dates
-    merged_df = pd.DataFrame({'Date': all_dates})
-    
-    # Merge with price data
-    merged_df = merged_df.merge(price_df, on='Date', how='left')
-    
-    # For each date in the merged dataframe
-    for idx, row in merged_df.iterrows():
-        if pd.isna(merged_df.loc[idx, price_df.columns[1]]):  # Check if price data is missing
-            # Find closest previous date in price data
-            closest_date = find_closest_previous_date(row['Date'], price_df['Date'])
-            if closest_date is not None:
-                # Fill with closest previous price data
-                price_row = price_df[price_df['Date'] == closest_date].iloc[0]
-                for col in price_df.columns[1:]:  # Skip date column
-                    merged_df.loc[idx, col] = price_row[col]
+    # Create a complete, sorted timeline with all dates from both dataframes
+    all_dates = pd.concat([price_df['Date'], fundamental_df['Date']]).drop_duplicates().sort_values()
+    timeline = pd.DataFrame({'Date': all_dates.reset_index(drop=True)})
+    
+    # Dates without price data take the closest previous price row
+    merged_df = pd.merge_asof(timeline, price_df.sort_values('Date'), on='Date', direction='backward')
+    
+    # Keep the dtypes of a left join, which turns integer columns into floats when dates are missing
+    if not timeline['Date'].isin(price_df['Date']).all():
+        integer_columns = [col for col in price_df.columns[1:] if pd.api.types.is_integer_dtype(price_df[col])]
+        merged_df = merged_df.astype({col: float for col in integer_columns})
     
     # Merge with fundamental data
     merged_df = merged_df.merge(fundamental_df, on='Date', how='left')
     
     return merged_df
 
-def process_all_tickers(price_data_folder, fundamental_data_folder, output_folder):
+def process_ticker(ticker, price_data_folder, fundamental_data_folder, output_folder, storage_format=DEFAULT_FORMAT,
+                   float32=False):
+    """
+    Merge and save the price and fundamental data of one ticker.
+    
+    Args:
+        ticker (str): Ticker symbol to process
+        price_data_folder (str): Folder of the price data tables
+        fundamental_data_folder (str): Folder of the fundamental data tables
+        output_folder (str): Folder of the merged tables
+        storage_format (str): Storage format of the merged table, one of pipeline_storage.FORMATS
+        float32 (bool): Store the float columns as float32 in the columnar formats
+        
+    Returns:
+        str: Path of the merged table
+    """
+    # Load and prepare data
+    price_df, fundamental_df = load_and_prepare_data(
+        price_data_folder,
+        fundamental_data_folder,
+        ticker
+    )
+    
+    # Merge data
+    merged_df = merge_ticker_data(price_df, fundamental_df)
+    
+    # Save merged data
+    return write_table(merged_df, output_folder, f"{ticker}_merged_data", storage_format, float32=float32)
+
+def process_all_tickers(price_data_folder, fundamental_data_folder, output_folder, storage_format=DEFAULT_FORMAT,
+                        float32=False):
     """
     Process all matching tickers in both folders.
     """
     # Create output folder if it doesn't exist
     Path(output_folder).mkdir(parents=True, exist_ok=True)
     
-    # Get list of tickers from price data files
-    price_files = os.listdir(price_data_folder)
-    tickers = [f.replace('_price_data.csv', '') for f in price_files if f.endswith('_price_data.csv')]
+    # Get list of tickers from price data tables
+    tickers = [name[:-len('_price_data')] for name in list_tables(price_data_folder, '_price_data')]
     
     # Process each ticker
     for ticker in tickers:
         # Check if fundamental data exists for this ticker
-        fundamental_file = f"{ticker}_fundamental_data.csv"
-        if os.path.exists(os.path.join(fundamental_data_folder, fundamental_file)):
+        if find_table(fundamental_data_folder, f"{ticker}_fundamental_data") is not None:
             try:
-                # Load and prepare data
-                price_df, fundamental_df = load_and_prepare_data(
-                    price_data_folder,
-                    fundamental_data_folder,
-                    ticker
-                )
-                
-                # Merge data
-                merged_df = merge_ticker_data(price_df, fundamental_df)
-                
-                # Save merged data
-                output_path = os.path.join(output_folder, f"{ticker}_merged_data.csv")
-                merged_df.to_csv(output_path, index=False)
+                process_ticker(ticker, price_data_folder, fundamental_data_folder, output_folder, storage_format, float32)
                 print(f"Successfully processed {ticker}")
                 
             except Exception as e:
@@ -138,8 +155,13 @@ def process_all_tickers(price_data_folder, fundamental_data_folder, output_folde
 
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the price and fundamental data of each ticker.")
+    parser.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="Storage format of the merged tables.")
+    parser.add_argument("--float32", action="store_true", help="Store the float columns as float32 in the columnar formats.")
+    args = parser.parse_args()
+
     price_data_folder = "C:/Users/adeeb/Desktop/portfolio-recommendation-master/Portfolio-Managment-Recommendation-System/backend/price_data"
     fundamental_data_folder = "C:/Users/adeeb/Desktop/portfolio-recommendation-master/Portfolio-Managment-Recommendation-System/backend/Merged_fundamental_Data"
     output_folder = "price_data"
     
-    process_all_tickers(price_data_folder, fundamental_data_folder, output_folder)
\ No newline at end of file
+    process_all_tickers(price_data_folder, fundamental_data_folder, output_folder, args.format, args.float32)
\ No newline at end of file
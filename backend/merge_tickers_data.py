@@ -11,50 +11,198 @@ The main data processing steps are:
 2. Filter out tickers with poor data quality
 3. Filter out columns with poor data quality
 4. Create a detailed summary of missing and zero values
-5. Save the processed data and summary to CSV files
+5. Save the processed data (see pipeline_storage) and the summary CSV file
 
 Usage:
-    Run this script directly to process all CSV files in the 'Processed_Ticker_Data' directory
-    and output 'processed_data.csv' and 'missing_values_summary.csv'.
+    Run this script directly to process all tables in the 'Processed_Ticker_Data' directory
+    and output 'processed_data' and 'missing_values_summary.csv':
+    python merge_tickers_data.py --format parquet --streaming
+    python merge_tickers_data.py --reuse-merged --ticker-threshold 0.85 --column-threshold 0.75
 """
 
+import argparse
 import pandas as pd
 import numpy as np
 import os
 from pathlib import Path
 
+from capm_features import BETAS_FILE, expand_capm_features, load_capm_inputs
+from pipeline_storage import (
+    DEFAULT_FORMAT,
+    FORMATS,
+    find_table,
+    list_tables,
+    read_table,
+    read_table_chunks,
+    table_file_dtypes,
+    write_table,
+    write_table_chunks,
+)
+
+# Table written by the streaming merge
+MERGED_TABLE = 'merged_ticker_data'
+
+# Outputs of main
+PROCESSED_TABLE = 'processed_data'
+SUMMARY_FILE = 'missing_values_summary.csv'
+
+# Columns renamed in the merged data
+RENAMED_COLUMNS = {'Current Ratio.1': 'Current_Ratio'}
+
+# Minimum ratios of non-zero, non-null values to keep a ticker or a column
+TICKER_THRESHOLD = 0.80
+COLUMN_THRESHOLD = 0.79
+
 def merge_csv_files(data_dir='Processed_Ticker_Data'):
     """
-    Merge all CSV files from the specified directory into a single DataFrame.
+    Merge all tables from the specified directory into a single DataFrame.
     
-    Each file name is expected to start with a ticker symbol. The function adds
+    Each table name is expected to start with a ticker symbol. The function adds
     'ticker' and 'time_idx' columns for identification and time series processing.
     
     Args:
-        data_dir (str): Directory containing CSV files to merge
+        data_dir (str): Directory containing the tables to merge
         
     Returns:
         pandas.DataFrame: Merged DataFrame with all ticker data
     """
     dataframes = []
-    for file_name in os.listdir(data_dir):
-        if file_name.endswith('.csv'):
-            ticker = file_name.split('_')[0]
-            csv_path = os.path.join(data_dir, file_name)
+    for name in list_tables(data_dir):
+        ticker = name.split('_')[0]
 
-            df = pd.read_csv(csv_path)
-            df['ticker'] = ticker
+        df = read_table(data_dir, name)
+        df['ticker'] = ticker
 
-            dataframes.append(df)
+        dataframes.append(df)
 
     merged_df = pd.concat(dataframes, ignore_index=True)
     merged_df['Date'] = pd.to_datetime(merged_df['Date'])
     merged_df['time_idx'] = (merged_df['Date'] - merged_df['Date'].min()).dt.days
-    return merged_df.rename(columns={'Current Ratio.1': 'Current_Ratio'})
+    return merged_df.rename(columns=RENAMED_COLUMNS)
+
+def merge_csv_files_streaming(data_dir='Processed_Ticker_Data', output_folder='.', name=MERGED_TABLE,
+                              storage_format=DEFAULT_FORMAT, float32=False):
+    """
+    Merge all tables from the specified directory into one table on disk, one table at a time.
+    
+    Produces the rows and columns of merge_csv_files with peak memory bounded by one
+    input table instead of the whole universe. A first pass reads the column dtypes
+    and the Date column of every table, for the column union, the schema of the
+    merged table and the global minimum date of time_idx. A column is stored as float
+    if it is numeric in every table that has it, and as string otherwise. The second
+    pass appends each table cast to that schema, with a categorical 'ticker' column
+    over all tickers, so every chunk has the same types whichever columns it lacks.
+    
+    Args:
+        data_dir (str): Directory containing the tables to merge
+        output_folder (str): Folder of the merged table
+        name (str): Name of the merged table
+        storage_format (str): Storage format of the merged table, one of pipeline_storage.FORMATS
+        float32 (bool): Store the numeric columns as float32 instead of float64
+        
+    Returns:
+        str: Path of the merged table, or None if data_dir has no tables
+    """
+    names = list_tables(data_dir)
+    tickers = [name.split('_')[0] for name in names]
+    
+    # First pass: column union in order of appearance, whether each column is numeric
+    # in every table, and the global minimum date
+    numeric = {}
+    min_date = None
+    for table_name in names:
+        for column, dtype in table_file_dtypes(find_table(data_dir, table_name)).items():
+            numeric[column] = numeric.get(column, True) and pd.api.types.is_numeric_dtype(dtype)
+        table_min_date = read_table(data_dir, table_name, columns=['Date'])['Date'].min()
+        if min_date is None or table_min_date < min_date:
+            min_date = table_min_date
+    
+    float_dtype = np.float32 if float32 else np.float64
+    dtypes = {column: float_dtype if is_numeric else 'string' for column, is_numeric in numeric.items()}
+    dtypes.update({'Date': 'datetime64[ns]', 'ticker': pd.CategoricalDtype(sorted(set(tickers))), 'time_idx': np.int64})
+    columns = list(dtypes)
+    
+    def chunks():
+        # Second pass: one table at a time, aligned to the column union
+        for table_name, ticker in zip(names, tickers):
+            df = read_table(data_dir, table_name).reindex(columns=columns)
+            df['ticker'] = ticker
+            df['time_idx'] = (df['Date'] - min_date).dt.days
+            yield df.astype(dtypes).rename(columns=RENAMED_COLUMNS)
+    
+    renamed_dtypes = {RENAMED_COLUMNS.get(column, column): dtype for column, dtype in dtypes.items()}
+    return write_table_chunks(chunks(), output_folder, name, storage_format, dtypes=renamed_dtypes)
+
+def load_merged_table(folder='.', name=MERGED_TABLE):
+    """
+    Load the table written by merge_csv_files_streaming.
+    
+    Args:
+        folder (str): Folder of the merged table
+        name (str): Name of the merged table
+        
+    Returns:
+        pandas.DataFrame: Merged data with a categorical 'ticker' column
+    """
+    df = read_table(folder, name)
+    # CSV does not keep the categorical dtype
+    df['ticker'] = df['ticker'].astype('category')
+    return df
+
+def bad_cell_mask(df, columns=None):
+    """
+    Mark the missing or zero cells of the numeric columns.
+    
+    The quality filters and the summary are all derived from this mask, so it can be
+    computed once and passed to each of them.
+    
+    Args:
+        df (pandas.DataFrame): DataFrame containing ticker data
+        columns (list, optional): Columns to check instead of the numeric columns of df
+        
+    Returns:
+        pandas.DataFrame: Boolean mask with the index of df and one column per numeric column
+    """
+    if columns is None:
+        columns = df.select_dtypes(include=np.number).columns.drop(['Date', 'ticker'], errors='ignore')
+    values = df[columns]
+    return values.isnull() | (values == 0)
 
+def _rows_of(bad_cells, df):
+    """Restrict a mask computed for a larger DataFrame to the rows of df."""
+    if bad_cells is None:
+        return bad_cell_mask(df)
+    if bad_cells.index.equals(df.index):
+        return bad_cells
+    return bad_cells.loc[df.index]
 
+def _capm_cell_counts(df, capm_inputs):
+    """Count the good and all cells of the CAPM features of df per ticker, expanding one ticker at a time."""
+    # The CAPM features only depend on the date and on whether there is a close price
+    capm_columns = [col for col in ('Date', 'Close') if col in df.columns]
+    good_cells = {}
+    total_cells = {}
+    for ticker, group in df[capm_columns].groupby(df['ticker'], observed=True):
+        features = expand_capm_features(group, *capm_inputs, ticker=ticker).drop(columns=capm_columns)
+        good_cells[ticker] = ((features != 0) & features.notnull()).to_numpy().sum()
+        total_cells[ticker] = features.size
+    return pd.Series(good_cells, dtype=np.int64), pd.Series(total_cells, dtype=np.int64)
 
-def filter_tickers_by_data_quality(df, threshold=0.80):
+def _ticker_ratios(rows, bad_counts, capm_counts=None):
+    """Ratios of good cells per ticker from its row count and bad cell counts per column."""
+    total_cells = rows * bad_counts.shape[1]
+    good_cells = total_cells - bad_counts.sum(axis=1)
+    if capm_counts is not None:
+        good_cells = good_cells.add(capm_counts[0], fill_value=0)
+        total_cells = total_cells.add(capm_counts[1], fill_value=0)
+    return (good_cells / total_cells).where(total_cells > 0, 0)
+
+def _column_ratios(total_cells, bad_totals):
+    """Ratios of good cells per column from the row count and bad cell count of each column."""
+    good_cells = total_cells - bad_totals
+    return good_cells / total_cells if total_cells > 0 else pd.Series(0, index=good_cells.index)
+
+def filter_tickers_by_data_quality(df, threshold=TICKER_THRESHOLD, capm_inputs=None, bad_cells=None):
     """
     Filter out tickers with too many missing or zero values.
     
@@ -64,51 +212,46 @@ def filter_tickers_by_data_quality(df, threshold=0.80):
     Args:
         df (pandas.DataFrame): DataFrame containing ticker data
         threshold (float): Minimum ratio of good values required to keep a ticker
+        capm_inputs (tuple, optional): (betas, treasury yields) from load_capm_inputs; the
+            CAPM expected return features expanded from them are counted as well, one
+            ticker at a time, so they need not be stored in df
+        bad_cells (pandas.DataFrame, optional): bad_cell_mask of df, or of a DataFrame
+            containing its rows
         
     Returns:
         pandas.DataFrame: Filtered DataFrame containing only quality tickers
     """
-    ticker_ratios = []
-    for ticker, group in df.groupby('ticker'):
-        numeric_cols = group.select_dtypes(include=np.number).columns.drop(['Date'], errors='ignore')
-        non_zero_non_null_count = group[numeric_cols].apply(lambda x: ((x != 0) & (x.notnull())).sum()).sum()
-        total_cells = len(group) * len(numeric_cols)
-        ratio = non_zero_non_null_count / total_cells if total_cells > 0 else 0
-        ticker_ratios.append([ticker, ratio])
-
-    ratio_df = pd.DataFrame(ticker_ratios, columns=['Ticker', 'Ratio'])
-    filtered_tickers = ratio_df[ratio_df['Ratio'] > threshold]['Ticker'].tolist()
+    bad_cells = _rows_of(bad_cells, df)
+    grouped = bad_cells.groupby(df['ticker'], observed=True)
+    capm_counts = _capm_cell_counts(df, capm_inputs) if capm_inputs is not None else None
+    ratios = _ticker_ratios(grouped.size(), grouped.sum(), capm_counts)
+    filtered_tickers = ratios[ratios > threshold].index.tolist()
     return df[df['ticker'].isin(filtered_tickers)]
 
-def filter_columns_by_data_quality(df, threshold=0.79):
+def filter_columns_by_data_quality(df, threshold=COLUMN_THRESHOLD, bad_cells=None):
     """
     Filter out columns with too many missing or zero values.
     
     Computes the ratio of non-zero, non-null values to total values for each column
-    and keeps only columns with a ratio above the specified threshold.
+    and keeps only columns with a ratio above the specified threshold. CAPM features
+    that are expanded on demand are not stored in df and therefore not filtered.
     
     Args:
         df (pandas.DataFrame): DataFrame with ticker data
         threshold (float): Minimum ratio of good values required to keep a column
+        bad_cells (pandas.DataFrame, optional): bad_cell_mask of df, or of a DataFrame
+            containing its rows
         
     Returns:
         pandas.DataFrame: Filtered DataFrame containing only quality columns
     """
-    numeric_cols = df.select_dtypes(include=np.number).columns.drop(['Date', 'ticker'], errors='ignore')
-    col_ratios = []
-    
-    for col in numeric_cols:
-        non_zero_non_null_count = ((df[col] != 0) & (df[col].notnull())).sum()
-        total_cells = df.shape[0]
-        ratio = non_zero_non_null_count / total_cells if total_cells > 0 else 0
-        col_ratios.append([col, ratio])
-
-    col_ratio_df = pd.DataFrame(col_ratios, columns=['Column', 'Ratio'])
-    filtered_cols = col_ratio_df[col_ratio_df['Ratio'] > threshold]['Column'].tolist()
+    bad_cells = _rows_of(bad_cells, df)
+    ratios = _column_ratios(df.shape[0], bad_cells.sum(axis=0))
+    filtered_cols = ratios[ratios > threshold].index.tolist()
     cols_to_keep = ['ticker', 'Date'] + filtered_cols
     return df[cols_to_keep]
 
-def create_missing_zero_summary(df):
+def create_missing_zero_summary(df, bad_cells=None):
     """
     Create a summary of missing and zero values per ticker per column.
     
@@ -117,21 +260,30 @@ def create_missing_zero_summary(df):
     
     Args:
         df (pandas.DataFrame): DataFrame to analyze
+        bad_cells (pandas.DataFrame, optional): bad_cell_mask of df, or of a DataFrame
+            containing its rows and numeric columns
         
     Returns:
         pandas.DataFrame: Summary DataFrame with missing/zero counts
     """
     columns_to_check = [col for col in df.columns if col != 'ticker']
-    grouped_counts = df.groupby('ticker')[columns_to_check].apply(
-        lambda g: (g.isnull() | (g == 0)).sum()
-    )
+    bad_cells = _rows_of(bad_cells, df)
 
+    # Columns outside the numeric mask, such as Date, are checked on their own
+    mask_cols = [col for col in columns_to_check if col in bad_cells.columns]
+    other_cols = [col for col in columns_to_check if col not in bad_cells.columns]
+    other_bad_cells = df[other_cols].isnull() | (df[other_cols] == 0)
+    bad_cells = pd.concat([bad_cells[mask_cols], other_bad_cells], axis=1)[columns_to_check]
+    grouped_counts = bad_cells.groupby(df['ticker'], observed=True).sum()
+    return _summary_from_counts(grouped_counts, df.groupby('ticker', observed=True).size())
+
+def _summary_from_counts(grouped_counts, total_rows_per_ticker):
+    """Build the summary of create_missing_zero_summary from the bad cell counts per ticker and column."""
     column_sums = grouped_counts.sum(axis=0)
     sorted_columns = column_sums.sort_values(ascending=False).index
     grouped_counts = grouped_counts[sorted_columns]
     grouped_counts = grouped_counts.reset_index()
 
-    total_rows_per_ticker = df.groupby('ticker').size()
     grouped_counts.insert(
         loc=1,
         column='total_rows_for_ticker',
@@ -151,41 +303,157 @@ def create_missing_zero_summary(df):
     summary_df = pd.DataFrame(summary_data, columns=grouped_counts.columns)
     return pd.concat([summary_df, grouped_counts], ignore_index=True)
 
+def filter_merged_table(folder='.', name=MERGED_TABLE, output_folder='.', storage_format=DEFAULT_FORMAT,
+                        ticker_threshold=TICKER_THRESHOLD, column_threshold=COLUMN_THRESHOLD, capm_inputs=None,
+                        float32=False):
+    """
+    Filter the table written by merge_csv_files_streaming one chunk at a time.
+    
+    Gives the processed data and summary of the in-memory filters and of
+    create_missing_zero_summary with peak memory bounded by one chunk. A first pass
+    counts the rows and the missing or zero cells of every column per ticker, plus
+    the cells of the CAPM features; the ticker ratios, the column ratios over the
+    kept tickers and the summary are all derived from these counts. A second pass
+    writes the kept columns of the kept tickers' rows chunk by chunk, cast to one
+    schema: a categorical 'ticker' over the kept tickers and float data columns.
+    
+    Args:
+        folder (str): Folder of the merged table
+        name (str): Name of the merged table
+        output_folder (str): Folder of the processed data
+        storage_format (str): Storage format of the processed data, one of pipeline_storage.FORMATS
+        ticker_threshold (float): Minimum ratio of good values required to keep a ticker
+        column_threshold (float): Minimum ratio of good values required to keep a column
+        capm_inputs (tuple, optional): (betas, treasury yields) from load_capm_inputs, counted
+            as in filter_tickers_by_data_quality
+        float32 (bool): Store the float columns of the processed data as float32 in the columnar formats
+        
+    Returns:
+        tuple: (path of the processed data table, summary DataFrame)
+    """
+    # First pass: counts per ticker
+    columns = None
+    chunk_rows, chunk_counts, chunk_capm_counts = [], [], []
+    for chunk in read_table_chunks(folder, name):
+        if columns is None:
+            # Numeric columns of the first chunk, as a CSV chunk may read an empty column as float
+            columns = bad_cell_mask(chunk).columns
+        bad_cells = bad_cell_mask(chunk, columns)
+        # Date is outside the numeric mask and checked on its own for the summary
+        bad_cells['Date'] = chunk['Date'].isnull() | (chunk['Date'] == 0)
+        grouped = bad_cells.groupby(chunk['ticker'], observed=True)
+        chunk_rows.append(grouped.size())
+        chunk_counts.append(grouped.sum())
+        if capm_inputs is not None:
+            chunk_capm_counts.append(_capm_cell_counts(chunk, capm_inputs))
+    
+    # A ticker's rows may span chunks
+    rows = pd.concat(chunk_rows).groupby(level=0, observed=True).sum()
+    counts = pd.concat(chunk_counts).groupby(level=0, observed=True).sum()
+    rows.index = rows.index.astype(str)
+    counts.index = counts.index.astype(str).rename('ticker')
+    capm_counts = None
+    if capm_inputs is not None:
+        capm_counts = tuple(pd.concat(part).groupby(level=0).sum() for part in zip(*chunk_capm_counts))
+    
+    ratios = _ticker_ratios(rows, counts[columns], capm_counts)
+    filtered_tickers = ratios[ratios > ticker_threshold].index.tolist()
+    ratios = _column_ratios(rows[filtered_tickers].sum(), counts.loc[filtered_tickers, columns].sum(axis=0))
+    filtered_cols = ratios[ratios > column_threshold].index.tolist()
+    summary = _summary_from_counts(counts.loc[filtered_tickers, ['Date'] + filtered_cols], rows[filtered_tickers])
+    
+    # Second pass: rows of the kept tickers, kept columns only
+    dtypes = {'ticker': pd.CategoricalDtype(filtered_tickers), 'Date': 'datetime64[ns]'}
+    # time_idx is a day count; the other columns are stored as floats, as by merge_csv_files_streaming
+    dtypes.update({col: np.int64 if col == 'time_idx' else np.float64 for col in filtered_cols})
+    chunks = (chunk[chunk['ticker'].isin(filtered_tickers)]
+              for chunk in read_table_chunks(folder, name, columns=list(dtypes)))
+    output_path = write_table_chunks(chunks, output_folder, PROCESSED_TABLE, storage_format, float32, dtypes)
+    return output_path, summary
 
-
-def main():
+def main(price_data_dir='price_data', storage_format=DEFAULT_FORMAT, streaming=False,
+         ticker_threshold=TICKER_THRESHOLD, column_threshold=COLUMN_THRESHOLD, reuse_merged=False,
+         data_dir='Processed_Ticker_Data', output_dir='.', float32=False):
     """
     Main function to process and merge ticker data files.
     
     This function:
-    1. Merges all CSV files into a single DataFrame
-    2. Filters tickers with poor data quality
+    1. Merges all CSV files into a single DataFrame, or with streaming into a table
+       on disk, one table at a time
+    2. Filters tickers with poor data quality, counting the CAPM features stored
+       as betas in price_data_dir as if they were columns
     3. Filters columns with poor data quality
     4. Creates a summary of missing/zero values
-    5. Saves the processed data and summary to CSV files
-    """
-    # Merge all CSV files
-    print("Merging CSV files...")
-    combined_df = merge_csv_files()
+    5. Saves the processed data in storage_format and the summary to a CSV file
     
-    # Filter tickers with too many missing values
-    print("Filtering tickers...")
-    combined_df = filter_tickers_by_data_quality(combined_df)
+    In memory, the filters and the summary share one bad_cell_mask of the merged data.
+    With streaming, steps 2 to 5 run on the merged table chunk by chunk through
+    filter_merged_table, so no step holds more than one table in memory.
     
-    # Filter columns with too many missing values
-    print("Filtering columns...")
-    combined_df = filter_columns_by_data_quality(combined_df)
+    Args:
+        price_data_dir (str): Folder with the stored CAPM betas and yields
+        storage_format (str): Storage format of the processed data, one of pipeline_storage.FORMATS
+        streaming (bool): Merge with merge_csv_files_streaming and filter with filter_merged_table,
+            so that memory use is bounded by one table
+        ticker_threshold (float): Minimum ratio of good values required to keep a ticker
+        column_threshold (float): Minimum ratio of good values required to keep a column
+        reuse_merged (bool): Filter the table of a previous streaming merge instead of merging again
+        data_dir (str): Directory containing the processed ticker tables
+        output_dir (str): Directory of the merged table, the processed data and the summary
+        float32 (bool): Store the float columns of the processed data as float32 in the columnar formats
     
-    # Create final missing values summary
-    print("Creating missing values summary...")
-    missing_zero_df = create_missing_zero_summary(combined_df)
+    Returns:
+        str: Path of the processed data table
+    """
+    capm_inputs = None
+    if os.path.exists(os.path.join(price_data_dir, BETAS_FILE)):
+        capm_inputs = load_capm_inputs(price_data_dir)
     
-    # Save the processed DataFrame
-    print("Saving processed data...")
-    combined_df.to_csv('processed_data.csv', index=False)
-    missing_zero_df.to_csv('missing_values_summary.csv', index=False)
+    if streaming or reuse_merged:
+        if not reuse_merged:
+            print("Merging CSV files...")
+            merge_csv_files_streaming(data_dir, output_dir, storage_format=storage_format, float32=float32)
+        
+        # Filter and summarize the merged table chunk by chunk
+        print("Filtering and saving processed data...")
+        output_path, missing_zero_df = filter_merged_table(
+            output_dir, MERGED_TABLE, output_dir, storage_format, ticker_threshold, column_threshold,
+            capm_inputs, float32
+        )
+    else:
+        # Merge all CSV files
+        print("Merging CSV files...")
+        combined_df = merge_csv_files(data_dir)
+        bad_cells = bad_cell_mask(combined_df)
+        
+        # Filter tickers with too many missing values
+        print("Filtering tickers...")
+        combined_df = filter_tickers_by_data_quality(combined_df, ticker_threshold, capm_inputs, bad_cells)
+        
+        # Filter columns with too many missing values
+        print("Filtering columns...")
+        combined_df = filter_columns_by_data_quality(combined_df, column_threshold, bad_cells)
+        
+        # Create final missing values summary
+        print("Creating missing values summary...")
+        missing_zero_df = create_missing_zero_summary(combined_df, bad_cells)
+        
+        # Save the processed DataFrame
+        print("Saving processed data...")
+        output_path = write_table(combined_df, output_dir, PROCESSED_TABLE, storage_format, float32=float32)
+    missing_zero_df.to_csv(os.path.join(output_dir, SUMMARY_FILE), index=False)
     
     print("Processing complete!")
+    return output_path
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Merge the processed ticker data into one dataset.")
+    parser.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="Storage format of the processed data.")
+    parser.add_argument("--float32", action="store_true", help="Store the float columns of the processed data as float32 in the columnar formats.")
+    parser.add_argument("--streaming", action="store_true", help="Merge the tables one at a time through a table on disk to bound memory use.")
+    parser.add_argument("--ticker-threshold", type=float, default=TICKER_THRESHOLD, help="Minimum ratio of non-zero, non-null values to keep a ticker.")
+    parser.add_argument("--column-threshold", type=float, default=COLUMN_THRESHOLD, help="Minimum ratio of non-zero, non-null values to keep a column.")
+    parser.add_argument("--reuse-merged", action="store_true", help=f"Filter the {MERGED_TABLE} table of a previous --streaming run instead of merging again.")
+    args = parser.parse_args()
+    main(storage_format=args.format, float32=args.float32, streaming=args.streaming, ticker_threshold=args.ticker_threshold,
+         column_threshold=args.column_threshold, reuse_merged=args.reuse_merged)
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Online Covariance Module
+
+This module keeps the covariance matrices of the n-month returns of the price
+panel up to date without recomputing them from the full history on every
+refresh. For every interval a CovarianceAccumulator holds, for each pair of
+tickers, the number of periods where both have a return and the sums and
+co-moment sums of their returns over those periods. Folding in a newly
+completed period then costs O(N^2) instead of the O(T*N^2) of a full recompute,
+and the state is saved between runs as one .npz file per interval.
+
+The periods are those of get_price_data.compute_monthly_covs: the first one ends
+at the first month end of the history and each later one spans n months. A
+period is completed once the prices reach a later period; the period still open
+is kept aside and included in the matrices without being folded in, so without
+decay or window the matrices equal a full recompute on the same prices, up to
+rounding. Optionally the returns can be weighted by an exponential decay per
+period, or restricted to a rolling window of the most recent periods.
+
+Usage:
+    covs = update_covariances(prices_df, [2, 3, 6], state_dir='cov_state')
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+RETURN_TYPES = ('simple', 'log')
+STATE_FILE = 'cov_{}month_state.npz'
+
+# Pairwise sums of the accumulator, each a (tickers x tickers) matrix:
+# count: periods where both tickers have a return
+# weight, weight_sq: sum of the weights (and squared weights) of those periods
+# sums: sums[i, j] is the weighted sum of the returns of i over the periods shared with j
+# comoments: weighted sum of the products of the returns
+STAT_NAMES = ('count', 'weight', 'weight_sq', 'sums', 'comoments')
+
+def interval_returns(prices, return_type='simple'):
+    """
+    Compute the returns between consecutive rows of a price array.
+
+    Args:
+        prices (np.ndarray): Prices with one row per period and one column per ticker
+        return_type (str): 'simple' for p1 / p0 - 1 or 'log' for log(p1 / p0)
+
+    Returns:
+        np.ndarray: One row fewer than prices; NaN where either price is missing or
+            not positive, such as the zeros get_price_data.custom_fill puts before a listing
+    """
+    if return_type not in RETURN_TYPES:
+        raise ValueError(f"Unknown return type {return_type!r}, expected one of {RETURN_TYPES}")
+    prices = np.where(prices > 0, prices, np.nan)
+    ratios = prices[1:] / prices[:-1]
+    return np.log(ratios) if return_type == 'log' else ratios - 1
+
+def _empty_stats(n_tickers):
+    """Pairwise sums of an accumulator without returns."""
+    return {name: np.zeros((n_tickers, n_tickers)) for name in STAT_NAMES}
+
+def _fold(stats, returns, weights, sign=1):
+    """Add (or with sign=-1 remove) weighted rows of returns to the pairwise sums, in place."""
+    mask = ~np.isnan(returns)
+    observed = mask.astype(float)
+    values = np.where(mask, returns, 0.0)
+    weighted = observed * weights[:, None]
+
+    stats['count'] += sign * (observed.T @ observed)
+    stats['weight'] += sign * (weighted.T @ observed)
+    stats['weight_sq'] += sign * ((weighted * weights[:, None]).T @ observed)
+    weighted_values = values * weights[:, None]
+    stats['sums'] += sign * (weighted_values.T @ observed)
+    stats['comoments'] += sign * (weighted_values.T @ values)
+
+def _decay(stats, factor):
+    """Scale down the weights of the folded returns by factor, in place."""
+    for name in ('weight', 'sums', 'comoments'):
+        stats[name] *= factor
+    stats['weight_sq'] *= factor ** 2
+
+class CovarianceAccumulator:
+    """
+    Running pairwise sums of the n-month returns of a set of tickers.
+
+    Without decay the covariance of a pair is the sample covariance over the periods
+    where both tickers have a return, as DataFrame.cov computes it. With decay each
+    return is weighted by decay ** age in periods and the covariance is the weighted
+    one with the unbiased denominator sum(w) - sum(w^2) / sum(w), which is the sample
+    covariance for equal weights.
+
+    Args:
+        months (int): Length of the periods in months
+        return_type (str): 'simple' or 'log' returns
+        decay (float, optional): Weight factor per period of age, in (0, 1]
+        window (int, optional): Number of most recent returns to keep; cannot be
+            combined with decay
+    """
+
+    def __init__(self, months, return_type='simple', decay=None, window=None):
+        if months < 1:
+            raise ValueError(f"months must be at least 1, got {months}")
+        if return_type not in RETURN_TYPES:
+            raise ValueError(f"Unknown return type {return_type!r}, expected one of {RETURN_TYPES}")
+        if decay is not None and not 0 < decay <= 1:
+            raise ValueError(f"decay must be in (0, 1], got {decay}")
+        if window is not None and window < 2:
+            raise ValueError(f"window must be at least 2, got {window}")
+        if decay is not None and window is not None:
+            raise ValueError("decay and window cannot be combined")
+
+        self.months = months
+        self.return_type = return_type
+        self.decay = decay
+        self.window = window
+
+        self.tickers = []
+        self.origin = None  # First month of the history, as year * 12 + month - 1
+        self.last_bin = -1  # Index of the last completed period
+        self.last_prices = np.empty(0)  # Prices of the last completed period
+        self.pending_prices = None  # Prices of the period still open
+        self.observed = np.zeros(0)  # Completed periods with a price, per ticker
+        self.stats = _empty_stats(0)
+        self.recent = np.empty((0, 0))  # Returns in the window, oldest first
+
+    def update(self, prices_df):
+        """
+        Fold in the periods completed by new prices.
+
+        The prices must include every date after the last completed period, filled
+        the same way on every run; earlier dates may be left out. When they are
+        passed, they are checked against the state: if the prices of the last
+        completed period changed (e.g. after a dividend adjustment), a ticker with
+        earlier prices was added or the history starts earlier, the state is rebuilt
+        from the given prices.
+
+        Args:
+            prices_df (pd.DataFrame): Prices with dates as index and one column per ticker
+
+        Returns:
+            CovarianceAccumulator: self
+        """
+        prices_df = prices_df.set_axis(pd.to_datetime(prices_df.index).tz_localize(None), axis=0).sort_index()
+        if prices_df.empty:
+            return self
+        months = np.asarray(prices_df.index.year * 12 + prices_df.index.month - 1)
+        if self.origin is None:
+            self.origin = int(months[0])
+        bins = (months - self.origin + self.months - 1) // self.months
+
+        if self._history_changed(prices_df, months, bins):
+            self.__init__(self.months, self.return_type, self.decay, self.window)
+            return self.update(prices_df)
+
+        self._add_tickers(prices_df.columns)
+        new = bins > self.last_bin
+        if not new.any():
+            return self
+        # Periods without any date get a row of NaN, as in a resample of the full history
+        bin_prices = prices_df[new].reindex(columns=self.tickers).groupby(bins[new]).last()
+        bin_prices = bin_prices.reindex(range(self.last_bin + 1, bins[-1] + 1)).to_numpy(dtype=float)
+        completed, self.pending_prices = bin_prices[:-1], bin_prices[-1]
+        if len(completed):
+            previous = self.last_prices[None] if self.last_bin >= 0 else np.empty((0, len(self.tickers)))
+            self._fold_returns(interval_returns(np.vstack([previous, completed]), self.return_type))
+            self.observed += (~np.isnan(completed)).sum(axis=0)
+            self.last_prices = completed[-1]
+            self.last_bin += len(completed)
+        return self
+
+    def _history_changed(self, prices_df, months, bins):
+        """Check the prices up to the last completed period against the state."""
+        if self.last_bin < 0:
+            return False
+        if months[0] < self.origin:
+            return True
+        history = prices_df[bins <= self.last_bin]
+        known = set(self.tickers)
+        added = [ticker for ticker in history.columns if ticker not in known]
+        if history[added].notna().any().any():
+            return True
+
+        last_period = prices_df[bins == self.last_bin].reindex(columns=self.tickers)
+        if last_period.empty:
+            return False
+        last_prices = last_period.ffill().iloc[-1].to_numpy(dtype=float)
+        both = ~np.isnan(last_prices) & ~np.isnan(self.last_prices)
+        return not np.allclose(last_prices[both], self.last_prices[both], rtol=1e-9, atol=0)
+
+    def _add_tickers(self, columns):
+        """Extend the state with tickers without returns so far."""
+        known = set(self.tickers)
+        added = [ticker for ticker in columns if ticker not in known]
+        if not added:
+            return
+        k = len(added)
+        self.tickers = self.tickers + added
+        self.last_prices = np.concatenate([self.last_prices, np.full(k, np.nan)])
+        self.observed = np.concatenate([self.observed, np.zeros(k)])
+        self.stats = {name: np.pad(matrix, ((0, k), (0, k))) for name, matrix in self.stats.items()}
+        self.recent = np.hstack([self.recent, np.full((len(self.recent), k), np.nan)])
+
+    def _fold_returns(self, returns):
+        """Fold consecutive returns, oldest first, into the sums."""
+        weights = np.ones(len(returns))
+        if self.decay is not None:
+            _decay(self.stats, self.decay ** len(returns))
+            weights = self.decay ** np.arange(len(returns) - 1, -1, -1, dtype=float)
+        _fold(self.stats, returns, weights)
+
+        if self.window is not None:
+            self.recent = np.vstack([self.recent, returns])
+            expired = len(self.recent) - self.window
+            if expired > 0:
+                _fold(self.stats, self.recent[:expired], np.ones(expired), sign=-1)
+                self.recent = self.recent[expired:]
+
+    def covariance(self, include_pending=True):
+        """
+        Compute the covariance matrix of the folded returns.
+
+        Args:
+            include_pending (bool): Include the return of the period still open, as a
+                full recompute on the same prices does
+
+        Returns:
+            pd.DataFrame: Covariance matrix of the tickers with prices in more than one
+                period, 0 for pairs with fewer than two common returns
+        """
+        stats = self.stats
+        observed = self.observed
+        if include_pending and self.pending_prices is not None:
+            observed = observed + ~np.isnan(self.pending_prices)
+            if self.last_bin >= 0:
+                stats = {name: matrix.copy() for name, matrix in stats.items()}
+                returns = interval_returns(np.vstack([self.last_prices, self.pending_prices]), self.return_type)
+                if self.decay is not None:
+                    _decay(stats, self.decay)
+                _fold(stats, returns, np.ones(1))
+                if self.window is not None and len(self.recent) == self.window:
+                    _fold(stats, self.recent[:1], np.ones(1), sign=-1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = stats['weight']
+            cov = (stats['comoments'] - stats['sums'] * stats['sums'].T / weight) / (weight - stats['weight_sq'] / weight)
+        cov = np.where(stats['count'] > 1, cov, 0.0)
+
+        valid = observed > 1
+        tickers = [ticker for ticker, keep in zip(self.tickers, valid) if keep]
+        return pd.DataFrame(cov[np.ix_(valid, valid)], index=tickers, columns=tickers)
+
+    def save(self, path):
+        """
+        Save the state as a NumPy .npz file, replacing the previous one atomically.
+
+        Args:
+            path (str): Path of the state file
+        """
+        arrays = {
+            'months': self.months,
+            'return_type': self.return_type,
+            'decay': np.nan if self.decay is None else self.decay,
+            'window': 0 if self.window is None else self.window,
+            'tickers': np.array(self.tickers, dtype=str),
+            'origin': -1 if self.origin is None else self.origin,
+            'last_bin': self.last_bin,
+            'last_prices': self.last_prices,
+            'pending_prices': np.empty(0) if self.pending_prices is None else self.pending_prices,
+            'observed': self.observed,
+            'recent': self.recent,
+        }
+        arrays.update(self.stats)
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a state saved by save.
+
+        Args:
+            path (str): Path of the state file
+
+        Returns:
+            CovarianceAccumulator: The restored accumulator
+        """
+        with np.load(path) as data:
+            decay = float(data['decay'])
+            window = int(data['window'])
+            accumulator = cls(int(data['months']), str(data['return_type']),
+                              None if np.isnan(decay) else decay, window or None)
+            origin = int(data['origin'])
+            accumulator.tickers = data['tickers'].tolist()
+            accumulator.origin = None if origin < 0 else origin
+            accumulator.last_bin = int(data['last_bin'])
+            accumulator.last_prices = data['last_prices']
+            accumulator.pending_prices = data['pending_prices'] if len(data['pending_prices']) else None
+            accumulator.observed = data['observed']
+            accumulator.recent = data['recent']
+            accumulator.stats = {name: data[name] for name in STAT_NAMES}
+        return accumulator
+
+def update_covariances(prices_df, months, return_type='simple', state_dir=None, decay=None, window=None):
+    """
+    Update the covariance matrices of several month intervals from new prices.
+
+    The accumulator of each interval is loaded from state_dir, updated and saved back.
+    A missing state, or one saved with other settings, is rebuilt from prices_df,
+    which then needs the full history.
+
+    Args:
+        prices_df (pd.DataFrame): Prices with dates as index and one column per ticker
+        months (iterable): Lengths of the intervals in months
+        return_type (str): 'simple' or 'log' returns
+        state_dir (str, optional): Folder of the saved states; without it nothing is saved
+        decay (float, optional): Weight factor per period of age
+        window (int, optional): Number of most recent returns to keep
+
+    Returns:
+        dict: Covariance matrix of returns (pd.DataFrame) per number of months
+    """
+    if state_dir is not None:
+        os.makedirs(state_dir, exist_ok=True)
+
+    covs = {}
+    for n in months:
+        path = os.path.join(state_dir, STATE_FILE.format(n)) if state_dir is not None else None
+        accumulator = None
+        if path is not None and os.path.exists(path):
+            accumulator = CovarianceAccumulator.load(path)
+            if (accumulator.return_type, accumulator.decay, accumulator.window) != (return_type, decay, window):
+                accumulator = None
+        if accumulator is None:
+            accumulator = CovarianceAccumulator(n, return_type, decay, window)
+
+        accumulator.update(prices_df)
+        if path is not None:
+            accumulator.save(path)
+        covs[n] = accumulator.covariance()
+    return covs
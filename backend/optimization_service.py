@@ -0,0 +1,311 @@
+"""
+Portfolio Optimization Service
+
+This module runs a long-lived local HTTP service around the portfolio construction
+algorithm, so the backend server does not have to start a new Python process for
+every questionnaire submission. The service loads the return predictions once,
+keeps a warm process pool whose workers already hold them and memory-map the
+covariance matrix of each horizon on first use, and answers requests concurrently
+from a threaded HTTP server.
+
+Endpoints:
+- GET /health: Reports whether the service is ready
+- POST /optimize: Body {"lambda_val", "investment_horizon", "portfolio_size"};
+  returns the same JSON as running portfolio_construction.py
+- POST /reload: Re-reads the input files and restarts the worker pool
+
+Requests covered by a precomputed grid (see precompute_portfolios) are answered
+from it directly. Other results are cached by request parameters and data version
+(see portfolio_cache). When new prediction or covariance files are published the
+service notices the new content hash on the next request, reloads its inputs and
+drops stale entries.
+
+Usage:
+    Run this script directly (from the backend directory) to start the service:
+    python optimization_service.py --port 5001 --processes 4
+"""
+
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from portfolio_cache import PortfolioCache, cache_key, data_version
+from portfolio_construction import (
+    PREDICTIONS_FILE,
+    SCANS,
+    SOLVERS,
+    build_mu_by_horizon,
+    candidate_solver,
+    close_worker_pool,
+    create_worker_pool,
+    format_portfolio_result,
+    load_cov_matrix,
+    optimize_portfolio_in_worker,
+    optimize_portfolio_rolling_parallel,
+    optimizer_input_paths,
+)
+from precompute_portfolios import GRID_FILE, load_grid, lookup_portfolio
+
+# Warm inputs and worker pool shared by the request handler threads
+_service_state = {
+    'condition': threading.Condition(),
+    'active_requests': 0,
+    'reloading': False,
+    'reload_lock': threading.Lock(),
+    'cache': None,
+    'grid_path': None,
+}
+
+def load_inputs(data_dir):
+    """
+    Load the return predictions used by the optimizer and check the covariance files.
+
+    The covariance matrix of every horizon is checked against the prediction
+    tickers once here, so misaligned files are reported at start-up rather than
+    per request.
+
+    Args:
+        data_dir (str): Directory containing the prediction and covariance files
+
+    Returns:
+        tuple: (latest_predictions DataFrame, mu per horizon dict)
+    """
+    latest_predictions = pd.read_csv(os.path.join(data_dir, PREDICTIONS_FILE))
+
+    mu_by_horizon = build_mu_by_horizon(latest_predictions)
+    tickers = latest_predictions['ticker'].tolist()
+    for investment_horizon in mu_by_horizon:
+        load_cov_matrix(investment_horizon, tickers, data_dir)
+    return latest_predictions, mu_by_horizon
+
+def start_service(data_dir, n_processes=None, solver='slsqp', scan='pool'):
+    """
+    Load the inputs and start the warm worker pool, replacing any previous one.
+
+    Waits for in-flight requests to finish before swapping the pool.
+
+    Args:
+        data_dir (str): Directory containing the prediction and covariance files
+        n_processes (int, optional): Number of worker processes
+        solver (str): Inner solver, one of SOLVERS
+        scan (str): Candidate scan, one of SCANS
+    """
+    version = data_version(optimizer_input_paths(data_dir))
+    latest_predictions, mu_by_horizon = load_inputs(data_dir)
+    pool, cov_block = create_worker_pool(None, mu_by_horizon, n_processes, latest_predictions, data_dir)
+
+    # A grid precomputed from other inputs or with other solvers is not used. The lazy and
+    # pool scans solve the candidates with the same solver, so a grid built with the lazy
+    # scan also answers a service running the pool scan; the batched scan solves them
+    # with the active-set QP.
+    grid = None
+    if _service_state['grid_path']:
+        grid = load_grid(_service_state['grid_path'], version)
+        solvers = (solver, candidate_solver(solver, scan))
+        if grid is not None and (grid.get('solver'), grid.get('candidate_solver')) != solvers:
+            grid = None
+
+    condition = _service_state['condition']
+    with condition:
+        _service_state['reloading'] = True
+        condition.wait_for(lambda: _service_state['active_requests'] == 0)
+        previous = (_service_state.get('pool'), _service_state.get('cov_block'))
+        _service_state.update({
+            'data_dir': data_dir,
+            'n_processes': n_processes,
+            'solver': solver,
+            'scan': scan,
+            'latest_predictions': latest_predictions,
+            'mu_by_horizon': mu_by_horizon,
+            'pool': pool,
+            'cov_block': cov_block,
+            'data_version': version,
+            'grid': grid,
+            'reloading': False,
+        })
+        condition.notify_all()
+
+    if previous[0] is not None:
+        close_worker_pool(*previous)
+
+    if _service_state['cache'] is not None:
+        _service_state['cache'].prune(version)
+
+def reload_if_changed():
+    """
+    Reload the inputs if the prediction or covariance files changed on disk.
+
+    Returns:
+        str: Current data version
+    """
+    version = data_version(optimizer_input_paths(_service_state['data_dir']))
+    if version != _service_state['data_version']:
+        with _service_state['reload_lock']:
+            # Another request may have reloaded while this one waited
+            if version != _service_state['data_version']:
+                start_service(_service_state['data_dir'], _service_state['n_processes'],
+                              _service_state['solver'], _service_state['scan'])
+    return _service_state['data_version']
+
+def stop_service():
+    """Stop the worker pool and release its shared memory."""
+    with _service_state['condition']:
+        pool = _service_state.pop('pool', None)
+        cov_block = _service_state.pop('cov_block', None)
+    if pool is not None:
+        close_worker_pool(pool, cov_block)
+
+def optimize_request(params):
+    """
+    Run one portfolio optimization on the warm pool, answering from the precomputed
+    grid or the cache when possible.
+
+    With the batched and lazy scans the whole optimization runs as a single task inside a
+    worker, so concurrent requests are spread across the pool. With the pool scan
+    the candidates of every greedy round are fanned out to the workers.
+
+    Args:
+        params (dict): Request body with lambda_val, investment_horizon and portfolio_size
+
+    Returns:
+        dict: JSON-serializable portfolio with selected assets and weights
+
+    Raises:
+        ValueError: If a parameter is missing or invalid
+    """
+    try:
+        lambda_val = float(params['lambda_val'])
+        investment_horizon = int(params['investment_horizon'])
+        portfolio_size = int(params['portfolio_size'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid request parameters: {e}")
+
+    version = reload_if_changed()
+    grid = _service_state.get('grid')
+    if grid is not None and grid['version'] == version:
+        precomputed = lookup_portfolio(grid, lambda_val, investment_horizon, portfolio_size)
+        if precomputed is not None:
+            return precomputed
+
+    cache = _service_state['cache']
+    key = cache_key(lambda_val, investment_horizon, portfolio_size, version,
+                    solver=_service_state['solver'], scan=_service_state['scan'])
+    if cache is not None:
+        cached = cache.get(key, version)
+        if cached is not None:
+            return cached
+
+    condition = _service_state['condition']
+    with condition:
+        condition.wait_for(lambda: not _service_state['reloading'])
+        _service_state['active_requests'] += 1
+        state = dict(_service_state)
+
+    try:
+        if investment_horizon not in state['mu_by_horizon']:
+            raise ValueError(f"No predictions for a {investment_horizon} month horizon")
+
+        if state['scan'] in ('batched', 'lazy'):
+            result = state['pool'].apply(
+                optimize_portfolio_in_worker,
+                (portfolio_size, lambda_val, investment_horizon),
+                {'solver': state['solver'], 'scan': state['scan']}
+            )
+        else:
+            result = optimize_portfolio_rolling_parallel(
+                portfolio_size=portfolio_size,
+                lambda_val=lambda_val,
+                latest_predictions=state['latest_predictions'],
+                cov_matrix=load_cov_matrix(investment_horizon, state['latest_predictions']['ticker'].tolist(), state['data_dir']),
+                investment_horizon=investment_horizon,
+                solver=state['solver'],
+                scan='pool',
+                pool=state['pool'],
+                mu=state['mu_by_horizon'][investment_horizon]
+            )
+    finally:
+        with condition:
+            _service_state['active_requests'] -= 1
+            condition.notify_all()
+
+    if result is None:
+        raise RuntimeError("Portfolio optimization did not select any assets")
+
+    portfolio = format_portfolio_result(result)
+    if cache is not None and state['data_version'] == version:
+        cache.put(key, portfolio, version)
+    return portfolio
+
+class OptimizationRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler exposing the health, optimize and reload endpoints."""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'ready': 'pool' in _service_state})
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        try:
+            if self.path == '/optimize':
+                self._send_json(200, optimize_request(self._read_json()))
+            elif self.path == '/reload':
+                with _service_state['reload_lock']:
+                    start_service(_service_state['data_dir'], _service_state['n_processes'],
+                                  _service_state['solver'], _service_state['scan'])
+                self._send_json(200, {'status': 'reloaded'})
+            else:
+                self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+def main():
+    """
+    Parse command-line arguments, warm up the inputs and serve requests until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Serve portfolio optimizations over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=5001, help="Port to listen on.")
+    parser.add_argument("--processes", type=int, default=4, help="Number of worker processes.")
+    parser.add_argument("--data-dir", default=".", help="Directory with the prediction and covariance files.")
+    parser.add_argument("--solver", choices=SOLVERS, default='slsqp', help="Inner solver for the candidate optimizations.")
+    parser.add_argument("--scan", choices=SCANS, default='pool', help="How the candidates of each greedy round are scored.")
+    parser.add_argument("--cache-dir", default="portfolio_cache", help="Directory of the result cache; empty to disable.")
+    parser.add_argument("--cache-size", type=int, default=512, help="Maximum number of cached results.")
+    parser.add_argument("--grid", default=GRID_FILE, help="Precomputed portfolio grid; empty to disable.")
+    args = parser.parse_args()
+
+    _service_state['grid_path'] = os.path.join(args.data_dir, args.grid) if args.grid else None
+    if args.cache_dir:
+        _service_state['cache'] = PortfolioCache(args.cache_dir, args.cache_size)
+    start_service(args.data_dir, args.processes, args.solver, args.scan)
+    server = ThreadingHTTPServer((args.host, args.port), OptimizationRequestHandler)
+    print(f"Optimization service listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_service()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Pipeline Storage Module
+
+This module is the storage layer the data preparation scripts use to pass tables
+between stages (get_price_data.py, merge_fundamental_data.py, merge_ticker_data.py,
+process_merged_data.py and merge_tickers_data.py). Instead of re-parsing text dates
+and floats from CSV in every stage, tables are written as typed columnar files:
+- parquet: compressed, typed columns; the default
+- feather: uncompressed Arrow IPC, the fastest to read and write
+- csv: plain text, kept as an export option for tools that need it
+
+Tables are addressed by folder and name without extension (e.g. 'price_data' and
+'AAPL_price_data'), so a stage reads its input whatever format the previous stage
+wrote. Per-ticker stages keep writing one table per ticker, which partitions the
+data by ticker. Reads can be restricted to a subset of columns, which the columnar
+formats serve without reading the others.
+
+Usage:
+    write_table(df, 'price_data', 'AAPL_price_data', 'parquet')
+    df = read_table('price_data', 'AAPL_price_data', columns=['Date', 'Close'])
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMATS = ('parquet', 'feather', 'csv')
+DEFAULT_FORMAT = 'parquet'
+
+# Extension of each format; read_table prefers the formats in this order
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+# Rows per chunk when read_table_chunks reads a CSV table
+CSV_CHUNK_ROWS = 10000
+
+def table_path(folder, name, storage_format=DEFAULT_FORMAT):
+    """
+    Build the path of a table in a given format.
+
+    Args:
+        folder (str): Folder of the table
+        name (str): Table name without extension
+        storage_format (str): One of FORMATS
+
+    Returns:
+        str: Path of the table file
+    """
+    if storage_format not in EXTENSIONS:
+        raise ValueError(f"Unknown storage format {storage_format!r}, expected one of {FORMATS}")
+    return os.path.join(folder, name + EXTENSIONS[storage_format])
+
+def find_table(folder, name):
+    """
+    Find the file of a table in whichever format it was written.
+
+    Args:
+        folder (str): Folder of the table
+        name (str): Table name without extension
+
+    Returns:
+        str: Path of the table file, or None if there is none
+    """
+    for storage_format in FORMATS:
+        path = table_path(folder, name, storage_format)
+        if os.path.exists(path):
+            return path
+    return None
+
+def list_tables(folder, suffix=''):
+    """
+    List the names of the tables in a folder.
+
+    Args:
+        folder (str): Folder to list
+        suffix (str): Only list tables whose name ends with this suffix (e.g. '_price_data')
+
+    Returns:
+        list: Sorted table names without extension
+    """
+    names = set()
+    for file_name in os.listdir(folder):
+        name, extension = os.path.splitext(file_name)
+        if extension in EXTENSIONS.values() and name.endswith(suffix):
+            names.add(name)
+    return sorted(names)
+
+def write_table(df, folder, name, storage_format=DEFAULT_FORMAT, float32=False):
+    """
+    Write a table, replacing any copy of it in another format.
+
+    Args:
+        df (pd.DataFrame): Table to write; the index is not stored
+        folder (str): Folder of the table, created if needed
+        name (str): Table name without extension
+        storage_format (str): One of FORMATS
+        float32 (bool): Store float64 columns as float32 in the columnar formats, for
+            stages whose values do not need more than 7 significant digits. CSV is
+            written at full precision for compatibility with existing consumers.
+
+    Returns:
+        str: Path of the written file
+    """
+    path = table_path(folder, name, storage_format)
+    os.makedirs(folder, exist_ok=True)
+
+    if storage_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        if float32:
+            df = _to_float32(df)
+        if storage_format == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(path)
+
+    _remove_other_formats(folder, name, storage_format)
+    return path
+
+def write_table_chunks(chunks, folder, name, storage_format=DEFAULT_FORMAT, float32=False, dtypes=None):
+    """
+    Write a table from consecutive chunks, holding one chunk in memory at a time.
+
+    Parquet chunks become row groups, feather chunks record batches and CSV chunks
+    are appended without a header.
+
+    Args:
+        chunks (iterable): DataFrames with the same columns and dtypes; categorical
+            columns must have the same categories in every chunk
+        folder (str): Folder of the table, created if needed
+        name (str): Table name without extension
+        storage_format (str): One of FORMATS
+        float32 (bool): Store float64 columns as float32 in the columnar formats
+        dtypes (dict, optional): Pandas dtype of every column, in table order. Each chunk
+            is cast to them and the columnar formats write the one schema they map to,
+            so a column that is empty in some chunks does not change type.
+
+    Returns:
+        str: Path of the written file, or None if there were no chunks
+    """
+    path = table_path(folder, name, storage_format)
+    os.makedirs(folder, exist_ok=True)
+
+    schema = None
+    if dtypes is not None and storage_format != 'csv':
+        import pyarrow
+
+        empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+        schema = pyarrow.Schema.from_pandas(_to_float32(empty) if float32 else empty, preserve_index=False)
+
+    writer = None
+    written = False
+    try:
+        for chunk in chunks:
+            if dtypes is not None:
+                chunk = chunk[list(dtypes)].astype(dtypes)
+            if storage_format == 'csv':
+                chunk.to_csv(path, index=False, mode='a' if written else 'w', header=not written)
+            else:
+                import pyarrow
+
+                if float32:
+                    chunk = _to_float32(chunk)
+                table = pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    writer = _open_table_writer(path, table.schema, storage_format)
+                writer.write_table(table)
+            written = True
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if not written:
+        return None
+    _remove_other_formats(folder, name, storage_format)
+    return path
+
+def _to_float32(df):
+    """Cast the float64 columns of a DataFrame to float32."""
+    float_columns = df.select_dtypes(include=np.float64).columns
+    return df.astype({column: np.float32 for column in float_columns})
+
+def _open_table_writer(path, schema, storage_format):
+    """Open a pyarrow writer that appends tables with the given schema to a columnar file."""
+    if storage_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(path, schema)
+    import pyarrow.ipc
+    # Same compression as DataFrame.to_feather
+    return pyarrow.ipc.new_file(path, schema, options=pyarrow.ipc.IpcWriteOptions(compression='lz4'))
+
+def _remove_other_formats(folder, name, storage_format):
+    """Remove copies of a table in formats other than storage_format."""
+    # A stale copy in another format would otherwise shadow or outlive this one
+    for other_format in FORMATS:
+        other_path = table_path(folder, name, other_format)
+        if other_format != storage_format and os.path.exists(other_path):
+            os.remove(other_path)
+
+def table_file_columns(path):
+    """
+    List the columns of a table file without reading its data.
+
+    Args:
+        path (str): Path of a parquet, feather or CSV file
+
+    Returns:
+        list: Column names in table order
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in EXTENSIONS.values():
+        raise ValueError(f"Unknown table file extension {extension!r}")
+
+    if extension == EXTENSIONS['csv']:
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    if extension == EXTENSIONS['parquet']:
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.schema.names
+
+def table_file_dtypes(path):
+    """
+    Get the pandas dtypes of the columns of a table file.
+
+    The columnar formats read them from the schema without reading the data; CSV
+    files have no schema and are read in full to infer them.
+
+    Args:
+        path (str): Path of a parquet, feather or CSV file
+
+    Returns:
+        pd.Series: dtype of every column in table order
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in EXTENSIONS.values():
+        raise ValueError(f"Unknown table file extension {extension!r}")
+
+    if extension == EXTENSIONS['csv']:
+        return pd.read_csv(path).dtypes
+    if extension == EXTENSIONS['parquet']:
+        import pyarrow.parquet
+        schema = pyarrow.parquet.read_schema(path)
+    else:
+        import pyarrow.ipc
+        with pyarrow.ipc.open_file(path) as reader:
+            schema = reader.schema
+    return schema.empty_table().to_pandas().dtypes
+
+def read_table_file(path, columns=None):
+    """
+    Read a table file, choosing the reader by its extension.
+
+    Args:
+        path (str): Path of a parquet, feather or CSV file
+        columns (list, optional): Columns to read; columns the table does not have are skipped
+
+    Returns:
+        pd.DataFrame: Table with a datetime Date column if it has one
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in EXTENSIONS.values():
+        raise ValueError(f"Unknown table file extension {extension!r}")
+
+    if extension == EXTENSIONS['csv']:
+        usecols = None if columns is None else (lambda column: column in columns)
+        df = pd.read_csv(path, usecols=usecols)
+    else:
+        if columns is not None:
+            available = table_file_columns(path)
+            columns = [column for column in columns if column in available]
+
+        if extension == EXTENSIONS['parquet']:
+            df = pd.read_parquet(path, columns=columns)
+        else:
+            df = pd.read_feather(path, columns=columns)
+
+    return _finish_read(df, columns)
+
+def _finish_read(df, columns):
+    """Order a table read from disk by the requested columns and parse its Date column."""
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    if 'Date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Date']):
+        df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+def read_table(folder, name, columns=None):
+    """
+    Read a table in whichever format it was written.
+
+    Args:
+        folder (str): Folder of the table
+        name (str): Table name without extension
+        columns (list, optional): Columns to read; columns the table does not have are skipped
+
+    Returns:
+        pd.DataFrame: Table with a datetime Date column if it has one
+
+    Raises:
+        FileNotFoundError: If the table does not exist in any format
+    """
+    path = find_table(folder, name)
+    if path is None:
+        raise FileNotFoundError(f"No table {name} in {folder}")
+    return read_table_file(path, columns)
+
+def read_table_chunks(folder, name, columns=None, csv_chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Read a table in consecutive chunks, holding one chunk in memory at a time.
+
+    Parquet tables are read by row group and feather tables by record batch, so a
+    table written by write_table_chunks comes back in the chunks it was written
+    from. CSV tables are read csv_chunk_rows rows at a time.
+
+    Args:
+        folder (str): Folder of the table
+        name (str): Table name without extension
+        columns (list, optional): Columns to read; columns the table does not have are skipped
+        csv_chunk_rows (int): Rows per chunk of a CSV table
+
+    Yields:
+        pd.DataFrame: Consecutive rows of the table, with a datetime Date column if it has one
+
+    Raises:
+        FileNotFoundError: If the table does not exist in any format
+    """
+    path = find_table(folder, name)
+    if path is None:
+        raise FileNotFoundError(f"No table {name} in {folder}")
+
+    if path.endswith(EXTENSIONS['csv']):
+        usecols = None if columns is None else (lambda column: column in columns)
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=csv_chunk_rows, low_memory=False):
+            yield _finish_read(chunk, columns)
+        return
+
+    if columns is not None:
+        available = table_file_columns(path)
+        columns = [column for column in columns if column in available]
+    if path.endswith(EXTENSIONS['parquet']):
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(i, columns=columns)
+            yield _finish_read(table.to_pandas(), columns)
+    else:
+        import pyarrow.ipc
+        with pyarrow.ipc.open_file(path) as reader:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                yield _finish_read(batch.to_pandas(), columns)
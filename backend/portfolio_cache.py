@@ -0,0 +1,194 @@
+"""
+Portfolio Cache Module
+
+This module caches portfolio construction results so that repeated requests with
+the same inputs are answered without re-running the greedy search. The lambda
+derived from the questionnaire, the investment horizons and the portfolio sizes
+all come from short discrete lists, so many users receive identical problems.
+
+Each entry is keyed by the optimization parameters plus a content hash of the
+prediction and covariance files (the data version). Publishing new predictions
+or a new covariance matrix changes the data version, so stale results are never
+returned and are removed on the next lookup. Entries are stored as JSON files in
+a cache directory and evicted in least-recently-used order.
+
+Usage:
+    cache = PortfolioCache('portfolio_cache')
+    version = data_version(['latest_predictions.csv', 'cleaned_cov_matrix_np.npy'])
+    key = cache_key(lambda_val, investment_horizon, portfolio_size, version)
+    portfolio = cache.get(key, version)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Content hashes memoized by (path, size, modification time)
+_fingerprints = {}
+
+def file_fingerprint(path):
+    """
+    Compute the SHA-256 content hash of a file.
+
+    The hash is memoized by path, size and modification time, so unchanged files
+    are only read once per process.
+
+    Args:
+        path (str): Path of the file to hash
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+def data_version(paths):
+    """
+    Combine the content hashes of the optimizer input files into one data version.
+
+    Args:
+        paths (list): Paths of the prediction and covariance files
+
+    Returns:
+        str: Hex digest identifying this version of the inputs
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_fingerprint(path).encode('ascii'))
+    return digest.hexdigest()
+
+def cache_key(lambda_val, investment_horizon, portfolio_size, version, **options):
+    """
+    Build the cache key of one optimization problem.
+
+    Args:
+        lambda_val (float): Risk aversion parameter, rounded to 6 decimals so that
+            float noise in the server's lambda formula does not split entries
+        investment_horizon (int): Investment horizon in months
+        portfolio_size (int): Number of assets in the portfolio
+        version (str): Data version from data_version
+        **options: Further settings that change the result (e.g. solver)
+
+    Returns:
+        str: Hex digest usable as a file name
+    """
+    payload = {
+        'lambda_val': round(float(lambda_val), 6),
+        'investment_horizon': int(investment_horizon),
+        'portfolio_size': int(portfolio_size),
+        'version': version,
+        'options': options,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+class PortfolioCache:
+    """
+    Least-recently-used cache of portfolio results backed by a directory of JSON files.
+
+    Args:
+        cache_dir (str): Directory holding one JSON file per entry
+        max_entries (int): Number of entries kept before the least recently used are evicted
+    """
+
+    def __init__(self, cache_dir, max_entries=512):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild the recency order from the file modification times
+        entries = []
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith('.json'):
+                path = os.path.join(cache_dir, file_name)
+                entries.append((os.path.getmtime(path), file_name[:-len('.json')]))
+        self._order = OrderedDict((key, None) for _, key in sorted(entries))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, version=None):
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            key (str): Key from cache_key
+            version (str, optional): Current data version; entries from other versions are removed
+
+        Returns:
+            dict: Cached result, or None on a miss
+        """
+        with self._lock:
+            # Read from disk so entries written by other processes are found too
+            try:
+                with open(self._path(key), 'r') as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                self._order.pop(key, None)
+                return None
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+
+            if version is not None and entry.get('version') != version:
+                self._remove(key)
+                return None
+
+            self._order[key] = None
+            self._order.move_to_end(key)
+            os.utime(self._path(key))
+            return entry['result']
+
+    def put(self, key, result, version=None):
+        """
+        Store a result and evict the least recently used entries beyond max_entries.
+
+        Args:
+            key (str): Key from cache_key
+            result (dict): JSON-serializable result
+            version (str, optional): Data version the result was computed from
+        """
+        with self._lock:
+            # Write to a temporary file first so readers never see a partial entry
+            temp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'version': version, 'result': result}, f)
+            os.replace(temp_path, self._path(key))
+
+            self._order[key] = None
+            self._order.move_to_end(key)
+            while len(self._order) > self.max_entries:
+                self._remove(next(iter(self._order)))
+
+    def prune(self, version):
+        """
+        Remove every entry computed from a data version other than the given one.
+
+        Args:
+            version (str): Current data version
+        """
+        with self._lock:
+            for key in list(self._order):
+                try:
+                    with open(self._path(key), 'r') as f:
+                        stale = json.load(f).get('version') != version
+                except (OSError, ValueError):
+                    stale = True
+                if stale:
+                    self._remove(key)
+
+    def _remove(self, key):
+        self._order.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
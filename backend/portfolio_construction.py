@@ -19,14 +19,523 @@ Usage:
 """
 
 import argparse
+import os
+import sys
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
+from scipy.optimize import minimize, OptimizeResult
+import heapq
 import json
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool, cpu_count, shared_memory
 from functools import partial
 
-def optimize_single_asset(new_asset, selected_assets, tickers_dict, latest_predictions, cov_matrix, lambda_val, investment_horizon, portfolio_size, tolerance=1e-10):
+# Inner solvers available for the candidate and final optimizations
+SOLVERS = ('slsqp', 'active_set')
+
+# Strategies for scoring the candidates of a greedy round
+SCANS = ('pool', 'batched', 'lazy')
+
+# Candidate objectives within this relative distance of the best one are ties
+TIE_TOLERANCE = 1e-9
+
+# Input files written by the prediction and price data pipelines
+PREDICTIONS_FILE = 'latest_predictions.csv'
+COV_MATRIX_FILE = 'cleaned_cov_matrix_np.npy'
+HORIZON_COV_FILE = 'cov_{}month.npy'
+COV_MANIFEST_FILE = 'cov_manifest.json'
+HORIZONS = (2, 3, 4, 5, 6, 8, 12)
+
+# Inputs installed once per pool worker by _init_worker
+_worker_state = {}
+
+# Covariance matrices aligned with the predictions, per file and per process
+_cov_cache = {}
+
+def cov_matrix_path(investment_horizon, data_dir='.'):
+    """Path of the covariance file for a horizon, falling back to the shared matrix"""
+    path = os.path.join(data_dir, HORIZON_COV_FILE.format(investment_horizon))
+    return path if os.path.exists(path) else os.path.join(data_dir, COV_MATRIX_FILE)
+
+def optimizer_input_paths(data_dir='.'):
+    """
+    List the input files an optimization result depends on.
+    
+    Args:
+        data_dir (str): Directory with the prediction and covariance files
+        
+    Returns:
+        list: Paths of the predictions, the covariance files in use and the manifest
+    """
+    paths = [os.path.join(data_dir, PREDICTIONS_FILE)]
+    paths += sorted({cov_matrix_path(horizon, data_dir) for horizon in HORIZONS})
+    manifest_path = os.path.join(data_dir, COV_MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        paths.append(manifest_path)
+    return paths
+
+def load_cov_matrix(investment_horizon, tickers, data_dir='.'):
+    """
+    Load the covariance matrix of a horizon, aligned with the prediction tickers.
+    
+    Uses cov_{horizon}month.npy when it exists and cleaned_cov_matrix_np.npy
+    otherwise. The file is memory-mapped and the result is cached per process
+    until the file changes, so repeated requests do not reload it. If the
+    manifest lists the tickers of the file's rows, they are checked against
+    the predictions and the rows are reordered when needed; without a manifest
+    only the shape is checked.
+    
+    Args:
+        investment_horizon (int): Investment horizon in months
+        tickers (list): Tickers of the predictions, in row order
+        data_dir (str): Directory with the covariance files
+        
+    Returns:
+        numpy.ndarray: Covariance matrix whose rows follow tickers
+        
+    Raises:
+        ValueError: If the matrix does not cover the tickers
+    """
+    path = os.path.abspath(cov_matrix_path(investment_horizon, data_dir))
+    manifest_path = os.path.join(data_dir, COV_MANIFEST_FILE)
+    has_manifest = os.path.exists(manifest_path)
+    tickers = tuple(tickers)
+    modified = (os.stat(path).st_mtime_ns, os.stat(manifest_path).st_mtime_ns if has_manifest else None)
+    cached = _cov_cache.get(path)
+    if cached is not None and cached[0] == modified and cached[1] == tickers:
+        return cached[2]
+
+    cov_matrix = np.load(path, mmap_mode='r')
+    row_tickers = None
+    if has_manifest:
+        with open(manifest_path, 'r') as f:
+            row_tickers = json.load(f).get(os.path.basename(path))
+
+    if row_tickers is None:
+        if cov_matrix.shape != (len(tickers), len(tickers)):
+            raise ValueError(f"{os.path.basename(path)} has shape {cov_matrix.shape} but there are {len(tickers)} predictions")
+    else:
+        if cov_matrix.shape != (len(row_tickers), len(row_tickers)):
+            raise ValueError(f"{os.path.basename(path)} does not match its manifest entry")
+        rows = {ticker: idx for idx, ticker in enumerate(row_tickers)}
+        missing = [ticker for ticker in tickers if ticker not in rows]
+        if missing:
+            raise ValueError(f"{os.path.basename(path)} has no rows for {', '.join(missing[:10])}")
+        indices = [rows[ticker] for ticker in tickers]
+        # Only copy when the file's rows are not already in prediction order
+        if indices != list(range(len(row_tickers))):
+            cov_matrix = np.ascontiguousarray(cov_matrix[np.ix_(indices, indices)])
+
+    _cov_cache[path] = (modified, tickers, cov_matrix)
+    return cov_matrix
+
+def get_dynamic_bounds(current_size, target_size):
+    """Set appropriate bounds based on portfolio size"""
+    if current_size == 1:
+        return [(1.0, 1.0)]
+    elif current_size == target_size:
+        return [(0.02, 0.15)] * current_size  # Final constraints
+    else:
+        return [(0.0, 1.0)] * current_size    # Looser constraints during selection
+
+def prediction_tickers(latest_predictions):
+    """Tickers of the prediction rows, in row order"""
+    return latest_predictions['ticker'].tolist() if 'ticker' in latest_predictions else latest_predictions.index.tolist()
+
+def build_mu_by_horizon(latest_predictions, horizons=None):
+    """
+    Extract the return predictions of each horizon as arrays aligned with the prediction rows.
+    
+    Entry i of every array belongs to ticker i of prediction_tickers, the same
+    position tickers_dict and the covariance rows use, so mu[indices] always
+    follows the order of the indices.
+    
+    Args:
+        latest_predictions (pandas.DataFrame): DataFrame with return_{n}m prediction columns
+        horizons (list, optional): Horizons to extract, defaults to every return_{n}m column
+        
+    Returns:
+        dict: Return prediction array per investment horizon
+        
+    Raises:
+        ValueError: If a requested horizon has no prediction column
+    """
+    if horizons is None:
+        horizons = [int(column[len('return_'):-1]) for column in latest_predictions.columns
+                    if column.startswith('return_') and column.endswith('m')]
+
+    mu_by_horizon = {}
+    for investment_horizon in horizons:
+        pred_col = f'return_{investment_horizon}m'
+        if pred_col not in latest_predictions:
+            raise ValueError(f"No predictions for a {investment_horizon} month horizon")
+        mu_by_horizon[investment_horizon] = latest_predictions[pred_col].to_numpy(dtype=float)
+    return mu_by_horizon
+
+def _initial_active_set(initial_weights, lower, upper, tolerance):
+    """
+    Starting point of the active-set iterations.
+    
+    Starts from the given weights, moved inside the bounds and onto the budget,
+    otherwise spreads the budget left over after the lower bounds in proportion
+    to each asset's capacity.
+    
+    Returns:
+        tuple: (weights, working set mask, mask of weights fixed by equal bounds)
+    """
+    n = len(lower)
+    if initial_weights is not None and len(initial_weights) == n:
+        weights = np.clip(np.asarray(initial_weights, dtype=float), lower, upper)
+        # Shift weights strictly inside their bounds first so the bounds they sit on stay active
+        for movable in ((weights > lower + tolerance) & (weights < upper - tolerance), np.ones(n, dtype=bool)):
+            residual = 1 - weights.sum()
+            room = np.where(movable, upper - weights if residual > 0 else weights - lower, 0.0)
+            if abs(residual) <= tolerance or room.sum() <= 0:
+                continue
+            weights = weights + np.sign(residual) * room * min(1.0, abs(residual) / room.sum())
+    else:
+        weights = None
+    if weights is None or abs(weights.sum() - 1) > tolerance:
+        capacity = upper - lower
+        weights = lower + capacity * ((1 - lower.sum()) / capacity.sum() if capacity.sum() > 0 else 0)
+
+    fixed = upper - lower <= tolerance
+    working = fixed | (weights <= lower + tolerance) | (weights >= upper - tolerance)
+    if working.all() and not fixed.all():
+        # The budget row needs at least one free weight to stay independent
+        working[np.flatnonzero(~fixed)[0]] = False
+    return weights, working, fixed
+
+def solve_mean_variance_qp(mu, cov_matrix, lambda_val, bounds, initial_weights=None, tolerance=1e-10, max_iter=None):
+    """
+    Solve a small mean-variance problem with a budget constraint and box bounds.
+    
+    Minimizes -(w . mu - lambda_val / 2 * w' cov w) subject to sum(w) == 1 and
+    lower <= w <= upper using a primal active-set method. Every iteration solves
+    the equality-constrained KKT system for the free weights in closed form while
+    the weights in the working set stay pinned to their bound; blocking bounds are
+    added and bounds with a wrong-signed multiplier are released until the KKT
+    conditions of the full problem hold.
+    
+    Args:
+        mu (numpy.ndarray): Expected returns of the assets
+        cov_matrix (numpy.ndarray): Covariance matrix of the assets
+        lambda_val (float): Risk aversion parameter
+        bounds (list): (lower, upper) weight bounds for each asset
+        initial_weights (numpy.ndarray, optional): Starting weights (e.g. the previous greedy round's
+            optimum); weights at a bound start in the working set, and weights that miss the
+            budget, e.g. after rounding, are shifted within their bounds until they sum to one
+        tolerance (float): Tolerance for steps, bounds and multipliers
+        max_iter (int, optional): Iteration limit, defaults to 10 * (n + 1)
+        
+    Returns:
+        scipy.optimize.OptimizeResult: Result with x, fun, success, status, message and nit.
+            status is 0 on success, 1 when the iteration limit is hit or the iterates
+            stall numerically, and 2 when the bounds cannot satisfy the budget constraint.
+    """
+    mu = np.asarray(mu, dtype=float)
+    n = len(mu)
+    hessian = lambda_val * np.asarray(cov_matrix, dtype=float)
+    lower = np.array([bound[0] for bound in bounds], dtype=float)
+    upper = np.array([bound[1] for bound in bounds], dtype=float)
+    max_iter = max_iter or 10 * (n + 1)
+
+    def objective_function(weights):
+        """Calculate negative utility (to be minimized)"""
+        return -(np.dot(weights, mu) - 0.5 * np.dot(weights, np.dot(hessian, weights)))
+
+    if lower.sum() > 1 + tolerance or upper.sum() < 1 - tolerance:
+        return OptimizeResult(x=np.full(n, 1 / n), fun=float('inf'), success=False, status=2, nit=0,
+                              message='Bounds are incompatible with the budget constraint')
+
+    weights, working, fixed = _initial_active_set(initial_weights, lower, upper, tolerance)
+    current_value = objective_function(weights)
+    for iteration in range(1, max_iter + 1):
+        free = np.flatnonzero(~working)
+        gradient = np.dot(hessian, weights) - mu
+        step = np.zeros(n)
+        if len(free) > 0:
+            # KKT system for the free weights: H_FF p - nu 1 = -g_F, 1' p = 0
+            kkt = np.zeros((len(free) + 1, len(free) + 1))
+            kkt[:-1, :-1] = hessian[np.ix_(free, free)]
+            kkt[:-1, -1] = -1.0
+            kkt[-1, :-1] = 1.0
+            rhs = np.append(-gradient[free], 0.0)
+            try:
+                solution = np.linalg.solve(kkt, rhs)
+            except np.linalg.LinAlgError:
+                solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+            step[free] = solution[:-1]
+            multiplier = solution[-1]
+        else:
+            multiplier = gradient[~fixed].mean() if (~fixed).any() else 0.0
+
+        if np.max(np.abs(step)) <= tolerance:
+            # Stationary on the working set: release the most violated bound, if any
+            pinned_lower = working & ~fixed & (weights <= lower + tolerance)
+            pinned_upper = working & ~fixed & ~pinned_lower
+            violation = np.zeros(n)
+            violation[pinned_lower] = multiplier - gradient[pinned_lower]
+            violation[pinned_upper] = gradient[pinned_upper] - multiplier
+            if violation.max(initial=0.0) <= tolerance:
+                return OptimizeResult(x=weights, fun=current_value, success=True, status=0, nit=iteration,
+                                      message='Optimization terminated successfully')
+            working[np.argmax(violation)] = False
+            continue
+
+        # Ratio test: largest step along the direction that keeps every bound satisfied
+        step_length = 1.0
+        blocking = None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(step < -tolerance, (lower - weights) / step,
+                              np.where(step > tolerance, (upper - weights) / step, np.inf))
+        ratios[working] = np.inf
+        if ratios.min() < step_length:
+            blocking = int(np.argmin(ratios))
+            step_length = max(ratios[blocking], 0.0)
+
+        weights = weights + step_length * step
+        if blocking is not None:
+            weights[blocking] = lower[blocking] if step[blocking] < 0 else upper[blocking]
+            working[blocking] = True
+
+        new_value = objective_function(weights)
+        if new_value > current_value + tolerance:
+            # A singular KKT system produced an ascent direction
+            break
+        current_value = new_value
+
+    return OptimizeResult(x=weights, fun=current_value, success=False, status=1, nit=iteration,
+                          message='Active-set iterations did not converge')
+
+def _solve_stacked(matrices, rhs):
+    """Solve a stack of linear systems, falling back to least squares for singular ones"""
+    try:
+        return np.linalg.solve(matrices, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        solutions = np.empty_like(rhs)
+        for i in range(len(rhs)):
+            try:
+                solutions[i] = np.linalg.solve(matrices[i], rhs[i])
+            except np.linalg.LinAlgError:
+                solutions[i] = np.linalg.lstsq(matrices[i], rhs[i], rcond=None)[0]
+        return solutions
+
+def solve_mean_variance_qp_batch(mu, cov_matrices, lambda_val, bounds, initial_weights=None, tolerance=1e-10, max_iter=None):
+    """
+    Solve a stack of mean-variance problems with the same size and bounds at once.
+    
+    Runs the active-set iterations of solve_mean_variance_qp on all problems together.
+    Every iteration solves the KKT systems of the problems still iterating as one
+    stacked linear solve, with the weights in each problem's working set pinned by
+    identity rows, and applies the multiplier checks, ratio tests and blocking bounds
+    as masked array updates. Problems leave the iterations as they finish.
+    
+    Args:
+        mu (numpy.ndarray): Expected returns, one row per problem
+        cov_matrices (numpy.ndarray): Covariance matrices, one (n x n) block per problem
+        lambda_val (float): Risk aversion parameter
+        bounds (list): (lower, upper) weight bounds for each asset, shared by all problems
+        initial_weights (numpy.ndarray, optional): Starting weights shared by all problems
+        tolerance (float): Tolerance for steps, bounds and multipliers
+        max_iter (int, optional): Iteration limit, defaults to 10 * (n + 1)
+        
+    Returns:
+        scipy.optimize.OptimizeResult: Result whose x (one row per problem), fun, success,
+            status and nit hold one entry per problem, with the statuses of solve_mean_variance_qp
+    """
+    mu = np.asarray(mu, dtype=float)
+    num_problems, n = mu.shape
+    hessians = lambda_val * np.asarray(cov_matrices, dtype=float)
+    lower = np.array([bound[0] for bound in bounds], dtype=float)
+    upper = np.array([bound[1] for bound in bounds], dtype=float)
+    max_iter = max_iter or 10 * (n + 1)
+
+    def objective_function(weights, problems):
+        """Calculate negative utility (to be minimized) of each problem"""
+        return -(np.einsum('bi,bi->b', weights, mu[problems])
+                 - 0.5 * np.einsum('bi,bij,bj->b', weights, hessians[problems], weights))
+
+    if lower.sum() > 1 + tolerance or upper.sum() < 1 - tolerance:
+        return OptimizeResult(x=np.full((num_problems, n), 1 / n), fun=np.full(num_problems, np.inf),
+                              success=np.zeros(num_problems, dtype=bool), status=np.full(num_problems, 2),
+                              nit=np.zeros(num_problems, dtype=int),
+                              message='Bounds are incompatible with the budget constraint')
+
+    start, start_working, fixed = _initial_active_set(initial_weights, lower, upper, tolerance)
+    weights = np.tile(start, (num_problems, 1))
+    working = np.tile(start_working, (num_problems, 1))
+    values = objective_function(weights, np.arange(num_problems))
+    status = np.ones(num_problems, dtype=int)
+    nit = np.zeros(num_problems, dtype=int)
+    diagonal = np.arange(n)
+
+    running = np.arange(num_problems)
+    for iteration in range(1, max_iter + 1):
+        if len(running) == 0:
+            break
+        nit[running] = iteration
+        w, pinned = weights[running], working[running]
+        free = ~pinned
+        gradient = np.einsum('bij,bj->bi', hessians[running], w) - mu[running]
+
+        # KKT systems H_FF p - nu 1 = -g_F, 1' p = 0 with p = 0 for the pinned weights
+        kkt = np.zeros((len(running), n + 1, n + 1))
+        kkt[:, :n, :n] = hessians[running] * (free[:, :, None] & free[:, None, :])
+        kkt[:, diagonal, diagonal] += pinned
+        kkt[:, :n, n] = -free.astype(float)
+        kkt[:, n, :n] = free
+        has_free = free.any(axis=1)
+        kkt[~has_free, n, n] = 1.0
+        rhs = np.zeros((len(running), n + 1))
+        rhs[:, :n] = np.where(free, -gradient, 0.0)
+        solution = _solve_stacked(kkt, rhs)
+        step = np.where(free, solution[:, :n], 0.0)
+        fallback_multiplier = gradient[:, ~fixed].mean(axis=1) if (~fixed).any() else np.zeros(len(running))
+        multiplier = np.where(has_free, solution[:, n], fallback_multiplier)
+
+        # Stationary on the working set: converged, or release the most violated bound
+        stationary = np.max(np.abs(step), axis=1) <= tolerance
+        pinned_lower = pinned & ~fixed & (w <= lower + tolerance)
+        pinned_upper = pinned & ~fixed & ~pinned_lower
+        violation = np.where(pinned_lower, multiplier[:, None] - gradient, 0.0)
+        violation = np.where(pinned_upper, gradient - multiplier[:, None], violation)
+        worst = np.argmax(violation, axis=1)
+        converged = stationary & (violation.max(axis=1, initial=0.0) <= tolerance)
+        status[running[converged]] = 0
+        release = stationary & ~converged
+        working[running[release], worst[release]] = False
+
+        # Ratio test: largest step along the direction that keeps every bound satisfied
+        moving = ~stationary
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(step < -tolerance, (lower - w) / step,
+                              np.where(step > tolerance, (upper - w) / step, np.inf))
+        ratios[pinned] = np.inf
+        blocking = np.argmin(ratios, axis=1)
+        blocking_ratio = ratios[np.arange(len(running)), blocking]
+        blocked = moving & (blocking_ratio < 1.0)
+        step_length = np.where(blocked, np.maximum(blocking_ratio, 0.0), 1.0)
+
+        new_weights = w + step_length[:, None] * step
+        rows = np.flatnonzero(blocked)
+        new_weights[rows, blocking[rows]] = np.where(step[rows, blocking[rows]] < 0, lower[blocking[rows]],
+                                                     upper[blocking[rows]])
+        moved = running[moving]
+        weights[moved] = new_weights[moving]
+        working[running[rows], blocking[rows]] = True
+
+        new_values = objective_function(weights[moved], moved)
+        # A singular KKT system produced an ascent direction
+        ascent = new_values > values[moved] + tolerance
+        values[moved[~ascent]] = new_values[~ascent]
+        running = np.concatenate([running[release], moved[~ascent]])
+        running.sort()
+
+    success = status == 0
+    return OptimizeResult(x=weights, fun=values, success=success, status=status, nit=nit,
+                          message=np.where(success, 'Optimization terminated successfully',
+                                           'Active-set iterations did not converge'))
+
+def solve_portfolio_weights(mu, cov_matrix, lambda_val, bounds, initial_weights, solver='slsqp', tolerance=1e-10):
+    """
+    Solve the mean-variance weights of one portfolio with the selected inner solver.
+    
+    The 'active_set' solver falls back to SLSQP when its iterations do not converge,
+    so SLSQP remains the reference implementation for both solvers.
+    
+    Args:
+        mu (numpy.ndarray): Expected returns of the assets
+        cov_matrix (numpy.ndarray): Covariance matrix of the assets
+        lambda_val (float): Risk aversion parameter
+        bounds (list): (lower, upper) weight bounds for each asset
+        initial_weights (numpy.ndarray): Starting weights
+        solver (str): One of SOLVERS
+        tolerance (float): Optimization tolerance parameter for the active-set solver
+        
+    Returns:
+        scipy.optimize.OptimizeResult: Optimization result; nit counts the iterations of both
+            solvers when the active-set solver fell back to SLSQP
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"solver must be one of {SOLVERS}")
+
+    active_set_iterations = 0
+    if solver == 'active_set':
+        result = solve_mean_variance_qp(mu, cov_matrix, lambda_val, bounds, initial_weights, tolerance)
+        if result.success or result.status == 2:
+            return result
+        active_set_iterations = result.nit
+
+    result = minimize(
+        lambda w: -(np.dot(w, mu) - (lambda_val / 2) * np.dot(w.T, np.dot(cov_matrix, w))),
+        initial_weights,
+        method='SLSQP',
+        bounds=bounds,
+        constraints={'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
+        options={'ftol': 1e-8}
+    )
+    # Count the iterations of a failed active-set attempt too
+    result.nit = result.get('nit', 0) + active_set_iterations
+    return result
+
+def _candidate_start(initial_weights, size):
+    """Starting weights of a candidate portfolio: the selected weights plus zero for the candidate"""
+    if initial_weights is not None and len(initial_weights) == size - 1:
+        return np.append(np.asarray(initial_weights, dtype=float), 0.0)
+    return np.full(size, 1 / size)
+
+def candidate_solver(solver, scan):
+    """
+    Name the solver that scores the candidates of a greedy round.
+
+    The batched scan solves every candidate with the batched active-set QP and only
+    falls back to solver for candidates whose iterations do not converge; the pool
+    and lazy scans solve candidates with solver itself. Results from settings with
+    the same candidate solver and the same final solver agree.
+
+    Args:
+        solver (str): Inner solver, one of SOLVERS
+        scan (str): Candidate scan, one of SCANS
+
+    Returns:
+        str: One of SOLVERS
+    """
+    return 'active_set' if scan == 'batched' else solver
+
+def _break_ties(values, candidates, selected, selected_weights, mu, cov_matrix, lambda_val):
+    """
+    Position of the best candidate value, breaking ties by marginal utility.
+    
+    Candidates that join the optimum of the selected assets at zero weight all tie
+    exactly on its objective. Among the values within TIE_TOLERANCE of the best, the
+    candidate with the highest marginal utility mu_i - lambda * (cov w)_i at that
+    optimum w wins, i.e. the one the objective gains most from moving weight to;
+    remaining ties, or ties without selected weights, go to the first candidate.
+    
+    Args:
+        values (numpy.ndarray): Objective value per candidate (inf for failed solves)
+        candidates (numpy.ndarray): Indices of the candidates, in candidate order
+        selected (numpy.ndarray): Indices of the selected assets
+        selected_weights (numpy.ndarray, optional): Optimum of the selected assets
+        mu (numpy.ndarray): Return predictions aligned with the indices
+        cov_matrix (numpy.ndarray): Covariance matrix of asset returns
+        lambda_val (float): Risk aversion parameter
+        
+    Returns:
+        int: Position of the best candidate
+    """
+    best_value = np.min(values)
+    if not np.isfinite(best_value):
+        return int(np.argmin(values))
+    tied = np.flatnonzero(values <= best_value + TIE_TOLERANCE * max(1.0, abs(best_value)))
+    if len(tied) == 1 or selected_weights is None or len(selected_weights) != len(selected):
+        return int(tied[0])
+    tied_candidates = candidates[tied]
+    marginal_utility = mu[tied_candidates] - lambda_val * cov_matrix[np.ix_(tied_candidates, selected)] @ selected_weights
+    # argmax returns the first maximum, so equal utilities keep candidate order
+    return int(tied[np.argmax(marginal_utility)])
+
+def optimize_single_asset(new_asset, selected_assets, tickers_dict, mu, cov_matrix, lambda_val, portfolio_size, tolerance=1e-10, solver='slsqp', initial_weights=None):
     """
     Optimize portfolio for a single new asset addition.
     
@@ -34,57 +543,36 @@ def optimize_single_asset(new_asset, selected_assets, tickers_dict, latest_predi
         new_asset (str): Ticker symbol of the new asset to evaluate
         selected_assets (list): List of ticker symbols already in the portfolio
         tickers_dict (dict): Mapping from ticker symbols to indices
-        latest_predictions (pandas.DataFrame): DataFrame containing return predictions
+        mu (numpy.ndarray): Return predictions aligned with tickers_dict (see build_mu_by_horizon)
         cov_matrix (numpy.ndarray): Covariance matrix of asset returns
         lambda_val (float): Risk aversion parameter
-        investment_horizon (int): Investment horizon in months
         portfolio_size (int): Target size of the portfolio
         tolerance (float): Optimization tolerance parameter
+        solver (str): Inner solver, 'slsqp' or 'active_set'
+        initial_weights (numpy.ndarray, optional): Weights of selected_assets to warm-start from;
+            the new asset starts at zero weight. Defaults to equal weights.
         
     Returns:
-        dict: Result containing asset, objective value, weights, and success flag
+        dict: Result containing asset, objective value, weights, success flag and solver iterations
     """
     current_portfolio = selected_assets + [new_asset]
     selected_asset_indices = [tickers_dict[asset] for asset in current_portfolio]
     
-    # Get predictions
-    pred_col = f'return_{investment_horizon}m'
-    if 'ticker' in latest_predictions:
-        selected_mu = latest_predictions.loc[
-            latest_predictions['ticker'].isin(current_portfolio),
-            pred_col
-        ].values
-    else:
-        selected_mu = latest_predictions.loc[current_portfolio, pred_col].values
-
+    # Predictions and covariances in the same order as current_portfolio
+    selected_mu = mu[selected_asset_indices]
     selected_cov_matrix = cov_matrix[np.ix_(selected_asset_indices, selected_asset_indices)]
     
-    def objective_function(weights):
-        """Calculate negative utility (to be minimized)"""
-        portfolio_return = np.dot(weights, selected_mu)
-        portfolio_variance = np.dot(weights.T, np.dot(selected_cov_matrix, weights))
-        return -(portfolio_return - (lambda_val / 2) * portfolio_variance)
-    
-    def get_dynamic_bounds(current_size, target_size):
-        """Set appropriate bounds based on portfolio size"""
-        if current_size == 1:
-            return [(1.0, 1.0)]
-        elif current_size == target_size:
-            return [(0.02, 0.15)] * current_size  # Final constraints
-        else:
-            return [(0.0, 1.0)] * current_size    # Looser constraints during selection
-            
-    constraints = {'type': 'eq', 'fun': lambda x: np.sum(x) - 1}
     bounds = get_dynamic_bounds(len(current_portfolio), portfolio_size)
-    initial_weights = np.array([1/len(current_portfolio)] * len(current_portfolio))
+    initial_weights = _candidate_start(initial_weights, len(current_portfolio))
     
-    result = minimize(
-        objective_function,
+    result = solve_portfolio_weights(
+        selected_mu,
+        selected_cov_matrix,
+        lambda_val,
+        bounds,
         initial_weights,
-        method='SLSQP',
-        bounds=bounds,
-        constraints=constraints,
-        options={'ftol': 1e-8}
+        solver=solver,
+        tolerance=tolerance
     )
     
     # Format weights to 3 decimal places if optimization was successful
@@ -94,19 +582,430 @@ def optimize_single_asset(new_asset, selected_assets, tickers_dict, latest_predi
         'asset': new_asset,
         'objective_value': result.fun if result.success else float('inf'),
         'weights': formatted_weights,
-        'success': result.success
+        'success': result.success,
+        'iterations': result.nit
     }
 
-def optimize_portfolio_rolling_parallel(portfolio_size, lambda_val, latest_predictions, cov_matrix, investment_horizon, n_processes=None, tolerance=1e-10):
+def _relaxed_candidate_values(selected, candidates, mu, cov_matrix, lambda_val, lower, upper, tolerance):
     """
-    Parallelized version of portfolio optimization using multiprocessing.
+    Solve the budget-constrained KKT systems of all candidates, ignoring the box bounds.
     
-    This function uses a greedy approach to iteratively build an optimal portfolio:
-    1. Starting with an empty portfolio
-    2. At each step, evaluating the addition of each remaining asset in parallel
-    3. Adding the asset that provides the best improvement to the objective function
-    4. Repeating until the target portfolio size is reached
-    5. Performing a final optimization with tighter allocation constraints
+    Returns:
+        tuple: (relaxed objective per candidate, relaxed weights per candidate,
+            mask of candidates whose relaxed weights satisfy the bounds)
+    """
+    k = len(selected)
+    num_candidates = len(candidates)
+    relaxed_values = np.full(num_candidates, -np.inf)
+    relaxed_weights = np.zeros((num_candidates, k + 1))
+    if k == 0:
+        relaxed_weights[:, 0] = 1.0
+        relaxed_values = -(mu[candidates] - (lambda_val / 2) * cov_matrix[candidates, candidates])
+    else:
+        # Shared block K = [[lambda * cov_SS, 1], [1', 0]] and the bordering column of every candidate
+        kkt = np.zeros((k + 1, k + 1))
+        kkt[:k, :k] = lambda_val * cov_matrix[np.ix_(selected, selected)]
+        kkt[:k, k] = 1.0
+        kkt[k, :k] = 1.0
+        border = np.ones((k + 1, num_candidates))
+        border[:k] = lambda_val * cov_matrix[np.ix_(selected, candidates)]
+        rhs = np.append(mu[selected], 1.0)
+        if np.linalg.cond(kkt) < 1e12:
+            solved = np.linalg.solve(kkt, np.column_stack([rhs, border]))
+            base, shift = solved[:, 0], solved[:, 1:]
+            schur = lambda_val * cov_matrix[candidates, candidates] - np.einsum('ij,ij->j', border, shift)
+            valid = schur > tolerance * max(1.0, lambda_val * np.abs(kkt[:k, :k]).max())
+            new_weight = np.zeros(num_candidates)
+            new_weight[valid] = (mu[candidates][valid] - border[:, valid].T @ base) / schur[valid]
+            solution = base[:, None] - shift * new_weight
+            relaxed_weights[:, :k] = solution[:k].T
+            relaxed_weights[:, k] = new_weight
+            # At a KKT point w' (lambda * cov) w = w . mu - t, so the objective is -(w . mu + t) / 2
+            portfolio_return = relaxed_weights[:, :k] @ mu[selected] + new_weight * mu[candidates]
+            relaxed_values = np.where(valid, -(portfolio_return + solution[k]) / 2, -np.inf)
+
+    feasible = np.isfinite(relaxed_values) & np.all(
+        (relaxed_weights >= lower - tolerance) & (relaxed_weights <= upper + tolerance), axis=1
+    )
+    return relaxed_values, relaxed_weights, feasible
+
+def evaluate_candidates_batched(selected_assets, candidate_assets, tickers_dict, mu, cov_matrix, lambda_val, portfolio_size, tolerance=1e-10, solver='slsqp', initial_weights=None, selected_weights=None):
+    """
+    Score all candidates of a greedy round together and return the best one.
+    
+    Every candidate portfolio consists of the selected assets plus one candidate and
+    has the same size, bounds and starting weights, so the candidate problems are
+    stacked and solved exactly with solve_mean_variance_qp_batch: each active-set
+    iteration advances all candidates with one stacked linear solve instead of one
+    solver call per candidate. Only candidates whose batched iterations do not
+    converge are solved again one by one.
+    
+    Args:
+        selected_assets (list): List of ticker symbols already in the portfolio
+        candidate_assets (list): Ticker symbols to evaluate, in tie-breaking order
+        tickers_dict (dict): Mapping from ticker symbols to indices
+        mu (numpy.ndarray): Return predictions aligned with tickers_dict
+        cov_matrix (numpy.ndarray): Covariance matrix of asset returns
+        lambda_val (float): Risk aversion parameter
+        portfolio_size (int): Target size of the portfolio
+        tolerance (float): Optimization tolerance parameter
+        solver (str): Inner solver for candidates whose batched iterations do not converge
+        initial_weights (numpy.ndarray, optional): Weights of selected_assets (the previous round's
+            optimum) to warm-start from; defaults to equal weights
+        selected_weights (numpy.ndarray, optional): Optimum of selected_assets, which breaks ties
+            between candidates by marginal utility (see _break_ties)
+        
+    Returns:
+        dict: Result for the best candidate containing asset, objective value, weights,
+            success flag, the number of inner solver calls (the batched solve counts once)
+            and their total solver iterations
+    """
+    selected = np.array([tickers_dict[asset] for asset in selected_assets], dtype=int)
+    candidates = np.array([tickers_dict[asset] for asset in candidate_assets], dtype=int)
+    k = len(selected)
+    bounds = get_dynamic_bounds(k + 1, portfolio_size)
+    start = _candidate_start(initial_weights, k + 1)
+
+    # Row i holds the indices of candidate portfolio i, the candidate last
+    indices = np.column_stack([np.tile(selected, (len(candidates), 1)), candidates])
+    batch = solve_mean_variance_qp_batch(
+        mu[indices],
+        cov_matrix[indices[:, :, None], indices[:, None, :]],
+        lambda_val,
+        bounds,
+        start,
+        tolerance=tolerance
+    )
+    values = np.where(batch.success, batch.fun, np.inf)
+    weights = batch.x
+    num_solves = 1
+    num_iterations = int(batch.nit.sum())
+
+    if not (batch.status == 2).all():
+        for position in np.flatnonzero(~batch.success):
+            result = solve_portfolio_weights(
+                mu[indices[position]],
+                cov_matrix[np.ix_(indices[position], indices[position])],
+                lambda_val,
+                bounds,
+                start,
+                solver=solver,
+                tolerance=tolerance
+            )
+            num_solves += 1
+            num_iterations += result.nit
+            if result.success:
+                values[position] = result.fun
+                weights[position] = result.x
+
+    best_position = _break_ties(values, candidates, selected, selected_weights, mu, cov_matrix, lambda_val) if len(values) else None
+    if best_position is None or not np.isfinite(values[best_position]):
+        return {'asset': None, 'objective_value': float('inf'), 'weights': None, 'success': False,
+                'solves': num_solves, 'iterations': num_iterations}
+
+    return {
+        'asset': candidate_assets[best_position],
+        'objective_value': values[best_position],
+        'weights': np.round(weights[best_position], 3),
+        'success': True,
+        'solves': num_solves,
+        'iterations': num_iterations
+    }
+
+def evaluate_candidates_lazy(selected_assets, candidate_assets, tickers_dict, mu, cov_matrix, lambda_val, portfolio_size, tolerance=1e-10, solver='slsqp', initial_weights=None, selected_weights=None):
+    """
+    Score the candidates of a greedy round lazily and return the best one.
+    
+    Candidates wait in a priority queue ordered by a lower bound on their objective.
+    Popping a bound replaces it with the exact objective, and the round ends as soon
+    as an exact objective is on top of the queue, since no remaining candidate can
+    beat it; candidates within TIE_TOLERANCE of it are then resolved as well and the
+    tie is broken as in _break_ties. Two bounds keep most candidates from ever
+    being solved:
+    - While the selection bounds are 0%-100%, the previous round's optimum stays
+      optimal with the candidate at zero weight whenever the candidate's marginal
+      utility at that optimum does not exceed the budget multiplier (the KKT
+      conditions still hold). Such a candidate reaches exactly the objective of the
+      selected assets, which no candidate can do worse than.
+    - Every other candidate starts from its Schur-complement relaxation: the
+      budget-constrained KKT systems of all candidates, ignoring the box bounds,
+      are solved at once through a bordering of the shared covariance block.
+      A candidate whose relaxed weights satisfy the bounds is solved exactly,
+      and the relaxed objective of any other candidate is a lower bound.
+    
+    Args:
+        selected_assets (list): List of ticker symbols already in the portfolio
+        candidate_assets (list): Ticker symbols to evaluate, in tie-breaking order
+        tickers_dict (dict): Mapping from ticker symbols to indices
+        mu (numpy.ndarray): Return predictions aligned with tickers_dict
+        cov_matrix (numpy.ndarray): Covariance matrix of asset returns
+        lambda_val (float): Risk aversion parameter
+        portfolio_size (int): Target size of the portfolio
+        tolerance (float): Optimization tolerance parameter
+        solver (str): Inner solver for candidates that need an exact solve
+        initial_weights (numpy.ndarray, optional): Weights of selected_assets (the previous round's
+            optimum) to warm-start the exact solves from; defaults to equal weights
+        selected_weights (numpy.ndarray, optional): Optimum of selected_assets, which breaks ties
+            between candidates by marginal utility (see _break_ties)
+        
+    Returns:
+        dict: Result for the best candidate containing asset, objective value, weights,
+            success flag, the number of inner solves and their total solver iterations
+    """
+    selected = np.array([tickers_dict[asset] for asset in selected_assets], dtype=int)
+    candidates = np.array([tickers_dict[asset] for asset in candidate_assets], dtype=int)
+    k = len(selected)
+    bounds = get_dynamic_bounds(k + 1, portfolio_size)
+    lower = np.array([bound[0] for bound in bounds])
+    upper = np.array([bound[1] for bound in bounds])
+
+    relaxed_values, relaxed_weights, feasible = _relaxed_candidate_values(
+        selected, candidates, mu, cov_matrix, lambda_val, lower, upper, tolerance
+    )
+    exact_weights = {position: np.clip(relaxed_weights[position], lower, upper) for position in np.flatnonzero(feasible)}
+
+    num_solves = 0
+    num_iterations = 0
+    certified = np.zeros(len(candidates), dtype=bool)
+    if k > 0 and np.all(lower == 0.0) and np.all(upper == 1.0):
+        # Optimum of the selected assets under the same 0%-100% bounds
+        incumbent = solve_mean_variance_qp(mu[selected], cov_matrix[np.ix_(selected, selected)], lambda_val,
+                                           [(0.0, 1.0)] * k, initial_weights, tolerance=tolerance)
+        num_solves += 1
+        num_iterations += incumbent.nit
+        if incumbent.success:
+            marginal_cost = lambda_val * cov_matrix[np.ix_(candidates, selected)] @ incumbent.x - mu[candidates]
+            held = incumbent.x > tolerance
+            budget_multiplier = np.max(lambda_val * cov_matrix[np.ix_(selected[held], selected)] @ incumbent.x - mu[selected[held]])
+            certified = ~feasible & (marginal_cost >= budget_multiplier - tolerance)
+            relaxed_values = np.where(certified, incumbent.fun, relaxed_values)
+            zero_weight = np.append(incumbent.x, 0.0)
+            exact_weights.update({position: zero_weight for position in np.flatnonzero(certified)})
+
+    def solve(position):
+        nonlocal num_solves, num_iterations
+        indices = np.append(selected, candidates[position])
+        result = solve_portfolio_weights(
+            mu[indices],
+            cov_matrix[np.ix_(indices, indices)],
+            lambda_val,
+            bounds,
+            _candidate_start(initial_weights, k + 1),
+            solver=solver,
+            tolerance=tolerance
+        )
+        num_solves += 1
+        num_iterations += result.nit
+        if result.success:
+            exact_weights[position] = result.x
+            heapq.heappush(queue, (result.fun, position, 0))
+
+    # Entries are (objective or lower bound, candidate position, 1 for a bound)
+    queue = [(value, position, 0 if position in exact_weights else 1) for position, value in enumerate(relaxed_values)]
+    heapq.heapify(queue)
+    while queue:
+        value, position, is_bound = heapq.heappop(queue)
+        if is_bound:
+            solve(position)
+            continue
+
+        # Resolve every candidate that can still tie with the best exact objective
+        tie_values = np.full(len(candidates), np.inf)
+        tie_values[position] = value
+        tie_limit = value + TIE_TOLERANCE * max(1.0, abs(value))
+        while queue and queue[0][0] <= tie_limit:
+            other_value, other_position, other_is_bound = heapq.heappop(queue)
+            if other_is_bound:
+                solve(other_position)
+            else:
+                tie_values[other_position] = other_value
+        position = _break_ties(tie_values, candidates, selected, selected_weights, mu, cov_matrix, lambda_val)
+        return {
+            'asset': candidate_assets[position],
+            'objective_value': tie_values[position],
+            'weights': np.round(exact_weights[position], 3),
+            'success': True,
+            'solves': num_solves,
+            'iterations': num_iterations
+        }
+
+    return {'asset': None, 'objective_value': float('inf'), 'weights': None, 'success': False,
+            'solves': num_solves, 'iterations': num_iterations}
+
+def _verify_round(best_result, selected_assets, candidate_assets, tickers_dict, mu, cov_matrix, lambda_val, portfolio_size, tolerance, solver):
+    """
+    Check the result of a batched or lazy round against an exhaustive scan.
+    
+    Raises:
+        RuntimeError: If an exhaustively solved candidate beats the selected one
+    """
+    exhaustive = [
+        optimize_single_asset(asset, selected_assets, tickers_dict, mu, cov_matrix, lambda_val, portfolio_size,
+                              tolerance=tolerance, solver=solver)
+        for asset in candidate_assets
+    ]
+    reference = min(exhaustive, key=lambda x: x['objective_value'])
+    if reference['objective_value'] < best_result['objective_value'] - 1e-8 * max(1.0, abs(reference['objective_value'])):
+        raise RuntimeError(
+            f"Round {len(selected_assets) + 1}: {best_result['asset']} ({best_result['objective_value']}) was selected "
+            f"but the exhaustive scan found {reference['asset']} ({reference['objective_value']})"
+        )
+
+def _share_array(array):
+    """
+    Copy an array into a new shared memory block.
+    
+    Args:
+        array (numpy.ndarray): Array to share with the pool workers
+        
+    Returns:
+        tuple: (SharedMemory block, (name, shape, dtype) spec for _init_worker)
+    """
+    array = np.ascontiguousarray(array, dtype=float)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def _init_worker(cov_spec, mu_by_horizon, latest_predictions=None, data_dir=None):
+    """
+    Pool initializer that attaches the shared covariance matrix and stores mu.
+    
+    Runs once per worker, so candidate tasks only need to carry ticker indices.
+    
+    Args:
+        cov_spec (tuple): (name, shape, dtype) of the shared covariance block, or None
+            to load the matrix of each horizon from data_dir on first use
+        mu_by_horizon (dict): Return predictions per investment horizon, aligned with the covariance rows
+        latest_predictions (pandas.DataFrame, optional): Predictions frame for whole-request tasks
+        data_dir (str, optional): Directory with the covariance files when cov_spec is None
+    """
+    if cov_spec is not None:
+        name, shape, dtype = cov_spec
+        block = shared_memory.SharedMemory(name=name)
+        # Keep a reference to the block so its buffer stays mapped
+        _worker_state['cov_block'] = block
+        _worker_state['cov_matrix'] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _worker_state['mu_by_horizon'] = mu_by_horizon
+    _worker_state['latest_predictions'] = latest_predictions
+    _worker_state['data_dir'] = data_dir
+
+def _worker_cov_matrix(investment_horizon):
+    """Covariance matrix of a horizon in a pool worker: the shared block or the memory-mapped file"""
+    if 'cov_matrix' in _worker_state:
+        return _worker_state['cov_matrix']
+    tickers = _worker_state['latest_predictions']['ticker'].tolist()
+    return load_cov_matrix(investment_horizon, tickers, _worker_state['data_dir'])
+
+def create_worker_pool(cov_matrix, mu_by_horizon, n_processes=None, latest_predictions=None, data_dir=None):
+    """
+    Start a process pool whose workers hold the optimization inputs.
+    
+    The covariance matrix is copied into shared memory once and every worker
+    attaches to it at start-up, so the pool can be reused across greedy rounds
+    and across requests. Without a covariance matrix the workers load the matrix
+    of each requested horizon with load_cov_matrix; the memory-mapped files are
+    shared through the page cache.
+    
+    Args:
+        cov_matrix (numpy.ndarray): Covariance matrix of asset returns, or None to load per horizon
+        mu_by_horizon (dict): Return predictions per investment horizon, aligned with cov_matrix
+        n_processes (int, optional): Number of worker processes
+        latest_predictions (pandas.DataFrame, optional): Predictions frame for optimize_portfolio_in_worker;
+            required when cov_matrix is None
+        data_dir (str, optional): Directory with the covariance files when cov_matrix is None
+        
+    Returns:
+        tuple: (Pool, SharedMemory block or None); release both with close_worker_pool
+    """
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+
+    cov_block, cov_spec = _share_array(cov_matrix) if cov_matrix is not None else (None, None)
+    try:
+        pool = Pool(processes=n_processes, initializer=_init_worker,
+                    initargs=(cov_spec, mu_by_horizon, latest_predictions, data_dir))
+    except Exception:
+        if cov_block is not None:
+            cov_block.close()
+            cov_block.unlink()
+        raise
+    return pool, cov_block
+
+def close_worker_pool(pool, cov_block):
+    """
+    Stop a pool created by create_worker_pool and release its shared memory.
+    
+    Args:
+        pool (multiprocessing.Pool): Pool to stop
+        cov_block (SharedMemory): Shared covariance block of the pool, or None
+    """
+    pool.terminate()
+    pool.join()
+    if cov_block is not None:
+        cov_block.close()
+        cov_block.unlink()
+
+def _evaluate_candidate_index(new_index, selected_indices, investment_horizon, lambda_val, portfolio_size, tolerance, solver, initial_weights=None):
+    """
+    Pool task: optimize the portfolio of the selected indices plus one candidate index.
+    
+    Reads mu and the covariance matrix from the worker state set up by _init_worker.
+    
+    Returns:
+        dict: Result containing candidate index, objective value, weights, success flag and solver iterations
+    """
+    indices = list(selected_indices) + [new_index]
+    mu = _worker_state['mu_by_horizon'][investment_horizon]
+    cov_matrix = _worker_cov_matrix(investment_horizon)
+
+    result = solve_portfolio_weights(
+        mu[indices],
+        cov_matrix[np.ix_(indices, indices)],
+        lambda_val,
+        get_dynamic_bounds(len(indices), portfolio_size),
+        _candidate_start(initial_weights, len(indices)),
+        solver=solver,
+        tolerance=tolerance
+    )
+
+    return {
+        'index': new_index,
+        'objective_value': result.fun if result.success else float('inf'),
+        'weights': np.round(result.x, 3) if result.success else None,
+        'success': result.success,
+        'iterations': result.nit
+    }
+
+def optimize_portfolio_in_worker(portfolio_size, lambda_val, investment_horizon, tolerance=1e-10, solver='slsqp', scan='batched'):
+    """
+    Pool task: run a whole batched or lazy portfolio optimization inside a worker.
+    
+    Uses the predictions and covariance matrix installed by create_worker_pool,
+    so a warm pool can serve complete requests concurrently.
+    
+    Returns:
+        dict: Portfolio optimization results, see optimize_portfolio_rolling_parallel
+    """
+    return optimize_portfolio_rolling_parallel(
+        portfolio_size=portfolio_size,
+        lambda_val=lambda_val,
+        latest_predictions=_worker_state['latest_predictions'],
+        cov_matrix=_worker_cov_matrix(investment_horizon),
+        investment_horizon=investment_horizon,
+        tolerance=tolerance,
+        solver=solver,
+        scan=scan,
+        mu=_worker_state['mu_by_horizon'][investment_horizon]
+    )
+
+def run_greedy_rounds(portfolio_size, lambda_val, latest_predictions, cov_matrix, investment_horizon, num_rounds=None, prefix=None, n_processes=None, tolerance=1e-10, solver='slsqp', scan='pool', pool=None, mu=None, verify=False, warm_start=False):
+    """
+    Run the greedy asset selection rounds of optimize_portfolio_rolling_parallel.
+    
+    Round k adds the asset that gives the best objective for a (k+1)-asset portfolio
+    under get_dynamic_bounds(k + 1, portfolio_size). Since only the round that reaches
+    portfolio_size uses the final bounds, the first rounds of a search are shared by
+    every larger target size, and a search can resume from such a prefix.
     
     Args:
         portfolio_size (int): Target number of assets in the portfolio
@@ -114,11 +1013,28 @@ def optimize_portfolio_rolling_parallel(portfolio_size, lambda_val, latest_predi
         latest_predictions (pandas.DataFrame): DataFrame with return predictions
         cov_matrix (numpy.ndarray): Covariance matrix of asset returns
         investment_horizon (int): Investment horizon in months
+        num_rounds (int, optional): Stop after this many selected assets (defaults to portfolio_size)
+        prefix (dict, optional): Trace of earlier rounds to resume from, as returned by this function
         n_processes (int, optional): Number of parallel processes to use
         tolerance (float): Optimization tolerance parameter
+        solver (str): Inner solver, one of SOLVERS
+        scan (str): How the candidates of a greedy round are scored, one of SCANS
+        pool (multiprocessing.Pool, optional): Warm pool from create_worker_pool for scan='pool'
+        mu (numpy.ndarray, optional): Return predictions aligned with the prediction rows,
+            extracted with build_mu_by_horizon when omitted
+        verify (bool): Check every round of the batched or lazy scan against an exhaustive scan
+        warm_start (bool): Start every candidate solve from the previous round's optimum with the
+            candidate at zero weight, instead of from equal weights. Off by default: from that start
+            SLSQP stays at the optimum for every candidate it does not improve, so these tie
+            exactly and the selection rests on the tie-break alone.
         
     Returns:
-        dict: Portfolio optimization results with selected assets and weights
+        dict: Trace with 'all_selected_assets', 'all_weights', 'all_objective_values',
+            'all_inner_solves' (number of inner solver calls) and 'all_inner_iterations'
+            (their total solver iterations) per round
+        
+    Raises:
+        RuntimeError: If verify is set and the exhaustive scan finds a better candidate
     """
     if lambda_val <= 0:
         raise ValueError("lambda_val must be positive")
@@ -130,66 +1046,181 @@ def optimize_portfolio_rolling_parallel(portfolio_size, lambda_val, latest_predi
     if portfolio_size > num_assets_universe or portfolio_size <= 0:
         raise ValueError("Invalid portfolio size")
 
+    if solver not in SOLVERS:
+        raise ValueError(f"solver must be one of {SOLVERS}")
+
+    if scan not in SCANS:
+        raise ValueError(f"scan must be one of {SCANS}")
+
+    num_rounds = portfolio_size if num_rounds is None else min(num_rounds, portfolio_size)
+
     # Create ticker to index mapping
-    tickers = latest_predictions['ticker'].tolist() if 'ticker' in latest_predictions else latest_predictions.index.tolist()
+    tickers = prediction_tickers(latest_predictions)
     tickers_dict = {ticker: idx for idx, ticker in enumerate(tickers)}
 
-    selected_assets = []
-    all_selected_assets = []
-    all_weights = []
-    all_objective_values = []
+    all_selected_assets = [list(assets) for assets in prefix['all_selected_assets']] if prefix else []
+    all_weights = list(prefix['all_weights']) if prefix else []
+    all_objective_values = list(prefix['all_objective_values']) if prefix else []
+    all_inner_solves = list(prefix.get('all_inner_solves', [])) if prefix else []
+    all_inner_iterations = list(prefix.get('all_inner_iterations', [])) if prefix else []
+    selected_assets = list(all_selected_assets[-1]) if all_selected_assets else []
     
-    # Determine number of processes
-    if n_processes is None:
-        n_processes = max(1, cpu_count() - 1)
-    
-    # Create a pool of workers
-    with Pool(processes=n_processes) as pool:
-        for k in range(portfolio_size):
-            remaining_assets = list(set(tickers) - set(selected_assets))
-            
-            optimize_func = partial(
-                optimize_single_asset,
-                selected_assets=selected_assets,
-                tickers_dict=tickers_dict,
-                latest_predictions=latest_predictions,
-                cov_matrix=cov_matrix,
-                lambda_val=lambda_val,
-                investment_horizon=investment_horizon,
-                portfolio_size=portfolio_size,
-                tolerance=tolerance
-            )
-            
-            results = pool.map(optimize_func, remaining_assets)
-            best_result = min(results, key=lambda x: x['objective_value'])
-            
+    if mu is None:
+        mu = build_mu_by_horizon(latest_predictions, [investment_horizon])[investment_horizon]
+
+    # Share the covariance matrix with the pool workers instead of pickling it into every task
+    cov_block = None
+    if scan == 'pool' and pool is None and len(selected_assets) < num_rounds:
+        pool, cov_block = create_worker_pool(cov_matrix, {investment_horizon: mu}, n_processes)
+
+    try:
+        for k in range(len(selected_assets), num_rounds):
+            # Every scan breaks ties by marginal utility at the previous optimum, then by universe order
+            remaining_assets = [ticker for ticker in tickers if ticker not in selected_assets]
+            selected_weights = all_weights[-1] if all_weights else None
+            initial_weights = selected_weights if warm_start else None
+
+            if scan in ('batched', 'lazy'):
+                evaluate_candidates = evaluate_candidates_lazy if scan == 'lazy' else evaluate_candidates_batched
+                best_result = evaluate_candidates(
+                    selected_assets,
+                    remaining_assets,
+                    tickers_dict,
+                    mu,
+                    cov_matrix,
+                    lambda_val,
+                    portfolio_size,
+                    tolerance=tolerance,
+                    solver=solver,
+                    initial_weights=initial_weights,
+                    selected_weights=selected_weights
+                )
+                if verify and best_result['success']:
+                    _verify_round(best_result, selected_assets, remaining_assets, tickers_dict, mu, cov_matrix,
+                                  lambda_val, portfolio_size, tolerance, solver)
+            else:
+                # Tasks only carry ticker indices; the inputs live in the worker state
+                evaluate_func = partial(
+                    _evaluate_candidate_index,
+                    selected_indices=tuple(tickers_dict[asset] for asset in selected_assets),
+                    investment_horizon=investment_horizon,
+                    lambda_val=lambda_val,
+                    portfolio_size=portfolio_size,
+                    tolerance=tolerance,
+                    solver=solver,
+                    initial_weights=initial_weights
+                )
+
+                candidates = np.array([tickers_dict[asset] for asset in remaining_assets], dtype=int)
+                results = pool.map(evaluate_func, candidates.tolist())
+                values = np.array([result['objective_value'] for result in results])
+                selected = np.array([tickers_dict[asset] for asset in selected_assets], dtype=int)
+                best_result = results[_break_ties(values, candidates, selected, selected_weights, mu, cov_matrix, lambda_val)]
+                best_result['asset'] = tickers[best_result['index']]
+                best_result['solves'] = len(results)
+                best_result['iterations'] = sum(result['iterations'] for result in results)
+
             if best_result['success']:
                 selected_assets.append(best_result['asset'])
                 all_selected_assets.append(selected_assets.copy())
                 all_weights.append(best_result['weights'])
                 all_objective_values.append(best_result['objective_value'])
+                all_inner_solves.append(best_result['solves'])
+                all_inner_iterations.append(best_result['iterations'])
             else:
                 break
+    finally:
+        if cov_block is not None:
+            close_worker_pool(pool, cov_block)
+
+    return {
+        'all_selected_assets': all_selected_assets,
+        'all_weights': all_weights,
+        'all_objective_values': all_objective_values,
+        'all_inner_solves': all_inner_solves,
+        'all_inner_iterations': all_inner_iterations
+    }
 
-    if not selected_assets:
+def optimize_portfolio_rolling_parallel(portfolio_size, lambda_val, latest_predictions, cov_matrix, investment_horizon, n_processes=None, tolerance=1e-10, solver='slsqp', scan='pool', pool=None, prefix=None, mu=None, verify=False, warm_start=False):
+    """
+    Parallelized version of portfolio optimization using multiprocessing.
+    
+    This function uses a greedy approach to iteratively build an optimal portfolio:
+    1. Starting with an empty portfolio
+    2. At each step, evaluating the addition of each remaining asset in parallel
+    3. Adding the asset that provides the best improvement to the objective function
+    4. Repeating until the target portfolio size is reached
+    5. Performing a final optimization with tighter allocation constraints
+    
+    Args:
+        portfolio_size (int): Target number of assets in the portfolio
+        lambda_val (float): Risk aversion parameter (higher value = more risk averse)
+        latest_predictions (pandas.DataFrame): DataFrame with return predictions
+        cov_matrix (numpy.ndarray): Covariance matrix of asset returns
+        investment_horizon (int): Investment horizon in months
+        n_processes (int, optional): Number of parallel processes to use
+        tolerance (float): Optimization tolerance parameter
+        solver (str): Inner solver for candidate and final optimizations, one of SOLVERS.
+            'active_set' uses the closed-form KKT/active-set engine with SLSQP as fallback.
+        scan (str): How the candidates of a greedy round are scored, one of SCANS.
+            'pool' evaluates the remaining assets in a process pool whose workers receive
+            the covariance matrix (through shared memory) and mu once at start-up,
+            'batched' scores them together with evaluate_candidates_batched in this process,
+            'lazy' solves only the candidates that can still win with evaluate_candidates_lazy.
+        pool (multiprocessing.Pool, optional): Warm pool from create_worker_pool, built for the
+            same covariance matrix and predictions, used by scan='pool' instead of a new pool
+        prefix (dict, optional): Trace from run_greedy_rounds for the same inputs whose rounds
+            (fewer than portfolio_size) are reused instead of being recomputed
+        mu (numpy.ndarray, optional): Return predictions aligned with the prediction rows,
+            extracted with build_mu_by_horizon when omitted
+        verify (bool): Check every round of the batched or lazy scan against an exhaustive scan
+        warm_start (bool): Start every candidate solve from the previous round's optimum, see
+            run_greedy_rounds (the final solve always starts from the last round's weights)
+        
+    Returns:
+        dict: Portfolio optimization results with selected assets and weights
+    """
+    if mu is None:
+        mu = build_mu_by_horizon(latest_predictions, [investment_horizon])[investment_horizon]
+
+    trace = run_greedy_rounds(
+        portfolio_size,
+        lambda_val,
+        latest_predictions,
+        cov_matrix,
+        investment_horizon,
+        prefix=prefix,
+        n_processes=n_processes,
+        tolerance=tolerance,
+        solver=solver,
+        scan=scan,
+        pool=pool,
+        mu=mu,
+        verify=verify,
+        warm_start=warm_start
+    )
+    all_selected_assets = trace['all_selected_assets']
+    all_weights = trace['all_weights']
+    all_objective_values = trace['all_objective_values']
+
+    if not all_selected_assets:
         return None
+    selected_assets = all_selected_assets[-1]
 
     # Final optimization with target bounds
+    tickers_dict = {ticker: idx for idx, ticker in enumerate(prediction_tickers(latest_predictions))}
     final_indices = [tickers_dict[asset] for asset in selected_assets]
-    pred_col = f'return_{investment_horizon}m' 
-    final_mu = latest_predictions.loc[
-               latest_predictions['ticker' if 'ticker' in latest_predictions else 'index'].isin(selected_assets),
-                pred_col].values
-    
+    final_mu = mu[final_indices]
     final_cov = cov_matrix[np.ix_(final_indices, final_indices)]
 
-    final_result = minimize(
-        lambda w: -(np.dot(w, final_mu) - (lambda_val / 2) * np.dot(w.T, np.dot(final_cov, w))),
+    final_result = solve_portfolio_weights(
+        final_mu,
+        final_cov,
+        lambda_val,
+        [(0.02, 0.15)] * len(selected_assets),  # Final constraints: min 2%, max 15%
         all_weights[-1],
-        method='SLSQP',
-        bounds=[(0.02, 0.15)] * len(selected_assets),  # Final constraints: min 2%, max 15%
-        constraints={'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-        options={'ftol': 1e-8}
+        solver=solver,
+        tolerance=tolerance
     )
 
     # Format weights to 3 decimal places
@@ -202,6 +1233,9 @@ def optimize_portfolio_rolling_parallel(portfolio_size, lambda_val, latest_predi
         'all_selected_assets': all_selected_assets,
         'all_weights': all_weights,
         'all_objective_values': all_objective_values,
+        'all_inner_solves': trace['all_inner_solves'],
+        'all_inner_iterations': trace['all_inner_iterations'],
+        'final_iterations': final_result.nit,
         'success': final_result.success,
         'message': final_result.message
     }
@@ -227,6 +1261,20 @@ def convert_to_serializable(obj):
     else:
         return obj
 
+def format_portfolio_result(result):
+    """
+    Reduce an optimization result to the JSON payload returned to the server.
+    
+    Args:
+        result (dict): Result of optimize_portfolio_rolling_parallel
+        
+    Returns:
+        dict: JSON-serializable result with the selected assets and their weights
+    """
+    keys_to_remove = ['optimal_value', 'all_selected_assets', 'all_objective_values', 'all_inner_solves', 'all_inner_iterations', 'final_iterations', 'success', 'message', 'all_weights']
+    trimmed = {key: value for key, value in result.items() if key not in keys_to_remove}
+    return convert_to_serializable(trimmed)
+
 if __name__ == "__main__":
     try:
         # Parse command-line arguments
@@ -234,30 +1282,56 @@ if __name__ == "__main__":
         parser.add_argument("lambda_val", type=float, help="Risk aversion parameter (lambda).")
         parser.add_argument("investment_horizon", type=int, help="Investment horizon in months.")
         parser.add_argument("portfolio_size", type=int, help="Desired number of assets in the portfolio.")
+        parser.add_argument("--solver", choices=SOLVERS, default='slsqp', help="Inner solver for the candidate optimizations.")
+        parser.add_argument("--scan", choices=SCANS, default='pool', help="How the candidates of each greedy round are scored.")
+        parser.add_argument("--verify", action="store_true", help="Check every batched or lazy round against an exhaustive scan.")
+        parser.add_argument("--stats", action="store_true", help="Print inner solve and iteration counts to stderr.")
+        parser.add_argument("--cache-dir", default=None, help="Directory of the result cache (disabled by default).")
         args = parser.parse_args()
+
+        # Answer from the result cache when the same problem was already solved on this data
+        cache = None
+        if args.cache_dir:
+            from portfolio_cache import PortfolioCache, cache_key, data_version
+            cache = PortfolioCache(args.cache_dir)
+            version = data_version(optimizer_input_paths())
+            key = cache_key(args.lambda_val, args.investment_horizon, args.portfolio_size, version, solver=args.solver, scan=args.scan)
+            cached = cache.get(key, version)
+            if cached is not None:
+                print(json.dumps(cached))
+                sys.exit(0)
+
         # Run the optimization function
 
-        latest_predictions = pd.read_csv(f'latest_predictions.csv')
-        cleaned_cov_matrix_np = np.load(f'cleaned_cov_matrix_np.npy')
+        latest_predictions = pd.read_csv(PREDICTIONS_FILE)
+        cov_matrix = load_cov_matrix(args.investment_horizon, latest_predictions['ticker'].tolist())
 
 
         result = optimize_portfolio_rolling_parallel(
             portfolio_size=args.portfolio_size,
             lambda_val=args.lambda_val,
             latest_predictions=latest_predictions,
-            cov_matrix=cleaned_cov_matrix_np,
+            cov_matrix=cov_matrix,
             investment_horizon=args.investment_horizon,
-            n_processes=4)
+            n_processes=4,
+            solver=args.solver,
+            scan=args.scan,
+            verify=args.verify)
+
 
+        if args.stats and result is not None:
+            print(f"rounds: {len(result['all_selected_assets'])}, "
+                  f"inner solves: {sum(result['all_inner_solves'])}, "
+                  f"inner iterations: {sum(result['all_inner_iterations'])}, "
+                  f"final iterations: {result['final_iterations']}", file=sys.stderr)
 
-        keys_to_remove = ['optimal_value', 'all_selected_assets', 'all_objective_values', 'success', 'message', 'all_weights']
-        for key in keys_to_remove:
-            result.pop(key, None)  # Use pop to safely remove the key if it exists
         # Debug optimization result
-        print(json.dumps(convert_to_serializable(result)))
+        portfolio = format_portfolio_result(result)
+        if cache is not None:
+            cache.put(key, portfolio, version)
+        print(json.dumps(portfolio))
     except Exception as e:
         # Print any errors that occur
         print(f"Error: {str(e)}")
-        import sys
         sys.exit(1)
 
@@ -0,0 +1,252 @@
+"""
+Precompute Portfolios Module
+
+This module solves the full grid of portfolio construction problems the backend
+can be asked for, so the serving path can look results up instead of running the
+greedy search per request. The inputs of portfolio_construction.py form a small
+cartesian product:
+- lambda: 1 + 0.142857 * (score - 7), where score sums seven answers of 1-3
+- investment horizon: 2, 3, 4, 5, 6, 8 or 12 months
+- portfolio size: 15, 20 or 25 assets
+
+The greedy search only uses the final (2%-15%) bounds in the round that reaches the
+target size, so for every (lambda, horizon) pair one search up to the largest size
+minus one is shared by all sizes; each size then runs its last round and the final
+optimization on top of that prefix. (lambda, horizon) pairs are solved in parallel.
+
+The results are written to a compact JSON artifact holding the ticker table, the
+data version of the inputs and, per grid cell, ticker indices and weights.
+
+Usage:
+    Run this script directly (from the backend directory) after publishing new
+    predictions or a new covariance matrix:
+    python precompute_portfolios.py --output portfolio_grid.json --processes 4
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+import pandas as pd
+
+from portfolio_cache import data_version
+from portfolio_construction import (
+    HORIZONS,
+    PREDICTIONS_FILE,
+    SOLVERS,
+    build_mu_by_horizon,
+    candidate_solver,
+    format_portfolio_result,
+    load_cov_matrix,
+    optimize_portfolio_rolling_parallel,
+    optimizer_input_paths,
+    run_greedy_rounds,
+)
+
+GRID_FILE = 'portfolio_grid.json'
+
+# Questionnaire layout used by server.js to derive lambda
+QUESTION_COUNT = 7
+ANSWER_VALUES = (1, 2, 3)
+PORTFOLIO_SIZES = [15, 20, 25]
+
+# Inputs installed once per worker by _init_precompute_worker
+_precompute_state = {}
+
+def questionnaire_lambdas():
+    """
+    List every lambda server.js can derive from a questionnaire score.
+
+    Returns:
+        list: Lambda values, computed with the same expression as server.js
+    """
+    min_score = QUESTION_COUNT * min(ANSWER_VALUES)
+    max_score = QUESTION_COUNT * max(ANSWER_VALUES)
+    return [1 + 0.142857 * (score - 7) for score in range(min_score, max_score + 1)]
+
+def grid_key(lambda_val, investment_horizon, portfolio_size):
+    """
+    Build the lookup key of one grid cell.
+
+    Args:
+        lambda_val (float): Risk aversion parameter, rounded to 6 decimals
+        investment_horizon (int): Investment horizon in months
+        portfolio_size (int): Number of assets in the portfolio
+
+    Returns:
+        str: Key of the cell in the artifact
+    """
+    return f"{round(float(lambda_val), 6)}|{int(investment_horizon)}|{int(portfolio_size)}"
+
+def _init_precompute_worker(latest_predictions, mu_by_horizon, data_dir):
+    """Pool initializer that stores the inputs once per worker."""
+    _precompute_state['latest_predictions'] = latest_predictions
+    _precompute_state['mu_by_horizon'] = mu_by_horizon
+    _precompute_state['data_dir'] = data_dir
+
+def solve_lambda_horizon(lambda_val, investment_horizon, portfolio_sizes, solver='slsqp', scan='lazy'):
+    """
+    Solve every portfolio size of one (lambda, horizon) pair with a shared greedy prefix.
+
+    Args:
+        lambda_val (float): Risk aversion parameter
+        investment_horizon (int): Investment horizon in months
+        portfolio_sizes (list): Target portfolio sizes
+        solver (str): Inner solver, one of SOLVERS
+        scan (str): Candidate scan, 'batched' or 'lazy'
+
+    Returns:
+        dict: Formatted portfolio per grid key
+    """
+    latest_predictions = _precompute_state['latest_predictions']
+    mu = _precompute_state['mu_by_horizon'][investment_horizon]
+    cov_matrix = load_cov_matrix(investment_horizon, latest_predictions['ticker'].tolist(), _precompute_state['data_dir'])
+
+    # Rounds before the largest target size use the same bounds for every size
+    largest_size = max(portfolio_sizes)
+    shared_trace = run_greedy_rounds(
+        largest_size,
+        lambda_val,
+        latest_predictions,
+        cov_matrix,
+        investment_horizon,
+        num_rounds=largest_size - 1,
+        solver=solver,
+        scan=scan,
+        mu=mu
+    )
+
+    portfolios = {}
+    for portfolio_size in sorted(portfolio_sizes):
+        prefix = {key: values[:portfolio_size - 1] for key, values in shared_trace.items()}
+        result = optimize_portfolio_rolling_parallel(
+            portfolio_size=portfolio_size,
+            lambda_val=lambda_val,
+            latest_predictions=latest_predictions,
+            cov_matrix=cov_matrix,
+            investment_horizon=investment_horizon,
+            solver=solver,
+            scan=scan,
+            prefix=prefix,
+            mu=mu
+        )
+        if result is not None:
+            portfolios[grid_key(lambda_val, investment_horizon, portfolio_size)] = format_portfolio_result(result)
+    return portfolios
+
+def precompute_grid(data_dir='.', lambdas=None, horizons=None, portfolio_sizes=None, n_processes=None, solver='slsqp', scan='lazy'):
+    """
+    Solve the whole portfolio grid for the current inputs.
+
+    Args:
+        data_dir (str): Directory with the prediction and covariance files
+        lambdas (list, optional): Lambda values, defaults to questionnaire_lambdas()
+        horizons (list, optional): Investment horizons, defaults to HORIZONS
+        portfolio_sizes (list, optional): Portfolio sizes, defaults to PORTFOLIO_SIZES
+        n_processes (int, optional): Number of worker processes
+        solver (str): Inner solver, one of SOLVERS
+        scan (str): Candidate scan, 'batched' or 'lazy'
+
+    Returns:
+        dict: Compact artifact with the data version, ticker table and one entry per grid cell
+    """
+    lambdas = questionnaire_lambdas() if lambdas is None else lambdas
+    horizons = HORIZONS if horizons is None else horizons
+    portfolio_sizes = PORTFOLIO_SIZES if portfolio_sizes is None else portfolio_sizes
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+
+    version = data_version(optimizer_input_paths(data_dir))
+    latest_predictions = pd.read_csv(os.path.join(data_dir, PREDICTIONS_FILE))
+    tickers = latest_predictions['ticker'].tolist()
+    mu_by_horizon = build_mu_by_horizon(latest_predictions, horizons)
+    # Check the covariance files once before starting the workers
+    for horizon in horizons:
+        load_cov_matrix(horizon, tickers, data_dir)
+    tickers_dict = {ticker: idx for idx, ticker in enumerate(tickers)}
+
+    tasks = [(lambda_val, horizon, portfolio_sizes, solver, scan) for lambda_val in lambdas for horizon in horizons]
+    with Pool(processes=n_processes, initializer=_init_precompute_worker,
+              initargs=(latest_predictions, mu_by_horizon, data_dir)) as pool:
+        results = pool.starmap(solve_lambda_horizon, tasks)
+
+    # Store tickers as indices into the ticker table to keep the artifact small
+    cells = {}
+    for portfolios in results:
+        for key, portfolio in portfolios.items():
+            cells[key] = [[tickers_dict[asset] for asset in portfolio['selected_assets']], portfolio['weights']]
+
+    return {
+        'version': version,
+        'solver': solver,
+        'candidate_solver': candidate_solver(solver, scan),
+        'scan': scan,
+        'tickers': tickers,
+        'lambdas': [round(lambda_val, 6) for lambda_val in lambdas],
+        'horizons': list(horizons),
+        'portfolio_sizes': list(portfolio_sizes),
+        'portfolios': cells,
+    }
+
+def load_grid(path, version=None):
+    """
+    Load a precomputed grid artifact.
+
+    Args:
+        path (str): Path of the artifact
+        version (str, optional): Expected data version; a grid for other inputs is ignored
+
+    Returns:
+        dict: Artifact, or None if it is missing or stale
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        grid = json.load(f)
+    if version is not None and grid.get('version') != version:
+        return None
+    return grid
+
+def lookup_portfolio(grid, lambda_val, investment_horizon, portfolio_size):
+    """
+    Look up one precomputed portfolio.
+
+    Args:
+        grid (dict): Artifact from precompute_grid or load_grid
+        lambda_val (float): Risk aversion parameter
+        investment_horizon (int): Investment horizon in months
+        portfolio_size (int): Number of assets in the portfolio
+
+    Returns:
+        dict: Portfolio with selected assets and weights, or None if the cell is not in the grid
+    """
+    cell = grid['portfolios'].get(grid_key(lambda_val, investment_horizon, portfolio_size))
+    if cell is None:
+        return None
+    indices, weights = cell
+    return {'selected_assets': [grid['tickers'][index] for index in indices], 'weights': weights}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the portfolio grid for the current inputs.")
+    parser.add_argument("--data-dir", default=".", help="Directory with the prediction and covariance files.")
+    parser.add_argument("--output", default=GRID_FILE, help="Path of the grid artifact.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--solver", choices=SOLVERS, default='slsqp', help="Inner solver for the candidate optimizations.")
+    parser.add_argument("--scan", choices=('batched', 'lazy'), default='lazy', help="How the candidates of each greedy round are scored.")
+    parser.add_argument("--force", action="store_true", help="Recompute even if the artifact matches the inputs.")
+    args = parser.parse_args()
+
+    current_version = data_version(optimizer_input_paths(args.data_dir))
+    existing = load_grid(args.output, current_version)
+    if existing is not None and (existing.get('solver'), existing.get('scan')) == (args.solver, args.scan) and not args.force:
+        print(f"{args.output} is up to date with the current inputs.")
+    else:
+        start = time.time()
+        grid = precompute_grid(args.data_dir, n_processes=args.processes, solver=args.solver, scan=args.scan)
+        temp_path = f"{args.output}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(grid, f, separators=(',', ':'))
+        os.replace(temp_path, args.output)
+        print(f"Saved {len(grid['portfolios'])} portfolios to {args.output} in {time.time() - start:.1f}s")
@@ -11,14 +11,18 @@ The module performs two main operations:
 2. Processing null values by distributing non-null values across consecutive null entries
 
 Usage:
-    Run this script directly to process all CSV files in the INPUT_FOLDER 
-    and save the results to the OUTPUT_FOLDER.
+    Run this script directly to process all tables in the INPUT_FOLDER 
+    and save the results to the OUTPUT_FOLDER (see pipeline_storage):
+    python process_merged_data.py --format parquet --rows-between 30
 """
 
+import argparse
 import os
 import pandas as pd
 import numpy as np
 
+from pipeline_storage import DEFAULT_FORMAT, FORMATS, list_tables, read_table, write_table
+
 # Define the directory containing the CSV files
 INPUT_FOLDER = 'C:/Users/adeeb/Desktop/portfolio-recommendation-master/Portfolio-Managment-Recommendation-System/backend/Merged_Ticker_Data'
 OUTPUT_FOLDER = 'Processed_Ticker_Data'
@@ -28,67 +32,64 @@ ROWS_BETWEEN = 30
 
 def calculate_even_indices(start_idx, end_idx, num_points):
     """
-    Generate evenly spaced indices between a start and end index.
+    Generate evenly spaced indices between start and end indices.
     
     Args:
-        start_idx (int): The starting index
-        end_idx (int): The ending index
+        start_idx (int or numpy.ndarray): The starting index, or an array of them
+        end_idx (int or numpy.ndarray): The ending index, or an array of them
         num_points (int): The number of points to generate between start and end
     
     Returns:
-        list: A list of evenly spaced integer indices
+        numpy.ndarray: The evenly spaced integer indices, with one row per start and end
+            pair when arrays are given
     """
-    all_points = np.linspace(start_idx, end_idx, num_points + 2)
-    return [int(round(x)) for x in all_points[1:-1]]
+    all_points = np.linspace(start_idx, end_idx, num_points + 2, axis=-1)
+    return np.rint(all_points[..., 1:-1]).astype(np.int64)
 
-def standardize_intervals(df, target_columns):
+def standardize_intervals(df, target_columns, rows_between=ROWS_BETWEEN):
     """
     Create evenly spaced intervals in the dataset by selecting specific rows to keep.
     
-    This function ensures exactly ROWS_BETWEEN points between consecutive non-null values.
+    This function keeps exactly rows_between points between consecutive non-null values
+    that are further apart, and every row between closer ones. The points of all gaps are
+    computed at once from the arrays of gap starts and ends.
     
     Args:
         df (pandas.DataFrame): The input DataFrame to process
         target_columns (list): List of column names to check for non-null values
+        rows_between (int): Number of rows to keep between consecutive non-null rows
     
     Returns:
         pandas.DataFrame: A new DataFrame with standardized intervals
     """
-    # Create a mask for rows where any target column has a non-null value
-    non_null_mask = df[target_columns].notna().any(axis=1)
+    if rows_between < 0:
+        raise ValueError(f"rows_between must be non-negative, got {rows_between}")
     
-    # Get indices of rows with non-null values
-    non_null_indices = non_null_mask[non_null_mask].index.tolist()
+    # Get indices of rows where any target column has a non-null value
+    non_null_mask = df[target_columns].notna().any(axis=1).to_numpy()
+    non_null_indices = df.index[non_null_mask].to_numpy(dtype=np.int64)
     
     # If there are less than 2 non-null rows, return the original DataFrame
     if len(non_null_indices) < 2:
         return df
     
-    # Initialize list to store indices to keep
-    indices_to_keep = []
-    
-    # Always keep the first row with non-null values
-    indices_to_keep.append(non_null_indices[0])
-    
-    # Process each pair of consecutive non-null indices
-    for i in range(len(non_null_indices) - 1):
-        start_idx = non_null_indices[i]
-        end_idx = non_null_indices[i + 1]
-        
-        # Calculate indices to keep between start and end
-        if end_idx - start_idx > ROWS_BETWEEN + 1:
-            # Generate exactly ROWS_BETWEEN evenly spaced points
-            middle_indices = calculate_even_indices(start_idx, end_idx, ROWS_BETWEEN)
-            indices_to_keep.extend(middle_indices)
-        else:
-            # If interval is already smaller than or equal to target, keep all rows
-            indices_to_keep.extend(range(start_idx + 1, end_idx))
-        
-        # Add the end index
-        indices_to_keep.append(end_idx)
+    starts = non_null_indices[:-1]
+    ends = non_null_indices[1:]
+    long_gaps = ends - starts > rows_between + 1
+    
+    # Gaps no longer than the target keep all their rows
+    candidates = np.arange(non_null_indices[0], non_null_indices[-1] + 1)
+    gap_of_candidate = np.searchsorted(non_null_indices, candidates, side='right') - 1
+    is_non_null = np.isin(candidates, non_null_indices)
+    keep_all = is_non_null | ~long_gaps[np.minimum(gap_of_candidate, len(long_gaps) - 1)]
+    
+    # Longer gaps keep exactly rows_between evenly spaced rows
+    middle_indices = calculate_even_indices(starts[long_gaps], ends[long_gaps], rows_between)
+    
+    indices_to_keep = np.union1d(candidates[keep_all], middle_indices.ravel())
     
     # Create new DataFrame with only the selected indices
-    return df.loc[sorted(set(indices_to_keep))].reset_index(drop=True)
+    return df.loc[indices_to_keep].reset_index(drop=True)
 
 def process_dataframe(df, target_columns):
     """
@@ -96,6 +97,9 @@ def process_dataframe(df, target_columns):
     a single value across consecutive null entries.
     
     This ensures the total value is preserved while spreading it evenly across time periods.
+    All columns are processed at once: a cumulative sum over the non-null mask numbers the
+    runs (a non-null value followed by its nulls), np.bincount counts their lengths, and
+    each run takes its first value divided by its length.
     
     Args:
         df (pandas.DataFrame): The input DataFrame to process
@@ -107,106 +111,130 @@ def process_dataframe(df, target_columns):
     # Create a copy to avoid modifying the original DataFrame
     processed_df = df.copy()
     
-    # Get indices where any target column has non-null and non-zero values
-    for col in target_columns:
-        # Get the indices where the value is not null and not zero for current column
-        non_null_indices = processed_df[
-            (processed_df[col].notnull()) & (processed_df[col] != 0)
-        ].index.tolist()
-        
-        for idx in non_null_indices:
-            # Process only if the current value is still non-null and non-zero
-            if not pd.isna(processed_df.at[idx, col]) and processed_df.at[idx, col] != 0:
-                # Initialize count and value
-                count = 1
-                value = processed_df.at[idx, col]
-                indices_to_replace = [idx]
-                
-                # Look at subsequent rows
-                next_idx = idx + 1
-                while next_idx < len(processed_df):
-                    if pd.isna(processed_df.at[next_idx, col]):
-                        indices_to_replace.append(next_idx)
-                        count += 1
-                        next_idx += 1
-                    else:
-                        break
-                
-                # Calculate and apply the replacement value
-                replacement_value = value / count
-                for replace_idx in indices_to_replace:
-                    processed_df.at[replace_idx, col] = replacement_value
+    # Columns without nulls have runs of length one and are left unchanged
+    columns = [col for col in target_columns
+               if pd.api.types.is_numeric_dtype(processed_df[col]) and processed_df[col].isna().any()]
+    if not columns:
+        return processed_df
+    
+    values = processed_df[columns].to_numpy(dtype=float)
+    n_rows, n_cols = values.shape
+    not_null = ~np.isnan(values)
+    
+    # Run number of each cell within its column (0 for the nulls before the first value),
+    # offset per column so that runs of all columns are numbered in one array
+    runs = np.cumsum(not_null, axis=0) + np.arange(n_cols) * (n_rows + 1)
+    run_lengths = np.bincount(runs.ravel(), minlength=n_cols * (n_rows + 1))
+    run_values = np.full(n_cols * (n_rows + 1), np.nan)
+    run_values[runs[not_null]] = values[not_null]
+    
+    # Runs starting with a zero, and nulls before the first value, are left unchanged
+    first_values = run_values[runs]
+    distribute = ~np.isnan(first_values) & (first_values != 0)
+    values[distribute] = first_values[distribute] / run_lengths[runs][distribute]
+    
+    processed_df[columns] = pd.DataFrame(values, index=processed_df.index, columns=columns).astype(processed_df[columns].dtypes)
     
     return processed_df
 
-def main():
+def process_table(input_folder, name, output_folder=OUTPUT_FOLDER, storage_format=DEFAULT_FORMAT, rows_between=ROWS_BETWEEN,
+                  float32=False):
     """
-    Main function that processes all CSV files in the input directory.
+    Standardize the intervals of one merged ticker table and distribute its values.
+    
+    Args:
+        input_folder (str): Folder of the merged ticker tables
+        name (str): Name of the table, which the output table keeps
+        output_folder (str): Folder of the processed tables
+        storage_format (str): Storage format of the output table, one of pipeline_storage.FORMATS
+        rows_between (int): Number of rows to keep between consecutive non-null rows
+        float32 (bool): Store the float columns as float32 in the columnar formats
+    
+    Returns:
+        str: Path of the processed table, or None if the table lacks the Date or START_COLUMN column
+    """
+    # Read the table
+    df = read_table(input_folder, name)
+
+    # Check if 'Date' column exists
+    if 'Date' not in df.columns:
+        print(f"  Warning: 'Date' column not found in {name}. Skipping this file.")
+        return None
+
+    # Ensure 'Cash On Hand' exists
+    if START_COLUMN not in df.columns:
+        print(f"  Warning: '{START_COLUMN}' column not found in {name}. Skipping this file.")
+        return None
+
+    # Determine the columns to process
+    start_col_index = df.columns.get_loc(START_COLUMN)
+    target_columns = df.columns[start_col_index:].tolist()
+
+    print(f"  Standardizing intervals for {len(target_columns)} columns")
+    # First standardize the intervals
+    df = standardize_intervals(df, target_columns, rows_between)
+    
+    print(f"  Processing {len(target_columns)} columns simultaneously")
+    # Then process the columns
+    df = process_dataframe(df, target_columns)
+
+    # Save the updated DataFrame to the output directory
+    return write_table(df, output_folder, name, storage_format, float32=float32)
+
+def main(storage_format=DEFAULT_FORMAT, rows_between=ROWS_BETWEEN, input_folder=INPUT_FOLDER, output_folder=OUTPUT_FOLDER,
+         float32=False):
+    """
+    Main function that processes all tables in the input directory.
     
     This function:
     1. Checks if the input folder exists
     2. Creates the output folder if needed
-    3. Processes each CSV file by:
+    3. Processes each table by:
        - Standardizing intervals
        - Processing null values
-       - Saving to the output directory
+       - Saving to the output directory in storage_format
+    
+    Args:
+        storage_format (str): Storage format of the output tables, one of pipeline_storage.FORMATS
+        rows_between (int): Number of rows to keep between consecutive non-null rows
+        input_folder (str): Folder of the merged ticker tables
+        output_folder (str): Folder of the processed tables
+        float32 (bool): Store the float columns as float32 in the columnar formats
     """
     # Check if the input folder exists
-    if not os.path.isdir(INPUT_FOLDER):
-        print(f"Error: The directory '{INPUT_FOLDER}' does not exist.")
+    if not os.path.isdir(input_folder):
+        print(f"Error: The directory '{input_folder}' does not exist.")
         return
 
     # Create the output folder if it doesn't exist
-    if not os.path.exists(OUTPUT_FOLDER):
-        os.makedirs(OUTPUT_FOLDER)
-        print(f"Created output directory: '{OUTPUT_FOLDER}'")
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+        print(f"Created output directory: '{output_folder}'")
     else:
-        print(f"Output directory '{OUTPUT_FOLDER}' already exists.")
+        print(f"Output directory '{output_folder}' already exists.")
 
-    # List all CSV files in the input directory
-    csv_files = [file for file in os.listdir(INPUT_FOLDER) if file.endswith('.csv')]
+    # List all tables in the input directory
+    tables = list_tables(input_folder)
 
-    if not csv_files:
-        print(f"No CSV files found in the directory '{INPUT_FOLDER}'.")
+    if not tables:
+        print(f"No tables found in the directory '{input_folder}'.")
         return
 
-    for file in csv_files:
-        input_file_path = os.path.join(INPUT_FOLDER, file)
-        output_file_path = os.path.join(OUTPUT_FOLDER, file)
+    for file in tables:
         print(f"Processing file: {file}")
 
         try:
-            # Read the CSV file
-            df = pd.read_csv(input_file_path)
-
-            # Check if 'Date' column exists
-            if 'Date' not in df.columns:
-                print(f"  Warning: 'Date' column not found in {file}. Skipping this file.")
-                continue
-
-            # Ensure 'Cash On Hand' exists
-            if START_COLUMN not in df.columns:
-                print(f"  Warning: '{START_COLUMN}' column not found in {file}. Skipping this file.")
-                continue
-
-            # Determine the columns to process
-            start_col_index = df.columns.get_loc(START_COLUMN)
-            target_columns = df.columns[start_col_index:].tolist()
-
-            print(f"  Standardizing intervals for {len(target_columns)} columns")
-            # First standardize the intervals
-            df = standardize_intervals(df, target_columns)
-            
-            print(f"  Processing {len(target_columns)} columns simultaneously")
-            # Then process the columns
-            df = process_dataframe(df, target_columns)
-
-            # Save the updated DataFrame to the output directory
-            df.to_csv(output_file_path, index=False)
-            print(f"  Finished processing and saved to: {output_file_path}\n")
+            output_file_path = process_table(input_folder, file, output_folder, storage_format, rows_between, float32)
+            if output_file_path is not None:
+                print(f"  Finished processing and saved to: {output_file_path}\n")
 
         except Exception as e:
             print(f"  An error occurred while processing {file}: {e}\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Standardize the intervals of the merged ticker data.")
+    parser.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="Storage format of the processed tables.")
+    parser.add_argument("--rows-between", type=int, default=ROWS_BETWEEN, help="Number of rows to keep between consecutive rows with fundamental data.")
+    parser.add_argument("--float32", action="store_true", help="Store the float columns as float32 in the columnar formats.")
+    args = parser.parse_args()
+    main(args.format, args.rows_between, float32=args.float32)
\ No newline at end of file
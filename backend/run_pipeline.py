@@ -0,0 +1,441 @@
+"""
+Run Pipeline Module
+
+This module runs the data preparation scripts as one pipeline instead of invoking
+the __main__ of each script by hand. The stages form a fixed DAG:
+
+    prices (optional) -> fundamentals -> merge -> process -> dataset -> finetune (optional)
+
+- prices: incremental price refresh of get_price_data.py
+- fundamentals, merge and process: the per-ticker steps of merge_fundamental_data.py,
+  merge_ticker_data.py and process_merged_data.py. The task of a ticker only depends
+  on the tasks of the same ticker in the previous stages, so the tickers of a stage
+  are fanned out across a process pool.
+- dataset and finetune: merge_tickers_data.py and finetune_network.py, which combine
+  all tickers
+
+Each task is fingerprinted by the content hashes of its input files and the
+parameters that change its result. The fingerprints of the last successful run are
+kept in a manifest next to the outputs, and a task whose fingerprint is unchanged and
+whose outputs are unchanged is skipped. A change to the data of one ticker therefore re-runs
+that ticker's chain and the combining stages only. The prices stage reads an
+external source and always runs when requested; rewriting a price table with the
+same content does not change its hash. The wall time of every stage is reported
+and kept in the manifest.
+
+Usage:
+    Run this script directly (from the backend directory):
+    python run_pipeline.py --processes 4
+    python run_pipeline.py --refresh-prices --model Networks/model.ckpt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+import merge_fundamental_data
+import merge_ticker_data
+import merge_tickers_data
+import process_merged_data
+from capm_features import BETAS_FILE, YIELDS_FILE
+from pipeline_storage import DEFAULT_FORMAT, FORMATS, find_table, list_tables
+from portfolio_cache import file_fingerprint
+
+MANIFEST_FILE = 'pipeline_manifest.json'
+
+# Folders and settings of a run; the folders default to the layout of the backend directory
+PipelineConfig = namedtuple('PipelineConfig', [
+    'mapping',
+    'fundamental_input_dir',
+    'fundamental_dir',
+    'price_dir',
+    'merged_dir',
+    'processed_dir',
+    'output_dir',
+    'format',
+    'float32',
+    'rows_between',
+    'streaming',
+    'ticker_threshold',
+    'column_threshold',
+    'refresh_prices',
+    'source_dir',
+    'model',
+    'model_out',
+], defaults=[
+    'filtered_mapping.json',
+    'Fundamental_data',
+    'Merged_Fundamental_Data',
+    'price_data',
+    'Merged_Ticker_Data',
+    'Processed_Ticker_Data',
+    '.',
+    DEFAULT_FORMAT,
+    False,
+    process_merged_data.ROWS_BETWEEN,
+    False,
+    merge_tickers_data.TICKER_THRESHOLD,
+    merge_tickers_data.COLUMN_THRESHOLD,
+    False,
+    None,
+    None,
+    None,
+])
+
+# A per-ticker stage: the config fields that change its result, the function listing
+# the input files of a ticker's task (None when they are missing) and the function
+# running the task and returning its output files
+TickerStage = namedtuple('TickerStage', ['name', 'params', 'inputs', 'run'])
+
+def _fundamentals_inputs(ticker, config, file_index):
+    return file_index.get(ticker) or None
+
+def _fundamentals_run(ticker, inputs, config):
+    output = merge_fundamental_data.process_ticker(ticker, inputs, config.fundamental_dir, config.format,
+                                                   float32=config.float32)
+    return [output] if output is not None else []
+
+def _merge_inputs(ticker, config, file_index):
+    inputs = [
+        find_table(config.price_dir, f"{ticker}_price_data"),
+        find_table(config.fundamental_dir, f"{ticker}_fundamental_data"),
+    ]
+    return None if None in inputs else inputs
+
+def _merge_run(ticker, inputs, config):
+    return [merge_ticker_data.process_ticker(ticker, config.price_dir, config.fundamental_dir, config.merged_dir,
+                                             config.format, config.float32)]
+
+def _process_inputs(ticker, config, file_index):
+    path = find_table(config.merged_dir, f"{ticker}_merged_data")
+    return [path] if path is not None else None
+
+def _process_run(ticker, inputs, config):
+    output = process_merged_data.process_table(config.merged_dir, f"{ticker}_merged_data", config.processed_dir,
+                                               config.format, config.rows_between, config.float32)
+    return [output] if output is not None else []
+
+def task_fingerprint(stage, input_paths, params):
+    """
+    Fingerprint one task by its stage, input file contents and parameters.
+
+    Args:
+        stage (str): Stage name
+        input_paths (list): Paths of the input files of the task
+        params (dict): Parameters that change the result of the task
+
+    Returns:
+        str: Hex digest identifying the task and its inputs
+    """
+    payload = {
+        'stage': stage,
+        'params': params,
+        'inputs': [[path, file_fingerprint(path)] for path in input_paths],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_manifest(path):
+    """
+    Load the task fingerprints and stage timings of the last run.
+
+    Args:
+        path (str): Path of the manifest
+
+    Returns:
+        dict: Manifest with 'tasks' and 'timings', empty if there is none
+    """
+    if not os.path.exists(path):
+        return {'tasks': {}, 'timings': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    """Write the manifest atomically, so an interrupted run keeps the previous one."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def is_up_to_date(manifest, key, fingerprint):
+    """
+    Check whether a task already ran with the same fingerprint and its outputs are unchanged.
+
+    Args:
+        manifest (dict): Manifest from load_manifest
+        key (str): Task key, '{stage}/{ticker}' or the stage name
+        fingerprint (str): Current fingerprint of the task
+
+    Returns:
+        bool: True if the task can be skipped
+    """
+    entry = manifest['tasks'].get(key)
+    if entry is None or entry['fingerprint'] != fingerprint:
+        return False
+    # Outputs removed or modified since the task ran are rebuilt
+    return all(os.path.exists(path) and file_fingerprint(path) == output_fingerprint
+               for path, output_fingerprint in entry['outputs'].items())
+
+def _task_entry(fingerprint, outputs):
+    """Manifest entry of a task that ran, with the content hashes of its outputs."""
+    return {'fingerprint': fingerprint, 'outputs': {path: file_fingerprint(path) for path in outputs}}
+
+def run_ticker_task(stage_name, ticker, inputs, config):
+    """
+    Run one per-ticker task; used as the process pool worker.
+
+    Args:
+        stage_name (str): Name of a stage of TICKER_STAGES
+        ticker (str): Ticker symbol
+        inputs (list): Input files of the task
+        config (PipelineConfig): Settings of the run
+
+    Returns:
+        tuple: (output files or None on failure, seconds, error message or None)
+    """
+    stage = next(stage for stage in TICKER_STAGES if stage.name == stage_name)
+    start = time.time()
+    try:
+        outputs = stage.run(ticker, inputs, config)
+    except Exception as e:
+        return None, time.time() - start, f"{type(e).__name__}: {e}"
+    return outputs, time.time() - start, None
+
+def _capm_input_paths(config):
+    """Stored CAPM betas and yields, which the dataset and finetune stages read if present."""
+    paths = [os.path.join(config.price_dir, name) for name in (BETAS_FILE, YIELDS_FILE)]
+    return [path for path in paths if os.path.exists(path)]
+
+def refresh_prices(tickers, config):
+    """
+    Fetch the trading days after the stored price data of every ticker.
+
+    Args:
+        tickers (list): Tickers to refresh
+        config (PipelineConfig): Settings of the run
+
+    Returns:
+        list: Tickers that could not be refreshed
+    """
+    from get_price_data import FileDataSource, YahooFinanceSource, get_price_data, load_market_context
+
+    source = FileDataSource(config.source_dir) if config.source_dir else YahooFinanceSource()
+    market = load_market_context(source)
+    return get_price_data(tickers, [], source=source, output_folder=config.price_dir, incremental=True,
+                          market=market, storage_format=config.format)
+
+def build_dataset(config):
+    """Run merge_tickers_data over the processed ticker tables."""
+    output = merge_tickers_data.main(
+        price_data_dir=config.price_dir,
+        storage_format=config.format,
+        float32=config.float32,
+        streaming=config.streaming,
+        ticker_threshold=config.ticker_threshold,
+        column_threshold=config.column_threshold,
+        data_dir=config.processed_dir,
+        output_dir=config.output_dir,
+    )
+    return [output, os.path.join(config.output_dir, merge_tickers_data.SUMMARY_FILE)]
+
+def finetune_model(config):
+    """Fine-tune the model of config.model on the dataset."""
+    # torch is only needed when a model is fine-tuned
+    from finetune_network import update_model
+
+    save_path = config.model_out or os.path.join(os.path.dirname(config.model), 'updated_' + os.path.basename(config.model))
+    update_model(find_table(config.output_dir, merge_tickers_data.PROCESSED_TABLE), config.model, save_path, config.price_dir)
+    return [save_path]
+
+def _dataset_inputs(config):
+    if not os.path.isdir(config.processed_dir):
+        return None
+    inputs = [find_table(config.processed_dir, name) for name in list_tables(config.processed_dir)]
+    return inputs + _capm_input_paths(config) if inputs else None
+
+def _finetune_inputs(config):
+    dataset = find_table(config.output_dir, merge_tickers_data.PROCESSED_TABLE)
+    if not config.model or dataset is None:
+        return None
+    return [dataset, config.model] + _capm_input_paths(config)
+
+TICKER_STAGES = [
+    TickerStage('fundamentals', ('format', 'float32'), _fundamentals_inputs, _fundamentals_run),
+    TickerStage('merge', ('format', 'float32'), _merge_inputs, _merge_run),
+    TickerStage('process', ('format', 'float32', 'rows_between'), _process_inputs, _process_run),
+]
+
+# A stage combining all tickers, run in the main process: the config fields that change
+# its result, the function listing its input files (None when it cannot run) and the
+# function running it and returning its output files
+GlobalStage = namedtuple('GlobalStage', ['name', 'params', 'inputs', 'run'])
+
+GLOBAL_STAGES = [
+    GlobalStage('dataset', ('format', 'float32', 'streaming', 'ticker_threshold', 'column_threshold'), _dataset_inputs, build_dataset),
+    GlobalStage('finetune', ('model_out',), _finetune_inputs, finetune_model),
+]
+
+STAGES = ['prices'] + [stage.name for stage in TICKER_STAGES] + [stage.name for stage in GLOBAL_STAGES]
+
+def run_pipeline(config, tickers=None, n_processes=None, force=()):
+    """
+    Run every stage of the pipeline, skipping tasks whose inputs did not change.
+
+    Args:
+        config (PipelineConfig): Settings of the run
+        tickers (list, optional): Tickers to process, defaults to the filtered mapping
+        n_processes (int, optional): Number of worker processes for the per-ticker stages
+        force (iterable): Stages whose tasks run even if they are up to date
+
+    Returns:
+        dict: Timing of each stage that ran: seconds plus the number of tasks run,
+            skipped and failed
+    """
+    if tickers is None:
+        tickers = merge_fundamental_data.load_filtered_mapping(config.mapping)
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+    force = set(force)
+    os.makedirs(config.output_dir, exist_ok=True)
+    manifest_path = os.path.join(config.output_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    timings = {}
+
+    if config.refresh_prices:
+        start = time.time()
+        missing = refresh_prices(tickers, config)
+        if missing:
+            print(f"Failed to refresh the prices of {len(missing)} tickers: {', '.join(missing)}")
+        timings['prices'] = {'seconds': time.time() - start, 'run': len(tickers) - len(missing),
+                             'skipped': 0, 'failed': len(missing)}
+
+    file_index = merge_fundamental_data.build_file_index(config.fundamental_input_dir)
+    # A ticker whose task failed is left out of the later stages of this run
+    failed = set()
+    pool = None
+    try:
+        for stage in TICKER_STAGES:
+            start = time.time()
+            params = {name: getattr(config, name) for name in stage.params}
+            tasks = []
+            skipped = 0
+            for ticker in tickers:
+                if ticker in failed:
+                    continue
+                inputs = stage.inputs(ticker, config, file_index)
+                if inputs is None:
+                    continue
+                key = f"{stage.name}/{ticker}"
+                fingerprint = task_fingerprint(stage.name, inputs, params)
+                if stage.name not in force and is_up_to_date(manifest, key, fingerprint):
+                    skipped += 1
+                else:
+                    tasks.append((key, ticker, inputs, fingerprint))
+
+            stage_failed = 0
+            if tasks:
+                if pool is None:
+                    pool = Pool(processes=n_processes)
+                results = pool.starmap(run_ticker_task, [(stage.name, ticker, inputs, config) for _, ticker, inputs, _ in tasks])
+                for (key, ticker, _, fingerprint), (outputs, _, error) in zip(tasks, results):
+                    if error is not None:
+                        print(f"{stage.name} failed for {ticker}: {error}")
+                        manifest['tasks'].pop(key, None)
+                        failed.add(ticker)
+                        stage_failed += 1
+                    else:
+                        manifest['tasks'][key] = _task_entry(fingerprint, outputs)
+
+            timings[stage.name] = {'seconds': time.time() - start, 'run': len(tasks) - stage_failed,
+                                   'skipped': skipped, 'failed': stage_failed}
+            save_manifest(manifest, manifest_path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Stages combining all tickers run in this process
+    for stage in GLOBAL_STAGES:
+        start = time.time()
+        inputs = stage.inputs(config)
+        if inputs is None:
+            continue
+        params = {name: getattr(config, name) for name in stage.params}
+        fingerprint = task_fingerprint(stage.name, inputs, params)
+        if stage.name not in force and is_up_to_date(manifest, stage.name, fingerprint):
+            timings[stage.name] = {'seconds': time.time() - start, 'run': 0, 'skipped': 1, 'failed': 0}
+            continue
+        try:
+            outputs = stage.run(config)
+        except Exception as e:
+            print(f"{stage.name} failed: {type(e).__name__}: {e}")
+            manifest['tasks'].pop(stage.name, None)
+            timings[stage.name] = {'seconds': time.time() - start, 'run': 0, 'skipped': 0, 'failed': 1}
+            break
+        manifest['tasks'][stage.name] = _task_entry(fingerprint, outputs)
+        timings[stage.name] = {'seconds': time.time() - start, 'run': 1, 'skipped': 0, 'failed': 0}
+
+    manifest['timings'] = timings
+    save_manifest(manifest, manifest_path)
+    return timings
+
+def print_timings(timings):
+    """Print the wall time and task counts of each stage."""
+    print(f"{'stage':<14}{'run':>6}{'skipped':>9}{'failed':>8}{'seconds':>10}")
+    for name in STAGES:
+        if name in timings:
+            timing = timings[name]
+            print(f"{name:<14}{timing['run']:>6}{timing['skipped']:>9}{timing['failed']:>8}{timing['seconds']:>10.2f}")
+
+if __name__ == "__main__":
+    defaults = PipelineConfig()
+    parser = argparse.ArgumentParser(description="Run the data preparation pipeline, skipping tasks whose inputs did not change.")
+    parser.add_argument("--mapping", default=defaults.mapping, help="Path of the filtered ticker mapping JSON file.")
+    parser.add_argument("--tickers", nargs="+", default=None, help="Tickers to process instead of the filtered mapping.")
+    parser.add_argument("--fundamental-input-dir", default=defaults.fundamental_input_dir, help="Folder with one subfolder of fundamental data files per category.")
+    parser.add_argument("--fundamental-dir", default=defaults.fundamental_dir, help="Folder of the merged fundamental tables.")
+    parser.add_argument("--price-dir", default=defaults.price_dir, help="Folder of the price data tables and CAPM inputs.")
+    parser.add_argument("--merged-dir", default=defaults.merged_dir, help="Folder of the merged ticker tables.")
+    parser.add_argument("--processed-dir", default=defaults.processed_dir, help="Folder of the processed ticker tables.")
+    parser.add_argument("--output-dir", default=defaults.output_dir, help="Folder of the dataset, its summary and the manifest.")
+    parser.add_argument("--format", choices=FORMATS, default=defaults.format, help="Storage format of the tables.")
+    parser.add_argument("--float32", action="store_true", help="Store the float columns of the tables after the price data as float32 in the columnar formats.")
+    parser.add_argument("--rows-between", type=int, default=defaults.rows_between, help="Number of rows to keep between consecutive rows with fundamental data.")
+    parser.add_argument("--streaming", action="store_true", help="Merge the processed tables one at a time to bound memory use.")
+    parser.add_argument("--ticker-threshold", type=float, default=defaults.ticker_threshold, help="Minimum ratio of non-zero, non-null values to keep a ticker.")
+    parser.add_argument("--column-threshold", type=float, default=defaults.column_threshold, help="Minimum ratio of non-zero, non-null values to keep a column.")
+    parser.add_argument("--refresh-prices", action="store_true", help="Fetch new trading days before processing.")
+    parser.add_argument("--source-dir", default=None, help="Read price history from tables in this folder instead of Yahoo Finance.")
+    parser.add_argument("--model", default=None, help="Checkpoint to fine-tune on the dataset; no fine-tuning if omitted.")
+    parser.add_argument("--model-out", default=None, help="Path of the fine-tuned checkpoint, by default next to --model with an 'updated_' prefix.")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--force", nargs="*", choices=STAGES, default=None, help="Re-run the given stages, or all stages if none are given, even if up to date.")
+    args = parser.parse_args()
+
+    config = PipelineConfig(
+        mapping=args.mapping,
+        fundamental_input_dir=args.fundamental_input_dir,
+        fundamental_dir=args.fundamental_dir,
+        price_dir=args.price_dir,
+        merged_dir=args.merged_dir,
+        processed_dir=args.processed_dir,
+        output_dir=args.output_dir,
+        format=args.format,
+        float32=args.float32,
+        rows_between=args.rows_between,
+        streaming=args.streaming,
+        ticker_threshold=args.ticker_threshold,
+        column_threshold=args.column_threshold,
+        refresh_prices=args.refresh_prices,
+        source_dir=args.source_dir,
+        model=args.model,
+        model_out=args.model_out,
+    )
+    force = STAGES if args.force == [] else (args.force or ())
+    start = time.time()
+    timings = run_pipeline(config, args.tickers, args.processes, force)
+    print_timings(timings)
+    print(f"Pipeline finished in {time.time() - start:.1f}s")
@@ -19,10 +19,12 @@ const fs = require("fs");
 const path = require("path");
 const cors = require("cors");
 const jwt = require("jsonwebtoken");
-const { spawnSync, execSync } = require("child_process");
+const { spawn, execSync } = require("child_process");
 const axios = require('axios');
 const app = express();
 const PORT = 3001;
+const OPTIMIZER_PORT = 5001;
+const OPTIMIZER_URL = `http://127.0.0.1:${OPTIMIZER_PORT}`;
 const { parse } = require("json2csv");
 
 /**
@@ -150,7 +152,7 @@ const writeCSV2 = (filePath, header, data) => {
 
 /**
  * Sets up and verifies Python environment for portfolio optimization
- * Checks Python version and installs required packages
+ * Checks Python version and installs the packages of requirements.txt, if present
  * @throws {Error} If Python environment setup fails
  */
 function ensurePythonEnvironment() {
@@ -159,10 +161,16 @@ function ensurePythonEnvironment() {
     const pythonVersion = execSync("python3 --version").toString().trim();
     console.log(`Python version detected: ${pythonVersion}`);
 
+    const requirementsPath = path.join(__dirname, "requirements.txt");
+    if (!fs.existsSync(requirementsPath)) {
+      console.log(`No ${requirementsPath}, skipping the Python dependency installation.`);
+      return;
+    }
+
     // Install required packages using pip
     console.log("Ensuring Python dependencies are installed...");
     execSync("python3 -m pip install --upgrade pip", { stdio: "inherit" });
-    execSync("python3 -m pip install -r requirements.txt", {
+    execSync(`python3 -m pip install -r "${requirementsPath}"`, {
       stdio: "inherit",
     });
     console.log("Python environment setup complete.");
@@ -175,37 +183,103 @@ function ensurePythonEnvironment() {
 }
 
 /**
- * Calls external Python script to generate optimized investment portfolio
+ * Starts the long-lived Python optimization service (optimization_service.py)
+ * The service keeps the predictions, covariance matrix and a process pool warm
+ * between requests. If it exits on its own it is restarted with exponential
+ * backoff, up to OPTIMIZER_MAX_RESTARTS consecutive times; it is not restarted
+ * after stopOptimizationService or when it was interrupted or terminated
+ */
+const OPTIMIZER_MAX_RESTARTS = 5;
+const OPTIMIZER_RESTART_DELAY_MS = 1000;
+// A service that ran this long before exiting resets the restart count
+const OPTIMIZER_STABLE_MS = 60000;
+
+let optimizerProcess = null;
+let optimizerRestarts = 0;
+let optimizerStopped = false;
+
+function startOptimizationService() {
+  if (optimizerStopped) {
+    return;
+  }
+  const startedAt = Date.now();
+  const child = spawn(
+    "python3",
+    ["optimization_service.py", "--port", OPTIMIZER_PORT.toString()],
+    { cwd: __dirname, stdio: "inherit" }
+  );
+  optimizerProcess = child;
+
+  child.on("error", (error) => {
+    console.error("Failed to start optimization service:", error.message);
+  });
+
+  child.on("exit", (code, signal) => {
+    optimizerProcess = null;
+    if (optimizerStopped || signal === "SIGINT" || signal === "SIGTERM") {
+      console.log(`Optimization service stopped (code ${code}, signal ${signal})`);
+      return;
+    }
+    if (Date.now() - startedAt >= OPTIMIZER_STABLE_MS) {
+      optimizerRestarts = 0;
+    }
+    if (optimizerRestarts >= OPTIMIZER_MAX_RESTARTS) {
+      console.error(
+        `Optimization service exited (code ${code}, signal ${signal}), giving up after ${optimizerRestarts} restarts`
+      );
+      optimizerStopped = true;
+      return;
+    }
+    const delay = OPTIMIZER_RESTART_DELAY_MS * 2 ** optimizerRestarts;
+    optimizerRestarts += 1;
+    console.error(
+      `Optimization service exited (code ${code}, signal ${signal}), restarting in ${delay} ms ` +
+        `(attempt ${optimizerRestarts} of ${OPTIMIZER_MAX_RESTARTS})...`
+    );
+    setTimeout(startOptimizationService, delay);
+  });
+}
+
+/**
+ * Stops the optimization service for good
+ * SIGINT lets the service shut down its worker pool and shared memory
+ */
+function stopOptimizationService() {
+  optimizerStopped = true;
+  if (optimizerProcess) {
+    optimizerProcess.kill("SIGINT");
+    optimizerProcess = null;
+  }
+}
+
+/**
+ * Requests an optimized investment portfolio from the Python optimization service
+ * Retries while the service is still starting up
  * @param {number} lambda - Risk tolerance parameter
  * @param {number} horizon - Investment time horizon
  * @param {number} size - Number of assets in the portfolio
- * @returns {Object} Portfolio with selected assets and optimal weights
+ * @returns {Promise<Object>} Portfolio with selected assets and optimal weights
  */
-function getPortfolio(lambda, horizon, size) {
-  try {
-    ensurePythonEnvironment();
-    // Spawn a Python process to execute the script
-    const pythonProcess = spawnSync("python3", [
-      "portfolio_construction.py", // Path to your Python script
-      lambda.toString(),
-      horizon.toString(),
-      size.toString(),
-    ]);
-
-    // Check for errors during script execution
-    if (pythonProcess.error) {
-      throw new Error(
-        `Python script execution failed: ${pythonProcess.error.message}`
-      );
+async function getPortfolio(lambda, horizon, size) {
+  const maxAttempts = 30;
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const response = await axios.post(`${OPTIMIZER_URL}/optimize`, {
+        lambda_val: Number(lambda),
+        investment_horizon: Number(horizon),
+        portfolio_size: Number(size),
+      });
+      return response.data; // Return the portfolio as a JSON object
+    } catch (error) {
+      if (error.code === "ECONNREFUSED" && !optimizerStopped && attempt < maxAttempts) {
+        // Service is not listening yet
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        continue;
+      }
+      const message = error.response?.data?.error || error.message;
+      console.error("Error in getPortfolio:", message);
+      throw new Error(`Portfolio optimization failed: ${message}`);
     }
-
-    // Capture and parse the script's output
-    const output = pythonProcess.stdout.toString();
-    const portfolio = JSON.parse(output);
-    return portfolio; // Return the portfolio as a JSON object
-  } catch (error) {
-    console.error("Error in getPortfolio:", error.message);
-    throw error; // Rethrow the error for the caller to handle
   }
 }
 
@@ -328,9 +402,9 @@ app.get("/get-email", (req, res) => {
 /**
  * Generate portfolio based on user preferences
  * @param {Array} preferences - User preference data
- * @returns {Object} Generated portfolio information
+ * @returns {Promise<Object>} Generated portfolio information
  */
-function generatePortfolio(preferences) {
+async function generatePortfolio(preferences) {
   console.log(preferences)
   const email = preferences[0];
   const horizon = preferences[preferences.length - 3];
@@ -346,7 +420,7 @@ function generatePortfolio(preferences) {
     `Lambda: ${lambda}, Horizon: ${horizon}, Portfolio Size: ${size}`
   );
 
-  let portfolio = getPortfolio(lambda, horizon, size);
+  let portfolio = await getPortfolio(lambda, horizon, size);
   // Save the portfolio in the portfolios.json file
   savePortfolio(email, portfolio);
   return { email, score, lambda };
@@ -670,7 +744,7 @@ app.post("/save-preferences", authenticateToken, async (req, res) => {
     writeCSV(preferencesFile, updatedPreferences, false);
 
     // Generate portfolio
-    const portfolio = getPortfolio(
+    const portfolio = await getPortfolio(
       1 + 0.142857 * (sanitizedRow.slice(1, sanitizedRow.length - 3).reduce((sum, value) => +sum + +value, 0) - 7),
       sanitizedRow[sanitizedRow.length - 3],
       sanitizedRow[sanitizedRow.length - 1]
@@ -867,6 +941,24 @@ app.get("/user-preferences", authenticateToken, (req, res) => {
   }
 });
 
+// Set up the Python environment once and start the optimization service; a failed
+// setup is logged and the service reports missing dependencies when it starts
+try {
+  ensurePythonEnvironment();
+} catch (error) {
+  console.error(error.message);
+}
+startOptimizationService();
+
+// Stop the optimization service with the server
+process.on("exit", stopOptimizationService);
+for (const signal of ["SIGINT", "SIGTERM"]) {
+  process.on(signal, () => {
+    stopOptimizationService();
+    process.exit(0);
+  });
+}
+
 // Start the server
 app.listen(PORT, () => {
   console.log(`Server is running on http://localhost:${PORT}`);
@@ -0,0 +1,111 @@
+"""
+Parity tests of the panel beta engine against the original per-ticker OLS regressions,
+and tests of the incremental price download.
+
+data/get_price_data/interval_betas.csv holds the betas the original
+statsmodels regressions estimate for the sample price data against the
+index built by make_index.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from get_price_data import (
+    RateLimiter,
+    compute_intervals_betas,
+    compute_panel_betas,
+    fetch_price_update,
+    intervals as INTERVALS,
+)
+from pipeline_storage import list_tables, read_table, write_table
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRICE_DATA_DIR = os.path.join(BACKEND_DIR, 'price_data')
+EXPECTED_PATH = os.path.join(BACKEND_DIR, 'tests', 'data', 'get_price_data', 'interval_betas.csv')
+
+def load_sample_closes():
+    """Close prices of the sample tickers, one column per ticker on the union of their dates."""
+    closes = {}
+    for name in list_tables(PRICE_DATA_DIR, '_price_data'):
+        df = read_table(PRICE_DATA_DIR, name, columns=['Date', 'Close'])
+        closes[name[:-len('_price_data')]] = df.set_index('Date')['Close']
+    return pd.DataFrame(closes).astype(float).sort_index()
+
+def make_index(closes):
+    """An equal-weighted index of the sample tickers, with some dates missing."""
+    index_returns = closes.pct_change(fill_method=None).mean(axis=1).fillna(0.0)
+    index_close = 100 * (1 + index_returns).cumprod()
+    # Dates missing from the index drop out of every regression
+    index_close = index_close[np.arange(len(index_close)) % 37 != 5]
+    return index_close.rename('Close').rename_axis('Date').reset_index()
+
+@pytest.fixture(scope='module')
+def sample_closes():
+    return load_sample_closes()
+
+@pytest.fixture(scope='module')
+def expected_betas():
+    return pd.read_csv(EXPECTED_PATH, index_col='interval')
+
+def test_panel_betas_match_original_regressions(sample_closes, expected_betas):
+    betas = compute_panel_betas(sample_closes, make_index(sample_closes), INTERVALS)
+
+    assert list(betas.index) == list(expected_betas.index)
+    pd.testing.assert_frame_equal(betas[expected_betas.columns], expected_betas, check_names=False,
+                                  rtol=1e-9, atol=1e-12)
+
+def test_ticker_betas_match_original_regressions(sample_closes, expected_betas):
+    hist_sp500 = make_index(sample_closes)
+    for ticker in ['CEG', 'KVUE', 'UBER']:
+        df = sample_closes[ticker].dropna().rename('Close').rename_axis('Date').reset_index()
+        betas = compute_intervals_betas(df, hist_sp500, INTERVALS)
+        np.testing.assert_allclose([betas[n] for n in INTERVALS], expected_betas[ticker], rtol=1e-9, atol=1e-12)
+
+class CountingRateLimiter(RateLimiter):
+    """Rate limiter without a limit that counts its acquisitions."""
+
+    def __init__(self):
+        super().__init__(None)
+        self.calls = 0
+
+    def acquire(self):
+        self.calls += 1
+        super().acquire()
+
+class AdjustedSource:
+    """Source whose prices were adjusted after the stored data was saved; the first full download fails."""
+
+    def __init__(self, history):
+        self.history_df = history
+        self.full_attempts = 0
+
+    def history(self, ticker, start=None):
+        if start is None:
+            self.full_attempts += 1
+            if self.full_attempts == 1:
+                raise ConnectionError("rate limited")
+            return self.history_df.copy()
+        return self.history_df[self.history_df['Date'] >= pd.Timestamp(start)].copy()
+
+def test_full_history_refetch_goes_through_limiter_and_retries(tmp_path):
+    dates = pd.bdate_range('2024-01-01', periods=30)
+    history = pd.DataFrame({'Date': dates, 'Close': np.linspace(100.0, 130.0, len(dates))})
+    stored = history.iloc[:20].assign(Close=history['Close'].iloc[:20] * 1.1)
+    write_table(stored, str(tmp_path), 'TEST_price_data')
+
+    source = AdjustedSource(history)
+    rate_limiter = CountingRateLimiter()
+    previous, df_price = fetch_price_update('TEST', source, str(tmp_path), rate_limiter, retries=1, backoff=0.0)
+
+    assert previous is None
+    assert pd.to_datetime(df_price['Date']).tolist() == dates.tolist()
+    np.testing.assert_array_equal(df_price['Close'], history['Close'])
+    # The update download, then the failed and the retried full download
+    assert source.full_attempts == 2
+    assert rate_limiter.calls == 3
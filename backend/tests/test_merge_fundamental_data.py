@@ -0,0 +1,82 @@
+"""
+Parity tests of merge_fundamental_data against the original chain of outer merges.
+
+The fundamental data files are rebuilt from the sample data in
+Processed_Ticker_Data: the quarter-end rows of each ticker are split into one
+file per category, each missing some dates. The expected tables in
+data/merge_fundamental_data were written by the original merge loop from
+these files, taken in sorted order.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from merge_fundamental_data import build_file_index, merge_fundamental_files, process_ticker
+from pipeline_storage import read_table
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'Processed_Ticker_Data')
+EXPECTED_DIR = os.path.join(BACKEND_DIR, 'tests', 'data', 'merge_fundamental_data')
+
+CATEGORIES = ['balance_sheet', 'cash_flow', 'income_statement', 'financial_ratios']
+# CEG joins on a unique Date index; a repeated date sends KVUE through pd.merge
+SAMPLE_TICKERS = ['CEG', 'KVUE']
+
+def write_category_files(fundamental_data_dir, ticker):
+    """Split the quarterly fundamental data of a sample ticker into one file per category."""
+    processed = pd.read_csv(os.path.join(PROCESSED_DATA_DIR, f'{ticker}_merged_data.csv'))
+    processed = processed[pd.to_datetime(processed['Date']).dt.is_quarter_end].reset_index(drop=True)
+    columns = processed.columns[processed.columns.get_loc('Cash On Hand'):]
+    for i, category in enumerate(CATEGORIES):
+        data = processed[['Date'] + list(columns[i::len(CATEGORIES)])]
+        data = data[data.index % (i + 3) != 1]
+        if i == 0:
+            # Records before 2009 are dropped
+            data = pd.concat([data.iloc[:1].assign(Date='2008-12-31'), data])
+        if i == 3 and ticker == 'KVUE':
+            data = pd.concat([data, data.iloc[-1:]])
+        folder = os.path.join(fundamental_data_dir, category)
+        os.makedirs(folder, exist_ok=True)
+        data.to_csv(os.path.join(folder, f'{ticker}_{category}.csv'), index=False)
+
+@pytest.fixture(scope='module')
+def fundamental_data_dir(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('Fundamental_data'))
+    for ticker in SAMPLE_TICKERS:
+        write_category_files(folder, ticker)
+    return folder
+
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_merge_matches_original_output(fundamental_data_dir, ticker):
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, f'{ticker}_fundamental_data.parquet'))
+    file_paths = sorted(build_file_index(fundamental_data_dir)[ticker])
+
+    pd.testing.assert_frame_equal(merge_fundamental_files(file_paths), expected)
+
+def test_process_ticker_writes_original_output(fundamental_data_dir, tmp_path):
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, 'CEG_fundamental_data.parquet'))
+    file_paths = sorted(build_file_index(fundamental_data_dir)['CEG'])
+    process_ticker('CEG', file_paths, str(tmp_path), 'parquet')
+
+    pd.testing.assert_frame_equal(read_table(str(tmp_path), 'CEG_fundamental_data'), expected)
+
+def test_file_index_matches_original_prefix_search(tmp_path):
+    names = ['FOX_income.csv', 'FOXA_income.csv', 'BF.B_income.csv', 'BF_B_income.csv', 'FOX_notes.txt']
+    for folder in ['income', 'cash_flow', 'market_cap_updated']:
+        os.makedirs(tmp_path / folder)
+        for name in names:
+            (tmp_path / folder / name).write_text('Date\n')
+
+    file_index = build_file_index(str(tmp_path))
+    for ticker in ['FOX', 'FOXA', 'BF.B', 'BF']:
+        expected = [
+            os.path.join(str(tmp_path), folder, name)
+            for folder in ['income', 'cash_flow'] for name in names
+            if name.startswith(f'{ticker}_') and name.endswith('.csv')
+        ]
+        assert sorted(file_index[ticker]) == sorted(expected)
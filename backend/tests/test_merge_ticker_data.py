@@ -0,0 +1,52 @@
+"""
+Parity tests of merge_ticker_data against the output of the original iterrows merge.
+
+The expected tables in data/merge_ticker_data were written by the original
+implementation from the sample price data and quarterly fundamental data rebuilt from
+the sample data in Processed_Ticker_Data.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from merge_ticker_data import load_and_prepare_data, merge_ticker_data, process_ticker
+from pipeline_storage import read_table, write_table
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRICE_DATA_DIR = os.path.join(BACKEND_DIR, 'price_data')
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'Processed_Ticker_Data')
+EXPECTED_DIR = os.path.join(BACKEND_DIR, 'tests', 'data', 'merge_ticker_data')
+
+# Both have reports before their first price date and on weekends, without prices
+SAMPLE_TICKERS = ['CEG', 'KVUE']
+
+@pytest.fixture(scope='module')
+def fundamental_data_dir(tmp_path_factory):
+    """Fundamental data of the sample tickers: the quarter-end rows of their processed tables."""
+    folder = str(tmp_path_factory.mktemp('fundamental_data'))
+    for ticker in SAMPLE_TICKERS:
+        processed = pd.read_csv(os.path.join(PROCESSED_DATA_DIR, f'{ticker}_merged_data.csv'))
+        fundamental_columns = ['Date'] + list(processed.columns[processed.columns.get_loc('Cash On Hand'):])
+        fundamental_df = processed[fundamental_columns]
+        fundamental_df = fundamental_df[pd.to_datetime(fundamental_df['Date']).dt.is_quarter_end]
+        write_table(fundamental_df, folder, f'{ticker}_fundamental_data', 'csv')
+    return folder
+
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_merge_matches_original_output(fundamental_data_dir, ticker):
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, f'{ticker}_merged_data.parquet'))
+    price_df, fundamental_df = load_and_prepare_data(PRICE_DATA_DIR, fundamental_data_dir, ticker)
+
+    pd.testing.assert_frame_equal(merge_ticker_data(price_df, fundamental_df), expected)
+
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_process_ticker_writes_original_output(fundamental_data_dir, tmp_path, ticker):
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, f'{ticker}_merged_data.parquet'))
+    process_ticker(ticker, PRICE_DATA_DIR, fundamental_data_dir, str(tmp_path), 'parquet')
+
+    pd.testing.assert_frame_equal(read_table(str(tmp_path), f'{ticker}_merged_data'), expected)
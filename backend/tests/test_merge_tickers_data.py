@@ -0,0 +1,107 @@
+"""
+Parity tests of merge_tickers_data against the output of the original implementation.
+
+The inputs are seven tickers of the sample data in Processed_Ticker_Data, four
+of which fail the ticker filter. The expected merged table, the tickers and
+columns the original filters kept, and the original summary in
+data/merge_tickers_data were written by the original implementation from
+these tables, taken in sorted order.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from merge_tickers_data import (
+    PROCESSED_TABLE,
+    SUMMARY_FILE,
+    bad_cell_mask,
+    create_missing_zero_summary,
+    filter_columns_by_data_quality,
+    filter_tickers_by_data_quality,
+    load_merged_table,
+    main,
+    merge_csv_files,
+    merge_csv_files_streaming,
+)
+from pipeline_storage import read_table
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSED_DATA_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'Processed_Ticker_Data')
+EXPECTED_DIR = os.path.join(BACKEND_DIR, 'tests', 'data', 'merge_tickers_data')
+
+SAMPLE_TICKERS = ['BF.B', 'CEG', 'GEHC', 'GEV', 'KVUE', 'SW', 'VLTO']
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('Processed_Ticker_Data')
+    for ticker in SAMPLE_TICKERS:
+        shutil.copy(os.path.join(PROCESSED_DATA_DIR, f'{ticker}_merged_data.csv'), folder)
+    return str(folder)
+
+@pytest.fixture(scope='module')
+def expected_merged():
+    return pd.read_parquet(os.path.join(EXPECTED_DIR, 'merged_ticker_data.parquet'))
+
+@pytest.fixture(scope='module')
+def expected_processed(expected_merged):
+    with open(os.path.join(EXPECTED_DIR, 'processed_data.json')) as f:
+        kept = json.load(f)
+    rows = expected_merged['ticker'].isin(kept['tickers'])
+    return expected_merged.loc[rows, kept['columns']].reset_index(drop=True)
+
+@pytest.fixture(scope='module')
+def expected_summary():
+    return pd.read_csv(os.path.join(EXPECTED_DIR, SUMMARY_FILE))
+
+def as_streamed(df, ticker_dtype):
+    """The original table with the types of the streaming mode: float data columns and a categorical ticker."""
+    float_columns = [col for col in df.columns if df[col].dtype.kind in 'if' and col != 'time_idx']
+    return df.astype({col: np.float64 for col in float_columns}).astype({'ticker': ticker_dtype})
+
+def test_merge_matches_original_output(data_dir, expected_merged):
+    pd.testing.assert_frame_equal(merge_csv_files(data_dir), expected_merged)
+
+def test_streaming_merge_matches_original_output(data_dir, expected_merged, tmp_path):
+    merge_csv_files_streaming(data_dir, str(tmp_path), storage_format='parquet')
+    merged = load_merged_table(str(tmp_path))
+
+    assert list(merged['ticker'].cat.categories) == SAMPLE_TICKERS
+    pd.testing.assert_frame_equal(merged, as_streamed(expected_merged, merged['ticker'].dtype))
+
+@pytest.mark.parametrize('storage_format', ['parquet', 'csv'])
+def test_streaming_main_matches_original_output(data_dir, expected_processed, expected_summary, tmp_path,
+                                                storage_format):
+    main(price_data_dir=str(tmp_path), storage_format=storage_format, streaming=True, data_dir=data_dir,
+         output_dir=str(tmp_path))
+    processed = read_table(str(tmp_path), PROCESSED_TABLE)
+    if storage_format == 'csv':
+        # CSV does not keep the categorical dtype
+        processed['ticker'] = processed['ticker'].astype('category')
+
+    pd.testing.assert_frame_equal(processed, as_streamed(expected_processed, processed['ticker'].dtype))
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(str(tmp_path), SUMMARY_FILE)), expected_summary)
+
+@pytest.mark.parametrize('shared_mask', [False, True])
+def test_filters_and_summary_match_original_output(expected_merged, expected_processed, expected_summary,
+                                                   shared_mask):
+    bad_cells = bad_cell_mask(expected_merged) if shared_mask else None
+    processed = filter_tickers_by_data_quality(expected_merged, bad_cells=bad_cells)
+    processed = filter_columns_by_data_quality(processed, bad_cells=bad_cells)
+    summary = create_missing_zero_summary(processed, bad_cells)
+
+    pd.testing.assert_frame_equal(processed.reset_index(drop=True), expected_processed)
+    pd.testing.assert_frame_equal(summary, expected_summary)
+
+def test_main_matches_original_output(data_dir, expected_processed, expected_summary, tmp_path):
+    main(price_data_dir=str(tmp_path), storage_format='parquet', data_dir=data_dir, output_dir=str(tmp_path))
+
+    pd.testing.assert_frame_equal(read_table(str(tmp_path), PROCESSED_TABLE), expected_processed)
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(str(tmp_path), SUMMARY_FILE)), expected_summary)
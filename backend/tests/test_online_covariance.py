@@ -0,0 +1,43 @@
+"""
+Tests that the online covariances match a full recompute of get_price_data.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from get_price_data import COV_MONTHS, compute_monthly_covs, custom_fill
+from online_covariance import update_covariances
+
+def make_prices(n_days=1000, n_tickers=6, seed=2):
+    """Daily prices with a late listing and gaps, filled as get_price_data fills them."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-02', periods=n_days)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_tickers)), axis=0))
+    prices_df = pd.DataFrame(prices, index=dates, columns=[f'T{i}' for i in range(n_tickers)])
+    prices_df.iloc[:300, 0] = np.nan
+    prices_df[rng.random(prices_df.shape) < 0.02] = np.nan
+    return custom_fill(prices_df)
+
+@pytest.mark.parametrize('return_type', ['simple', 'log'])
+def test_accumulated_covariances_match_recompute(return_type):
+    prices_df = make_prices()
+    covs = update_covariances(prices_df, COV_MONTHS, return_type)
+    expected = compute_monthly_covs(prices_df, COV_MONTHS, return_type)
+    for months in COV_MONTHS:
+        pd.testing.assert_frame_equal(covs[months], expected[months], rtol=1e-9, atol=1e-13)
+
+def test_incremental_covariances_match_recompute(tmp_path):
+    prices_df = make_prices()
+    state_dir = str(tmp_path)
+    update_covariances(prices_df.iloc[:600], COV_MONTHS, state_dir=state_dir)
+
+    # Later runs pass only the recent prices, which cover the periods still open
+    for end in (601, 640, 700, 850, len(prices_df)):
+        covs = update_covariances(prices_df.iloc[end - 300:end], COV_MONTHS, state_dir=state_dir)
+        expected = compute_monthly_covs(prices_df.iloc[:end], COV_MONTHS)
+        for months in COV_MONTHS:
+            pd.testing.assert_frame_equal(covs[months], expected[months], rtol=1e-9, atol=1e-13)
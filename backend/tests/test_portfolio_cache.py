@@ -0,0 +1,44 @@
+"""
+Tests for the keys and data versions of the portfolio result cache.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+from portfolio_cache import PortfolioCache, cache_key, data_version
+
+def test_cache_key_rounds_lambda_and_separates_settings():
+    key = cache_key(2.0, 3, 8, 'v1', solver='slsqp')
+
+    # Float noise in lambda and numeric types of the sizes do not split entries
+    assert cache_key(2.0 + 1e-9, 3.0, 8, 'v1', solver='slsqp') == key
+    assert cache_key(2.0, 3, 8, 'v1', solver='slsqp', scan='pool') == \
+        cache_key(2.0, 3, 8, 'v1', scan='pool', solver='slsqp')
+
+    assert cache_key(2.0 + 1e-3, 3, 8, 'v1', solver='slsqp') != key
+    assert cache_key(2.0, 4, 8, 'v1', solver='slsqp') != key
+    assert cache_key(2.0, 3, 9, 'v1', solver='slsqp') != key
+    assert cache_key(2.0, 3, 8, 'v2', solver='slsqp') != key
+    assert cache_key(2.0, 3, 8, 'v1', solver='active_set') != key
+
+def test_data_version_follows_file_contents(tmp_path):
+    path = tmp_path / 'latest_predictions.csv'
+    path.write_text('ticker,return_3m\nA,0.1\n')
+    version = data_version([str(path)])
+    assert data_version([str(path)]) == version
+
+    path.write_text('ticker,return_3m\nA,0.2\n')
+    assert data_version([str(path)]) != version
+
+def test_cache_evicts_least_recently_used_and_other_versions(tmp_path):
+    cache = PortfolioCache(str(tmp_path), max_entries=2)
+    cache.put('a', {'value': 1}, 'v1')
+    cache.put('b', {'value': 2}, 'v1')
+    assert cache.get('a', 'v1') == {'value': 1}
+
+    cache.put('c', {'value': 3}, 'v1')
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') == {'value': 1}
+
+    assert cache.get('c', 'v2') is None
+    assert cache.get('c', 'v1') is None
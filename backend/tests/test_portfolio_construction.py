@@ -0,0 +1,115 @@
+"""
+Regression tests for the greedy portfolio optimizer and its solvers.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_construction import (
+    SCANS,
+    SOLVERS,
+    _break_ties,
+    candidate_solver,
+    load_cov_matrix,
+    optimize_portfolio_rolling_parallel,
+    prediction_tickers,
+    run_greedy_rounds,
+    solve_mean_variance_qp,
+    solve_mean_variance_qp_batch,
+)
+
+HORIZON = 3
+LAMBDA = 2.0
+PORTFOLIO_SIZE = 8
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_problem(n_assets=16, seed=0):
+    """Predictions and a factor covariance matrix of a small synthetic universe."""
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(size=(n_assets, 3))
+    cov_matrix = 0.01 * factors @ factors.T + np.diag(rng.uniform(0.01, 0.04, n_assets))
+    predictions = pd.DataFrame({
+        'ticker': [f'T{i}' for i in range(n_assets)],
+        f'return_{HORIZON}m': rng.normal(0.03, 0.05, n_assets),
+    })
+    return predictions, cov_matrix
+
+@pytest.fixture(scope='module')
+def reference_trace():
+    predictions, cov_matrix = make_problem()
+    return run_greedy_rounds(PORTFOLIO_SIZE, LAMBDA, predictions, cov_matrix, HORIZON,
+                             n_processes=2, solver='slsqp', scan='pool')
+
+@pytest.mark.parametrize('scan', SCANS)
+@pytest.mark.parametrize('solver', SOLVERS)
+def test_scans_and_solvers_select_the_same_portfolio(reference_trace, solver, scan):
+    predictions, cov_matrix = make_problem()
+    trace = run_greedy_rounds(PORTFOLIO_SIZE, LAMBDA, predictions, cov_matrix, HORIZON,
+                              n_processes=2, solver=solver, scan=scan, verify=scan != 'pool')
+
+    assert len(trace['all_selected_assets']) == PORTFOLIO_SIZE
+    assert trace['all_selected_assets'] == reference_trace['all_selected_assets']
+    for weights, expected in zip(trace['all_weights'], reference_trace['all_weights']):
+        np.testing.assert_allclose(weights, expected, atol=1e-5)
+    np.testing.assert_allclose(trace['all_objective_values'], reference_trace['all_objective_values'], atol=1e-8)
+
+def test_batch_solver_matches_single_solves():
+    rng = np.random.default_rng(1)
+    n_problems, n_assets = 20, 8
+    factors = rng.normal(size=(n_problems, n_assets, 2))
+    cov_matrices = 0.01 * factors @ factors.transpose(0, 2, 1) + 0.02 * np.eye(n_assets)
+    mu = rng.normal(0.03, 0.05, (n_problems, n_assets))
+
+    for bounds in ([(0.0, 1.0)] * n_assets, [(0.02, 0.15)] * n_assets):
+        batch = solve_mean_variance_qp_batch(mu, cov_matrices, LAMBDA, bounds)
+        assert batch.success.all()
+        for i in range(n_problems):
+            single = solve_mean_variance_qp(mu[i], cov_matrices[i], LAMBDA, bounds)
+            np.testing.assert_allclose(batch.x[i], single.x, atol=1e-10)
+            assert batch.fun[i] == pytest.approx(single.fun, abs=1e-12)
+
+def test_ties_are_broken_by_marginal_utility():
+    predictions, cov_matrix = make_problem()
+    mu = predictions[f'return_{HORIZON}m'].to_numpy()
+    selected = np.array([0, 1])
+    selected_weights = np.array([0.6, 0.4])
+    candidates = np.array([4, 3, 2])
+    marginal_utility = mu[candidates] - LAMBDA * cov_matrix[np.ix_(candidates, selected)] @ selected_weights
+
+    values = np.array([-0.1, -0.1, -0.1])
+    position = _break_ties(values, candidates, selected, selected_weights, mu, cov_matrix, LAMBDA)
+    assert position == np.argmax(marginal_utility) == 2
+
+    # A strictly better objective wins regardless, and without weights ties keep candidate order
+    values[0] -= 1e-6
+    assert _break_ties(values, candidates, selected, selected_weights, mu, cov_matrix, LAMBDA) == 0
+    assert _break_ties(np.full(3, -0.1), candidates, selected, None, mu, cov_matrix, LAMBDA) == 0
+
+@pytest.mark.parametrize('lambda_val', [1.0, 3.0])
+def test_sample_data_selection_is_not_universe_order(lambda_val):
+    predictions = pd.read_csv(os.path.join(DATA_DIR, 'latest_predictions.csv'))
+    tickers = prediction_tickers(predictions)
+    cov_matrix = load_cov_matrix(12, tickers, DATA_DIR)
+
+    result = optimize_portfolio_rolling_parallel(20, lambda_val, predictions, cov_matrix, 12, scan='batched')
+    selected = result['selected_assets']
+
+    # Ties at zero weight used to be won by the next tickers in alphabetical order
+    remaining = [ticker for ticker in tickers if ticker != selected[0]]
+    assert selected[1:4] != remaining[:3]
+    assert result['optimal_value'] < -0.9
+
+def test_candidate_solver_names_the_solver_that_scores_candidates():
+    # The batched scan scores every candidate with the active-set QP
+    assert candidate_solver('slsqp', 'batched') == 'active_set'
+    assert candidate_solver('active_set', 'batched') == 'active_set'
+    for scan in ('pool', 'lazy'):
+        for solver in SOLVERS:
+            assert candidate_solver(solver, scan) == solver
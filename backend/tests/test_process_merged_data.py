@@ -0,0 +1,56 @@
+"""
+Parity tests of process_merged_data against the output of the original loops.
+
+The inputs are the merged sample tables of data/merge_ticker_data; the expected
+tables in data/process_merged_data, and the rows the original standardization
+keeps in standardized_rows.json, were written by the original implementation
+from them.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from pipeline_storage import read_table
+from process_merged_data import START_COLUMN, process_dataframe, process_table, standardize_intervals
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+MERGED_DIR = os.path.join(DATA_DIR, 'merge_ticker_data')
+EXPECTED_DIR = os.path.join(DATA_DIR, 'process_merged_data')
+
+SAMPLE_TICKERS = ['CEG', 'KVUE']
+
+def load_merged(ticker):
+    """Merged sample table of a ticker and its target columns."""
+    df = pd.read_parquet(os.path.join(MERGED_DIR, f'{ticker}_merged_data.parquet'))
+    return df, df.columns[df.columns.get_loc(START_COLUMN):].tolist()
+
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_distributed_values_match_original_output(ticker):
+    df, target_columns = load_merged(ticker)
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, f'{ticker}_processed_data.parquet'))
+
+    standardized = standardize_intervals(df, target_columns)
+    pd.testing.assert_frame_equal(process_dataframe(standardized, target_columns), expected)
+
+@pytest.mark.parametrize('rows_between', [5, 30])
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_standardized_rows_match_original_output(ticker, rows_between):
+    df, target_columns = load_merged(ticker)
+    with open(os.path.join(EXPECTED_DIR, 'standardized_rows.json')) as f:
+        rows = json.load(f)[ticker][str(rows_between)]
+
+    expected = df.loc[rows].reset_index(drop=True)
+    pd.testing.assert_frame_equal(standardize_intervals(df, target_columns, rows_between), expected)
+
+@pytest.mark.parametrize('ticker', SAMPLE_TICKERS)
+def test_process_table_writes_original_output(tmp_path, ticker):
+    expected = pd.read_parquet(os.path.join(EXPECTED_DIR, f'{ticker}_processed_data.parquet'))
+    process_table(MERGED_DIR, f'{ticker}_merged_data', str(tmp_path), 'parquet')
+
+    pd.testing.assert_frame_equal(read_table(str(tmp_path), f'{ticker}_merged_data'), expected)